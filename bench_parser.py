@@ -0,0 +1,63 @@
+"""
+指令解析 micro-benchmark：舊的 Regex 判斷鏈 vs command_parser.parse_command
+
+用法: python bench_parser.py [訊息數量]
+"""
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from command_parser import parse_command, SignupDelta, RosterQuery, StatsQuery  # noqa: E402
+
+CHAT = [
+    "大家好", "今天天氣真好", "哈哈哈", "明天幾點集合？", "收到", "+1 的人記得帶水",
+    "有人要一起吃飯嗎", "我晚點到", "👍", "OK", "謝謝主辦!", "球場在哪裡",
+    "這週末下雨嗎", "等等見", "請問還有名額嗎?", "好的 $100 我先付",
+]
+COMMANDS = ["+1", "+2", "-1", "?", "$", "$$", "小明+1", "小明-1", "小華$", "+10"]
+
+
+def chat_corpus(n, command_ratio=0.1, seed=1):
+    """模擬群組訊息：大部分是一般對話，少部分是指令"""
+    rng = random.Random(seed)
+    return [rng.choice(COMMANDS) if rng.random() < command_ratio else rng.choice(CHAT) for _ in range(n)]
+
+
+def legacy_parse(text):
+    """原本 handle_text_message 的判斷方式 (每則訊息三次未編譯的 re.match)"""
+    match_plus = re.match(r'^((?P<name>[^+-]+))?\+(?P<num>\d+)$', text)
+    match_minus = re.match(r'^((?P<name>[^+-]+))?\-(?P<num>\d+)$', text)
+    is_query_signup = (text == '?')
+    match_query_self = (text == '$')
+    match_query_all = (text == '$$')
+    match_query_other = re.match(r'^([^$]+)\$$', text)
+
+    if match_plus:
+        return SignupDelta(match_plus.group('name'), int(match_plus.group('num')), False)
+    if match_minus:
+        return SignupDelta(match_minus.group('name'), int(match_minus.group('num')), True)
+    if is_query_signup:
+        return RosterQuery()
+    if match_query_all:
+        return StatsQuery('all', None)
+    if match_query_self:
+        return StatsQuery('self', None)
+    if match_query_other:
+        return StatsQuery('name', match_query_other.group(1))
+    return None
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    corpus = chat_corpus(n)
+    for name, func in (("legacy regex", legacy_parse), ("parse_command", parse_command)):
+        seconds = min(timeit.repeat(lambda: [func(t) for t in corpus], number=1, repeat=5))
+        print(f"{name:>14}: {seconds * 1e9 / n:8.1f} ns/訊息  ({n} 則，指令佔 10%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+報名流程 benchmark：以假的 Google Sheets / LINE API 重播指令，完整經過 handle_text_message
+
+工作負載：
+- signup_burst   大量用戶同時 +1 (超過上限的排入候補)
+- cancel_cascade 正取的人逐一 -1，每次都觸發候補遞補
+- query_storm    大量 ? / $ / $$ / 名稱$ 查詢夾雜一般聊天
+
+--cold 時每個指令都要重新讀取設定、名單與 LINE 顯示名稱 (快取全部過期)，
+並比較同一指令內平行讀取 (fan-out) 與依序讀取的延遲。
+
+用法: python bench_signup.py [--users 60] [--threads 8] [--sheets-latency-ms 80]
+                             [--line-latency-ms 30] [--batch-window-ms 0] [--cold] [workload ...]
+"""
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import bot_logic  # noqa: E402
+from fakes import FakeLineBotApi, make_sheet_manager, make_signup_spreadsheet, make_text_event  # noqa: E402
+from profile_cache import ProfileCache  # noqa: E402
+from rate_limit import RecentAnswers  # noqa: E402
+from signup_batcher import SignupBatcher  # noqa: E402
+
+CHAT = ["大家好", "幾點集合?", "收到", "我晚點到", "👍"]
+
+
+def _timestamp(i):
+    return f"2024-01-01 {10 + i // 3600:02d}:{i // 60 % 60:02d}:{i % 60:02d}"
+
+
+def signup_burst(users):
+    """(初始名單, 人數上限, 指令)：users 人同時 +1，上限為一半"""
+    return [], max(1, users // 2), [(f"U{i}", "+1") for i in range(users)]
+
+
+def cancel_cascade(users):
+    """前一半正取、後一半候補，正取的人依序取消"""
+    half = max(1, users // 2)
+    rows = [[f"U{i}", f"name-U{i}", 1, "正取" if i < half else "候補", _timestamp(i), ""] for i in range(users)]
+    return rows, half, [(f"U{i}", "-1") for i in range(half)]
+
+
+def query_storm(users):
+    """名單已滿時的大量查詢 (約 1/4 是一般聊天)"""
+    rows = [[f"U{i}", f"name-U{i}", 1, "正取", _timestamp(i), ""] for i in range(users)]
+    commands = []
+    for i in range(users * 4):
+        kind = i % 8
+        if kind < 3:
+            text = "?"
+        elif kind == 3:
+            text = "$"
+        elif kind == 4:
+            text = "$$"
+        elif kind == 5:
+            text = f"name-U{i % users}$"
+        else:
+            text = CHAT[i % len(CHAT)]
+        commands.append((f"U{i % users}", text))
+    return rows, users, commands
+
+
+WORKLOADS = {
+    "signup_burst": signup_burst,
+    "cancel_cascade": cancel_cascade,
+    "query_storm": query_storm,
+}
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))]
+
+
+def run_workload(name, users=60, threads=8, sheets_latency=0.0, line_latency=0.0, batch_window=0.0,
+                 cold=False, fan_out=True):
+    """
+    執行一個工作負載，回傳延遲 / API 呼叫次數 / 吞吐量與最後的試算表
+
+    cold=True 時每個指令都讀取設定、名單與顯示名稱；fan_out=False 時這些讀取依序進行
+    """
+    rows, max_people, commands = WORKLOADS[name](users)
+    spreadsheet = make_signup_spreadsheet(rows, max_people=max_people)
+    spreadsheet.worksheet("Stats").rows.extend(
+        [f"U{i}", f"name-U{i}", f"出席 {i % 7} 次"] for i in range(users)
+    )
+    manager = make_sheet_manager(spreadsheet, f"https://example.invalid/bench/{name}")
+    line_api = FakeLineBotApi(latency=line_latency)
+    # Google Sheets 與 LINE 的呼叫一起計算同時進行的數量
+    line_api.overlap = spreadsheet.overlap
+    spreadsheet.latency = sheets_latency
+
+    saved = (bot_logic._sheet_manager, bot_logic._profile_cache, bot_logic._signup_batcher, bot_logic._io_pool,
+             bot_logic._recent_answers, bot_logic._user_throttle, bot_logic._group_throttle)
+    bot_logic._sheet_manager = manager
+    bot_logic._profile_cache = ProfileCache(ttl=0 if cold else 6 * 3600)
+    bot_logic._signup_batcher = SignupBatcher(window=batch_window) if batch_window > 0 else None
+    # 每次重播都從空的查詢快取開始；重播的指令頻率遠超過用戶 / 群組的頻率限制，不套用
+    bot_logic._recent_answers = RecentAnswers(window=bot_logic._recent_answers.window)
+    bot_logic._user_throttle = None
+    bot_logic._group_throttle = None
+    if not fan_out:
+        bot_logic._io_pool = None
+
+    def run(command):
+        user_id, text = command
+        event = make_text_event(text, user_id=user_id)
+        if cold:
+            # 讓設定與名單都過期 (顯示名稱快取的 ttl 為 0)
+            manager.invalidate_settings()
+            manager.roster.loaded_at -= manager.roster_resync_interval
+        started = time.perf_counter()
+        bot_logic.handle_text_message(event, line_api)
+        return time.perf_counter() - started
+
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            latencies = sorted(pool.map(run, commands))
+        elapsed = time.perf_counter() - started
+    finally:
+        (bot_logic._sheet_manager, bot_logic._profile_cache, bot_logic._signup_batcher, bot_logic._io_pool,
+         bot_logic._recent_answers, bot_logic._user_throttle, bot_logic._group_throttle) = saved
+
+    n = len(commands)
+    return {
+        "workload": name,
+        "commands": n,
+        "seconds": elapsed,
+        "throughput": n / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+        "sheets_calls": Counter(spreadsheet.calls),
+        "sheets_calls_per_command": len(spreadsheet.calls) / n,
+        "line_calls": Counter(line_api.calls),
+        "line_calls_per_command": len(line_api.calls) / n,
+        "replies": len(line_api.replies),
+        "max_in_flight": spreadsheet.overlap.max_in_flight,
+        "spreadsheet": spreadsheet,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("workloads", nargs="*", help="、".join(WORKLOADS) + " (預設全部)")
+    parser.add_argument("--users", type=int, default=60)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--sheets-latency-ms", type=float, default=80)
+    parser.add_argument("--line-latency-ms", type=float, default=30)
+    parser.add_argument("--batch-window-ms", type=float, default=0)
+    parser.add_argument("--cold", action="store_true", help="快取全部過期，比較平行讀取與依序讀取")
+    args = parser.parse_args()
+    unknown = [w for w in args.workloads if w not in WORKLOADS]
+    if unknown:
+        parser.error(f"未知的工作負載: {', '.join(unknown)}")
+
+    print(f"users={args.users} threads={args.threads} sheets={args.sheets_latency_ms}ms "
+          f"line={args.line_latency_ms}ms batch_window={args.batch_window_ms}ms cold={args.cold}")
+    print(f"{'workload':<22}{'cmds':>6}{'cmd/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'sheets/cmd':>12}{'line/cmd':>10}")
+    modes = [(" (fan-out)", True), (" (sequential)", False)] if args.cold else [("", True)]
+    for name in args.workloads or WORKLOADS:
+        for suffix, fan_out in modes:
+            r = run_workload(
+                name, users=args.users, threads=args.threads,
+                sheets_latency=args.sheets_latency_ms / 1000.0,
+                line_latency=args.line_latency_ms / 1000.0,
+                batch_window=args.batch_window_ms / 1000.0,
+                cold=args.cold, fan_out=fan_out,
+            )
+            label = name + suffix
+            print(f"{label:<22}{r['commands']:>6}{r['throughput']:>9.1f}{r['p50_ms']:>9.1f}{r['p99_ms']:>9.1f}"
+                  f"{r['sheets_calls_per_command']:>12.2f}{r['line_calls_per_command']:>10.2f}")
+            print(f"{'':<22}sheets: {dict(r['sheets_calls'])}  line: {dict(r['line_calls'])}")
+
+
+if __name__ == "__main__":
+    main()
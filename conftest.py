@@ -0,0 +1,17 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+# 讓根目錄的測試可以直接 import src/ 底下的模組 (與 gunicorn --chdir src 相同)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+
+@pytest.fixture
+def app_module(monkeypatch):
+    """以測試用的 channel 設定重新載入 app.py (簽章以 fakes.sign_body 產生)"""
+    monkeypatch.setenv("LINE_CHANNEL_ACCESS_TOKEN", "test-token")
+    monkeypatch.setenv("LINE_CHANNEL_SECRET", "test-secret")
+    import app
+    return importlib.reload(app)
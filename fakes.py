@@ -0,0 +1,412 @@
+"""
+離線測試用的假 gspread / LINE 物件
+
+FakeClient / FakeSpreadsheet / FakeWorksheet 只實作 SheetManager 用到的 API，
+資料存在記憶體中，並記錄每一次 API 呼叫 (calls) 方便檢查呼叫次數；make_sheet_manager 以它們建立 SheetManager。
+FakeLineBotApi 記錄 Profile 查詢與回覆內容；兩者都可以用 latency 模擬網路延遲，
+並以 CallOverlap 記錄同時進行中的呼叫數 (兩者可共用同一個，檢查讀取是否真的平行)。
+"""
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
+import warnings
+from contextlib import contextmanager
+
+import gspread
+from linebot.models import MessageEvent, SourceGroup, SourceUser, TextMessage
+
+from roster import SIGNUP_HEADERS
+from sheets_api import SheetManager
+
+
+class FakeResponse:
+    def __init__(self, status_code, message=""):
+        self.status_code = status_code
+        self.text = message
+
+    def json(self):
+        return {"error": {"code": self.status_code, "message": self.text, "status": ""}}
+
+
+def api_error(status_code=429, message="Quota exceeded"):
+    """建立與 gspread 相同型別的 APIError (例如 429 超過配額)"""
+    return gspread.exceptions.APIError(FakeResponse(status_code, message))
+
+
+def _parse_range(range_name):
+    """'Title'!A:F / 'Title'!A1 -> (title, 欄數 或 None)"""
+    title, _, cells = range_name.rpartition('!')
+    title = title.strip("'")
+    if ':' in cells:
+        last = cells.split(':')[1].rstrip('0123456789')
+        return title, ord(last.upper()) - ord('A') + 1
+    return title, None
+
+
+def _start_row(range_name):
+    """'Title'!A2:A -> 2 (沒有指定列時為 1)"""
+    first = range_name.rpartition('!')[2].split(':')[0]
+    digits = first.lstrip('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz')
+    return int(digits) if digits else 1
+
+
+def _range_values(rows, width):
+    """像 Sheets API 一樣只回傳前 width 欄、去掉每列結尾與最後的空白格 / 空白列"""
+    values = []
+    for row in rows:
+        cells = ["" if v is None else str(v) for v in row][:width]
+        while cells and cells[-1] == "":
+            cells.pop()
+        values.append(cells)
+    while values and not values[-1]:
+        values.pop()
+    return values
+
+
+def _cell_value(cell):
+    value = cell.get("userEnteredValue", {})
+    for key in ("numberValue", "boolValue", "stringValue"):
+        if key in value:
+            return value[key]
+    return ""
+
+
+class CallOverlap:
+    """同時進行中的假 API 呼叫數；max_in_flight > 1 表示有呼叫重疊 (平行執行)"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def track(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, title, sheet_id, rows=None):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.id = sheet_id
+        self.rows = [list(r) for r in (rows or [])]
+
+    def _record(self, name):
+        self.spreadsheet.record(name)
+
+    # --- 讀取 ---
+
+    def get_all_values(self):
+        self._record('get_all_values')
+        return [[str(v) for v in r] for r in self.rows]
+
+    def get(self, range_name):
+        """A1:E / A2:A 這類範圍 (只看起始列與最後一欄)"""
+        self._record('get')
+        return _range_values(self.rows[_start_row(range_name) - 1:], _parse_range(range_name)[1])
+
+    def row_values(self, row):
+        self._record('row_values')
+        if row - 1 < len(self.rows):
+            return [str(v) for v in self.rows[row - 1] if str(v)]
+        return []
+
+    # --- 寫入 ---
+
+    def append_row(self, values):
+        self._record('append_row')
+        self.rows.append(list(values))
+
+    def append_rows(self, values):
+        self._record('append_rows')
+        for row in values:
+            self.rows.append(list(row))
+
+    def update_cell(self, row, col, value):
+        self._record('update_cell')
+        while len(self.rows) < row:
+            self.rows.append([])
+        r = self.rows[row - 1]
+        while len(r) < col:
+            r.append("")
+        r[col - 1] = value
+
+    def delete_rows(self, index):
+        self._record('delete_rows')
+        del self.rows[index - 1]
+
+
+class FakeSpreadsheet:
+    def __init__(self, worksheets=None, latency=0.0):
+        # latency: 每次 API 呼叫額外等待的秒數 (模擬網路延遲)
+        self.latency = latency
+        self.overlap = CallOverlap()
+        # fail_next() 排入的錯誤，之後的 API 呼叫會依序拋出
+        self.failures = []
+        self.calls = []
+        self._lock = threading.Lock()
+        self._worksheets = []
+        for title, rows in (worksheets or {}).items():
+            self._worksheets.append(FakeWorksheet(self, title, len(self._worksheets), rows))
+
+    def record(self, name):
+        with self._lock:
+            self.calls.append(name)
+            error = self.failures.pop(0) if self.failures else None
+        with self.overlap.track():
+            if self.latency:
+                time.sleep(self.latency)
+        if error is not None:
+            raise error
+
+    def fail_next(self, count=1, status_code=429):
+        """讓接下來 count 次 API 呼叫失敗"""
+        with self._lock:
+            self.failures.extend(api_error(status_code) for _ in range(count))
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls = []
+
+    def get_lastUpdateTime(self):
+        """以所有分頁的內容代替修改時間 (內容有變就不同，包含測試直接修改 rows)"""
+        self.record('get_lastUpdateTime')
+        with self._lock:
+            content = json.dumps([[ws.title, ws.rows] for ws in self._worksheets], ensure_ascii=False, default=str)
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+    def worksheet(self, title):
+        self.record('worksheet')
+        for ws in self._worksheets:
+            if ws.title == title:
+                return ws
+        raise gspread.exceptions.WorksheetNotFound(title)
+
+    def worksheets(self):
+        self.record('worksheets')
+        return list(self._worksheets)
+
+    def add_worksheet(self, title, rows=100, cols=26):
+        self.record('add_worksheet')
+        ws = FakeWorksheet(self, title, len(self._worksheets))
+        self._worksheets.append(ws)
+        return ws
+
+    def batch_update(self, body):
+        """支援 MutationPlan 會送出的 appendCells / updateCells / deleteDimension"""
+        self.record('batch_update')
+        for req in body["requests"]:
+            if "appendCells" in req:
+                spec = req["appendCells"]
+                ws = self._by_id(spec["sheetId"])
+                for row in spec["rows"]:
+                    ws.rows.append([_cell_value(c) for c in row["values"]])
+            elif "updateCells" in req:
+                spec = req["updateCells"]
+                start = spec["start"]
+                ws = self._by_id(start["sheetId"])
+                for i, row in enumerate(spec["rows"]):
+                    r = start["rowIndex"] + i
+                    while len(ws.rows) <= r:
+                        ws.rows.append([])
+                    target = ws.rows[r]
+                    for j, c in enumerate(row["values"]):
+                        col = start["columnIndex"] + j
+                        while len(target) <= col:
+                            target.append("")
+                        target[col] = _cell_value(c)
+            elif "deleteDimension" in req:
+                rng = req["deleteDimension"]["range"]
+                ws = self._by_id(rng["sheetId"])
+                del ws.rows[rng["startIndex"]:rng["endIndex"]]
+            else:
+                raise NotImplementedError(list(req))
+        return {"replies": []}
+
+    def values_batch_get(self, ranges):
+        self.record('values_batch_get')
+        value_ranges = []
+        for range_name in ranges:
+            title, width = _parse_range(range_name)
+            values = _range_values(self._by_title(title).rows, width)
+            value_ranges.append({"range": range_name, "values": values})
+        return {"valueRanges": value_ranges}
+
+    def values_update(self, range_name, params=None, body=None):
+        self.record('values_update')
+        title, _ = _parse_range(range_name)
+        ws = self._by_title(title)
+        for i, row in enumerate(body["values"]):
+            while len(ws.rows) <= i:
+                ws.rows.append([])
+            ws.rows[i] = list(row)
+        return {}
+
+    def values_append(self, range_name, params=None, body=None):
+        self.record('values_append')
+        title, _ = _parse_range(range_name)
+        ws = self._by_title(title)
+        for row in body["values"]:
+            ws.rows.append(list(row))
+        return {}
+
+    def _by_title(self, title):
+        for ws in self._worksheets:
+            if ws.title == title:
+                return ws
+        raise gspread.exceptions.WorksheetNotFound(title)
+
+    def _by_id(self, sheet_id):
+        for ws in self._worksheets:
+            if ws.id == sheet_id:
+                return ws
+        raise KeyError(sheet_id)
+
+    @property
+    def sheet1(self):
+        if not self._worksheets:
+            self._worksheets.append(FakeWorksheet(self, "Sheet1", 0))
+        return self._worksheets[0]
+
+
+class FakeClient:
+    def __init__(self, spreadsheet=None):
+        self.spreadsheet = spreadsheet or FakeSpreadsheet()
+
+    def open_by_url(self, url):
+        self.spreadsheet.record('open_by_url')
+        return self.spreadsheet
+
+
+def make_signup_spreadsheet(rows=(), max_people=10, latency=0.0, title="測試活動", description="", stats=(),
+                            cls=FakeSpreadsheet):
+    """
+    建立含 Signups / Setting / Stats 三個分頁的假試算表
+
+    rows / stats 為各分頁標題列以下的資料；cls 可換成 FakeSpreadsheet 的子類別 (例如額外檢查寫入內容)
+    """
+    return cls({
+        "Signups": [SIGNUP_HEADERS] + [list(r) for r in rows],
+        "Setting": [
+            ["項目", "內容"],
+            ["活動標題", title],
+            ["活動說明", description],
+            ["人數上限", str(max_people)],
+            ["報名功能", "TRUE"],
+            ["查詢功能", "TRUE"],
+        ],
+        "Stats": [["User ID", "Name", "Description"]] + [list(r) for r in stats],
+    }, latency=latency)
+
+
+def make_sheet_manager(spreadsheet=None, url="https://example.invalid/sheet", client=None, reset_calls=True,
+                       **kwargs):
+    """
+    以假試算表建立 SheetManager (不需要憑證)，其他參數直接傳給 SheetManager
+
+    可以傳入 spreadsheet 或 FakeClient (例如 TenantRegistry 的 client)；
+    reset_calls=True 時清掉連線期間的 API 呼叫紀錄，測試只看之後的呼叫
+    """
+    if client is None:
+        client = FakeClient(spreadsheet)
+    manager = SheetManager("unused.json", url, client=client, **kwargs)
+    if reset_calls:
+        client.spreadsheet.reset_calls()
+    return manager
+
+
+class FakeProfile:
+    def __init__(self, user_id, display_name):
+        self.user_id = user_id
+        self.display_name = display_name
+
+
+class FakeLineBotApi:
+    """
+    假的 LineBotApi：顯示名稱為 name-{user_id}，回覆內容記錄在 replies (push_message 記錄在 pushes)
+
+    calls 記錄每一次呼叫 (API 名稱)，latency 為每次呼叫等待的秒數
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.overlap = CallOverlap()
+        self.calls = []
+        self.replies = []
+        self.pushes = []
+        self._lock = threading.Lock()
+
+    def _record(self, name):
+        with self._lock:
+            self.calls.append(name)
+        with self.overlap.track():
+            if self.latency:
+                time.sleep(self.latency)
+
+    def get_group_member_profile(self, group_id, user_id):
+        self._record('get_group_member_profile')
+        return FakeProfile(user_id, f"name-{user_id}")
+
+    def get_profile(self, user_id):
+        self._record('get_profile')
+        return FakeProfile(user_id, f"name-{user_id}")
+
+    def reply_message(self, reply_token, messages):
+        self._record('reply_message')
+        if not isinstance(messages, (list, tuple)):
+            messages = [messages]
+        with self._lock:
+            self.replies.append((reply_token, [m.text for m in messages]))
+
+    def push_message(self, to, messages):
+        self._record('push_message')
+        if not isinstance(messages, (list, tuple)):
+            messages = [messages]
+        with self._lock:
+            self.pushes.append((to, [m.text for m in messages]))
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls = []
+            self.replies = []
+            self.pushes = []
+
+
+def make_text_event(text, user_id="U1", group_id="G1", reply_token=None):
+    """建立與 webhook 解析結果相同型別的文字訊息事件 (group_id=None 為一對一聊天)"""
+    with warnings.catch_warnings():
+        # linebot.models 在 SDK v3 標記為 deprecated，app.py 仍使用這組 API
+        warnings.simplefilter("ignore")
+        source = SourceGroup(group_id=group_id, user_id=user_id) if group_id else SourceUser(user_id=user_id)
+        return MessageEvent(
+            reply_token=reply_token or f"reply-{user_id}-{time.monotonic_ns()}",
+            source=source,
+            message=TextMessage(text=text),
+        )
+
+
+def sign_body(body, secret="test-secret"):
+    """與 LINE 相同的 X-Line-Signature (HMAC-SHA256 + base64)"""
+    digest = hmac.new(secret.encode(), body.encode(), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode()
+
+
+def make_webhook_body(text, user_id="U1", group_id="G1", event_id="E1", redelivery=False):
+    """單一文字訊息事件的 webhook 請求內容"""
+    source = {"type": "group", "groupId": group_id, "userId": user_id} if group_id else {"type": "user", "userId": user_id}
+    return json.dumps({"destination": "bot", "events": [{
+        "type": "message", "mode": "active", "timestamp": 0,
+        "webhookEventId": event_id, "deliveryContext": {"isRedelivery": redelivery},
+        "replyToken": f"reply-{event_id}", "source": source,
+        "message": {"type": "text", "id": event_id, "text": text},
+    }]})
@@ -1,6 +1,7 @@
 import os
+import random
 import sys
-from flask import Flask, request, abort
+from flask import Flask, Response, request, abort, jsonify
 from dotenv import load_dotenv
 
 from linebot import (
@@ -13,7 +14,10 @@ from linebot.models import (
     MessageEvent, TextMessage, TextSendMessage, FlexSendMessage
 )
 
-from bot_logic import handle_text_message
+from bot_logic import get_shared_state, handle_text_message, profile_cache_stats, tenant_stats, warm_up
+from event_dedup import EventDeduplicator
+from metrics import metrics
+from work_queue import EventWorkQueue, PushReplyApi
 
 # 載入環境變數
 load_dotenv()
@@ -35,6 +39,20 @@ if CHANNEL_ACCESS_TOKEN is None or CHANNEL_SECRET is None:
 line_bot_api = LineBotApi(CHANNEL_ACCESS_TOKEN)
 handler = WebhookHandler(CHANNEL_SECRET)
 
+# 請求內容記錄比例 (0 = 不記錄，1 = 全部記錄；內容含用戶訊息，預設關閉)
+LOG_REQUEST_BODY_SAMPLE = float(os.getenv('LOG_REQUEST_BODY_SAMPLE', 0))
+metrics.slow_trace_ms = float(os.getenv('SLOW_COMMAND_MS', metrics.slow_trace_ms))
+
+# LINE 重送的事件 (同一個 webhook event ID) 只處理一次
+event_dedup = EventDeduplicator(
+    ttl=float(os.getenv('EVENT_DEDUP_TTL', 600)),
+    shared_state=get_shared_state(),
+)
+
+# 非同步模式：callback 驗證簽章後把事件交給背景 worker，立即回應 LINE
+ASYNC_WEBHOOK = os.getenv('ASYNC_WEBHOOK', 'false').lower() in ('1', 'true', 'yes')
+work_queue = None
+
 @app.route("/callback", methods=['POST'])
 def callback():
     # 取得 X-Line-Signature 表頭
@@ -42,21 +60,95 @@ def callback():
 
     # 取得請求內容
     body = request.get_data(as_text=True)
-    app.logger.info("Request body: " + body)
+    if LOG_REQUEST_BODY_SAMPLE > 0 and random.random() < LOG_REQUEST_BODY_SAMPLE:
+        app.logger.info("Request body: " + body)
 
-    # 驗證簽章並處理事件
+    # 驗證簽章並解析事件
     try:
-        handler.handle(body, signature)
+        with metrics.span("webhook_verify"):
+            events = handler.parser.parse(body, signature)
     except InvalidSignatureError:
+        metrics.inc("webhook_invalid_signature_total")
         print("Invalid signature. Please check your channel access token/channel secret.")
         abort(400)
 
+    metrics.inc("webhook_events_total", value=len(events))
+    for event in events:
+        # 重送的事件在任何 Google Sheets I/O 之前就略過
+        if not event_dedup.claim(getattr(event, 'webhook_event_id', None)):
+            continue
+        # 非同步模式下佇列已滿時改為同步處理，避免遺失事件
+        if work_queue is None or not work_queue.submit(event):
+            dispatch_event(event)
+
     return 'OK'
 
+@app.route("/stats/webhook")
+def webhook_stats():
+    if work_queue is None:
+        return jsonify({"async": False})
+    return jsonify(dict(work_queue.stats(), **{"async": True}))
+
+@app.route("/stats/profile")
+def profile_stats():
+    return jsonify(profile_cache_stats())
+
+@app.route("/stats/tenants")
+def tenants_stats():
+    return jsonify(tenant_stats())
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+def _runtime_gauges():
+    stats = profile_cache_stats()
+    gauges = [
+        ("profile_cache_hit_rate", {}, stats.get("hit_rate", 0.0)),
+        ("profile_cache_size", {}, stats.get("size", 0)),
+        ("active_tenants", {}, tenant_stats()["active"]),
+    ]
+    if work_queue is not None:
+        q = work_queue.stats()
+        gauges += [
+            ("webhook_queue_depth", {}, q["queue_depth"]),
+            ("webhook_busy_workers", {}, q["busy_workers"]),
+            ("webhook_late_replies", {}, q["late_replies"]),
+            ("webhook_rejected", {}, q["rejected"]),
+        ]
+    return gauges
+
+metrics.add_collector(_runtime_gauges)
+
 @handler.add(MessageEvent, message=TextMessage)
 def handle_message(event):
     # 將邏輯轉交給 bot_logic 處理，保持 app.py 乾淨
     handle_text_message(event, line_bot_api)
 
+def dispatch_event(event):
+    """背景 worker 處理單一事件 (與 handler 的註冊對應)"""
+    if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage):
+        handle_message(event)
+
+def dispatch_late_event(event):
+    """排隊太久 (reply token 可能已過期) 的事件：回覆改以 push message 送到群組 / 聊天室 / 用戶"""
+    if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage):
+        source = event.source
+        to = getattr(source, 'group_id', None) or getattr(source, 'room_id', None) or source.user_id
+        handle_text_message(event, PushReplyApi(line_bot_api, to))
+
+if ASYNC_WEBHOOK:
+    work_queue = EventWorkQueue(
+        dispatch_event,
+        workers=int(os.getenv('WEBHOOK_WORKERS', 4)),
+        maxsize=int(os.getenv('WEBHOOK_QUEUE_SIZE', 200)),
+        late_func=dispatch_late_event if os.getenv('WEBHOOK_LATE_PUSH', 'true').lower() in ('1', 'true', 'yes') else None,
+    )
+    work_queue.start()
+
+# 啟動時在背景先連線 Google Sheets，第一個指令不必等待授權與開啟試算表
+if os.getenv('STARTUP_WARMUP', 'true').lower() in ('1', 'true', 'yes'):
+    warm_up()
+
 if __name__ == "__main__":
     app.run(port=5000, debug=True)
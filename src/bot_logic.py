@@ -1,25 +1,237 @@
 from linebot.models import TextSendMessage
-from sheets_api import SheetManager
+from command_parser import (
+    parse_command, CloseEvent, SignupDelta, RosterQuery, StatsQuery, STATS_ALL, STATS_SELF
+)
+from metrics import metrics
+from profile_cache import ProfileCache
+from rate_limit import BUSY_REPLY, KeyedThrottle, RecentAnswers, is_overload_error
+from rollover import format_rollover
+from sheet_mirror import SheetMirror
+from sheets_api import SheetManager, authorize_client
+from signup_batcher import SignupBatcher
+from sqlite_backend import SQLiteBackend
+from circuit_breaker import CircuitOpenError
+from shared_state import FileLease, SharedState
+from tenants import Tenant, TenantRegistry, load_tenants
+from concurrent.futures import ThreadPoolExecutor
+import logging
 import os
-import re
+import threading
 
-# 初始化 SheetManager
+logger = logging.getLogger(__name__)
+
+# 初始化儲存後端 (預設為 Google Sheets，每個群組的報名表由 _tenant_registry 管理；
+# STORAGE_BACKEND=sqlite 時改用本機 SQLite)
 # 注意：在生產環境中，建議使用 Singleton 或全域變數避免重複連線
 # 在這裡我們會在第一次呼叫時初始化，簡單處理
 _sheet_manager = None
+_sheet_mirror = None
+_init_lock = threading.Lock()
+
+def _init_sqlite_backend():
+    """建立 SQLite 後端；有設定 Google Sheets 時啟動背景同步"""
+    global _sheet_mirror
+    cred_file = os.getenv('GOOGLE_SHEETS_CREDENTIALS_FILE')
+    sheet_url = os.getenv('SPREADSHEET_URL')
+    mirror_enabled = bool(cred_file and sheet_url)
+
+    sqlite_path = os.getenv('SQLITE_PATH', 'signups.db')
+    backend = SQLiteBackend(sqlite_path, journal=mirror_enabled)
+    if mirror_enabled:
+        try:
+            doc = authorize_client(cred_file).open_by_url(sheet_url)
+            # 每個 worker 都會啟動 SheetMirror，但同一個資料庫只有取得租約的 worker 會同步
+            _sheet_mirror = SheetMirror(
+                backend, doc,
+                interval=float(os.getenv('SHEETS_SYNC_INTERVAL', 5)),
+                edit_check_interval=float(os.getenv('SHEETS_EDIT_CHECK_INTERVAL', 30)),
+                lease=FileLease(sqlite_path + ".mirror.lock"),
+            )
+            _sheet_mirror.start()
+            logger.info("SheetMirror started.")
+        except Exception:
+            # 同步失敗不影響報名，日誌會保留到下次啟動
+            logger.exception("Failed to start SheetMirror")
+    return backend
+
+# 多個 gunicorn worker 共用的鎖與快取 (SHARED_STATE_PATH 未設定時只在行程內協調)
+_shared_state = None
+
+def get_shared_state():
+    global _shared_state
+    path = os.getenv('SHARED_STATE_PATH')
+    with _init_lock:
+        if _shared_state is None and path:
+            _shared_state = SharedState(path)
+        return _shared_state
+
+def _create_sheet_manager(tenant, client):
+    return SheetManager(
+        os.getenv('GOOGLE_SHEETS_CREDENTIALS_FILE'), tenant.spreadsheet_url, client=client,
+        signups_title=tenant.signups_title, setting_title=tenant.setting_title, stats_title=tenant.stats_title,
+        shared_state=get_shared_state(),
+    )
+
+def _init_tenant_registry():
+    """
+    群組 -> 報名表 的對應：TENANTS_FILE 指定的 JSON 檔，
+    沒有列在檔案中的群組使用 SPREADSHEET_URL (未設定時不處理)
+    """
+    cred_file = os.getenv('GOOGLE_SHEETS_CREDENTIALS_FILE')
+    sheet_url = os.getenv('SPREADSHEET_URL')
+    tenants_file = os.getenv('TENANTS_FILE')
+    return TenantRegistry(
+        _create_sheet_manager,
+        tenants=load_tenants(tenants_file) if tenants_file else None,
+        default=Tenant(sheet_url) if sheet_url else None,
+        client_factory=lambda: authorize_client(cred_file),
+        max_active=int(os.getenv('TENANT_POOL_SIZE', 50)),
+        idle_ttl=float(os.getenv('TENANT_IDLE_TTL', 3600)),
+        backoff_base=float(os.getenv('SHEETS_CONNECT_BACKOFF', 1)),
+        backoff_max=float(os.getenv('SHEETS_CONNECT_BACKOFF_MAX', 300)),
+    )
+
+_tenant_registry = None
 
-def get_sheet_manager():
+def get_sheet_manager(group_id=None):
+    """取得該群組的報名表 (SQLite 模式下所有群組共用同一個資料庫)"""
     global _sheet_manager
-    if _sheet_manager is None:
-        cred_file = os.getenv('GOOGLE_SHEETS_CREDENTIALS_FILE')
-        sheet_url = os.getenv('SPREADSHEET_URL')
-        if cred_file and sheet_url:
+    if os.getenv('STORAGE_BACKEND', 'sheets').lower() == 'sqlite':
+        # 背景預先連線與第一個指令可能同時進來，只初始化一次
+        with _init_lock:
+            if _sheet_manager is None:
+                try:
+                    _sheet_manager = _init_sqlite_backend()
+                    logger.info("SQLiteBackend initialized successfully.")
+                except Exception:
+                    logger.exception("Failed to initialize SQLiteBackend")
+        return _sheet_manager
+
+    # 直接指定的 manager (例如測試) 優先
+    if _sheet_manager is not None:
+        return _sheet_manager
+
+    registry = _get_tenant_registry()
+    if registry is None:
+        return None
+    try:
+        return registry.get(group_id)
+    except CircuitOpenError as e:
+        # 連線失敗後的退避期間：直接回覆系統錯誤，不重試連線
+        logger.info("%s", e)
+        return None
+    except Exception:
+        logger.exception("Failed to initialize SheetManager for %s", group_id)
+        return None
+
+def _peek_sheet_manager(group_id):
+    """已經連線的報名表 (不會觸發連線)，沒有時回傳 None"""
+    if _sheet_manager is not None:
+        return _sheet_manager
+    registry = _tenant_registry
+    return registry.peek(group_id) if registry is not None else None
+
+def _get_tenant_registry():
+    global _tenant_registry
+    with _init_lock:
+        if _tenant_registry is None and os.getenv('GOOGLE_SHEETS_CREDENTIALS_FILE'):
             try:
-                _sheet_manager = SheetManager(cred_file, sheet_url)
-                print("SheetManager initialized successfully.")
-            except Exception as e:
-                print(f"Failed to initialize SheetManager: {e}")
-    return _sheet_manager
+                _tenant_registry = _init_tenant_registry()
+            except Exception:
+                logger.exception("Failed to load tenants")
+        return _tenant_registry
+
+def warm_up():
+    """
+    程式啟動時在背景先連線 (授權、開啟預設活動的試算表、載入名單)，
+    第一個指令不需要等待；回傳背景執行緒 (沒有可預先連線的對象時為 None)
+    """
+    if os.getenv('STORAGE_BACKEND', 'sheets').lower() == 'sqlite':
+        thread = threading.Thread(target=get_sheet_manager, name="storage-warmup", daemon=True)
+        thread.start()
+        return thread
+    registry = _get_tenant_registry()
+    if registry is None or registry.default is None:
+        return None
+    return registry.warm_up()
+
+def tenant_stats():
+    if _tenant_registry is None:
+        return {"active": 0}
+    return _tenant_registry.stats()
+
+# 報名尖峰的微批次 (SIGNUP_BATCH_WINDOW_MS > 0 且 ASYNC_WEBHOOK 開啟時啟用；
+# 同步模式下每個 callback 只處理自己的事件，沒有同時進行的指令可以合併，只會多等待)
+_batch_window_ms = float(os.getenv('SIGNUP_BATCH_WINDOW_MS', 0))
+_async_webhook = os.getenv('ASYNC_WEBHOOK', 'false').lower() in ('1', 'true', 'yes')
+_signup_batcher = SignupBatcher(window=_batch_window_ms / 1000.0) if _batch_window_ms > 0 and _async_webhook else None
+
+# LINE 顯示名稱快取 (PROFILE_PREFETCH=true 時看到用戶第一則訊息就先在背景查詢)
+_profile_cache = ProfileCache(
+    maxsize=int(os.getenv('PROFILE_CACHE_SIZE', 2000)),
+    ttl=float(os.getenv('PROFILE_CACHE_TTL', 6 * 3600)),
+    prefetch=os.getenv('PROFILE_PREFETCH', 'false').lower() in ('1', 'true', 'yes'),
+)
+
+# 可以執行 #結算 的 LINE User ID (逗號分隔)
+_admin_user_ids = {u.strip() for u in os.getenv('ADMIN_USER_IDS', '').split(',') if u.strip()}
+
+# 每個用戶 / 群組每分鐘的指令數上限 (0 = 不限制)
+_user_rate = int(os.getenv('USER_COMMANDS_PER_MINUTE', 0))
+_group_rate = int(os.getenv('GROUP_COMMANDS_PER_MINUTE', 0))
+_user_throttle = KeyedThrottle(_user_rate) if _user_rate > 0 else None
+_group_throttle = KeyedThrottle(_group_rate) if _group_rate > 0 else None
+
+# 相同的唯讀查詢在這段秒數內直接回覆上一次的答案
+_recent_answers = RecentAnswers(window=float(os.getenv('READ_COLLAPSE_SECONDS', 2)))
+
+def profile_cache_stats():
+    return _profile_cache.stats()
+
+def _apply_signup(sheet, user_id, user_name, delta):
+    """套用一筆報名變動，回傳 (結果訊息, 名單摘要)"""
+    if delta > 0:
+        msg = sheet.add_signup(user_id, user_name, delta)
+    else:
+        msg = sheet.remove_signup(user_id, -delta)
+    return msg, sheet.get_summary()
+
+# 同一個指令內互不相依的遠端讀取 (LINE Profile、過期的設定與名單) 平行執行
+# COMMAND_IO_WORKERS=0 時依序執行
+_io_workers = int(os.getenv('COMMAND_IO_WORKERS', 8))
+_io_pool = ThreadPoolExecutor(max_workers=_io_workers, thread_name_prefix="command-io") if _io_workers > 0 else None
+
+def _fan_out(sheet, reads):
+    """
+    平行執行 reads (無參數函式)，回傳各自的結果；第一個在目前的執行緒執行
+
+    讀取失敗時結果為 None，之後依序處理的步驟會再讀一次並照常回報錯誤
+    """
+    def guarded(func):
+        try:
+            return func()
+        except Exception:
+            logger.debug("平行讀取失敗，稍後重試", exc_info=True)
+            return None
+
+    if _io_pool is None or len(reads) < 2:
+        return [guarded(func) for func in reads]
+
+    trace = metrics.current_trace()
+    counts = sheet.api_calls.current()
+
+    def run(func):
+        with metrics.attach(trace), sheet.api_calls.attach(counts):
+            return guarded(func)
+
+    futures = [_io_pool.submit(run, func) for func in reads[1:]]
+    with metrics.span("fan_out", reads=len(reads)):
+        results = [guarded(reads[0])] + [f.result() for f in futures]
+    return results
+
+def _reply(line_bot_api, reply_token, text):
+    with metrics.span("line", call="reply_message"):
+        line_bot_api.reply_message(reply_token, TextSendMessage(text=text))
 
 def handle_text_message(event, line_bot_api):
     """
@@ -28,128 +240,186 @@ def handle_text_message(event, line_bot_api):
     text = event.message.text.strip()
     user_id = event.source.user_id
     group_id = getattr(event.source, 'group_id', None)
-    
-    # 1. 判斷指令格式
-    # 支援: +1, +2, +10, -1, -2, ?
-    # 忽略一般對話訊息
-    
-    # 1. 判斷指令格式
-    # 支援: 
-    #   報名: +N, -N, Name+N, Name-N
-    #   查詢: ?, $, Name$, $$
-    
-    # 報名 Regex
-    match_plus = re.match(r'^((?P<name>[^+-]+))?\+(?P<num>\d+)$', text)
-    match_minus = re.match(r'^((?P<name>[^+-]+))?\-(?P<num>\d+)$', text)
-    is_query_signup = (text == '?')
+    _profile_cache.prefetch(line_bot_api, group_id, user_id)
+
+    # 1. 判斷指令格式 (一般對話訊息在這裡就直接忽略，不做任何 I/O)
+    with metrics.span("parse"):
+        command = parse_command(text)
+    if command is None:
+        return
+
+    kind = type(command).__name__
+    metrics.inc("commands_total", kind=kind)
+    with metrics.trace(repr(text)), metrics.span("command", kind=kind):
+        _handle_command(event, line_bot_api, command, text, user_id, group_id)
+
+def _read_key(sheet, command, user_id):
+    """唯讀查詢合併用的 key (報名表, 指令[, 用戶])；會改變資料的指令回傳 None"""
+    if isinstance(command, RosterQuery):
+        return (sheet.storage_key, command)
+    if isinstance(command, StatsQuery):
+        return (sheet.storage_key, command, user_id if command.scope == STATS_SELF else None)
+    return None
+
+def _admit(user_id, group_id):
+    """每個用戶 / 群組的指令頻率限制 (未設定時一律通過)"""
+    if _user_throttle is not None and not _user_throttle.allow(user_id):
+        return False
+    if _group_throttle is not None and group_id and not _group_throttle.allow(group_id):
+        return False
+    return True
+
+def _answer_query(sheet, command, user_id):
+    """? / ?N / $ / $$ / Name$ 的回覆文字 (功能關閉時為空字串)"""
+    if isinstance(command, RosterQuery):
+        _fan_out(sheet, sheet.pending_reads())
+        # 依照需求: 報名開關如關閉, +, -, ? 功能無效 (直接忽略)
+        if not sheet.is_signup_enabled():
+            return ""
+        return sheet.get_summary(page=command.page)
+
+    # 檢查查詢功能開關
+    if not sheet.is_query_enabled():
+        return "" # 直接忽略
+
+    if command.scope == STATS_ALL:
+        return sheet.get_all_stats()
+
+    if command.scope == STATS_SELF:
+        # 查自己 (利用 user_id)
+        results = sheet.query_stats(user_id=user_id)
+        if results:
+            return "\n".join(results)
+        return "查無您的相關資料。"
+
+    results = sheet.query_stats(name=command.name)
+    if results:
+        return "\n".join(results)
+    return f"查無 {command.name} 的相關資料。"
+
+def _reply_throttled(line_bot_api, reply_token, command, user_id, group_id):
+    """
+    超過頻率限制：查詢回覆最近一次的答案 (沒有就忽略)，報名請用戶稍後再試
 
-    # 資料查詢 Regex
-    match_query_self = (text == '$')
-    match_query_all = (text == '$$')
-    match_query_other = re.match(r'^([^$]+)\$$', text)
+    只使用已經連線的報名表，被限制的指令不會觸發連線
+    """
+    metrics.inc("commands_throttled_total", kind=type(command).__name__)
+    sheet = _peek_sheet_manager(group_id)
+    read_key = _read_key(sheet, command, user_id) if sheet is not None else None
+    if read_key is not None:
+        reply_msg = _recent_answers.peek(read_key)
+    elif isinstance(command, SignupDelta):
+        reply_msg = BUSY_REPLY
+    else:
+        reply_msg = None
+    if reply_msg:
+        _reply(line_bot_api, reply_token, reply_msg)
+
+def _handle_command(event, line_bot_api, command, text, user_id, group_id):
+    # 先檢查頻率限制，再取得 (可能需要連線的) 報名表
+    if not _admit(user_id, group_id):
+        _reply_throttled(line_bot_api, event.reply_token, command, user_id, group_id)
+        return
 
-    sheet = get_sheet_manager()
+    sheet = get_sheet_manager(group_id)
     if not sheet:
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text="系統錯誤：無法連線至報名表，請聯絡管理員。")
-        )
+        _reply(line_bot_api, event.reply_token, "系統錯誤：無法連線至報名表，請聯絡管理員。")
         return
 
+    read_key = _read_key(sheet, command, user_id)
     reply_msg = ""
     
     try:
-        # --- 處理報名相關指令 ---
-        if match_plus or match_minus or is_query_signup:
-            # 檢查報名功能開關
-            if not sheet.is_signup_enabled():
-                if is_query_signup:
-                     # 允許看名單，但提示已關閉? 或者都不允許? 
-                     # 依照需求: 報名開關如關閉, +, -, ? 功能無效
-                     # line_bot_api.reply_message(event.reply_token, TextSendMessage(text="報名系統目前已關閉。"))
-                     return # 直接忽略
-                return
-        
-            if match_plus:
-                count = int(match_plus.group('num'))
-                name_prefix = match_plus.group('name')
-                
-                target_id = user_id
-                target_name = "未知用戶"
-                
-                if name_prefix:
-                    # 代理報名
-                    target_id = f"PROXY_{name_prefix}"
-                    target_name = name_prefix
-                else:
-                    # 本人報名 -> 取得 Profile
-                    try:
-                        if group_id:
-                            profile = line_bot_api.get_group_member_profile(group_id, user_id)
-                        else:
-                            profile = line_bot_api.get_profile(user_id)
-                        target_name = profile.display_name
-                    except:
-                        pass
-                
-                msg = sheet.add_signup(target_id, target_name, count)
-                summary = sheet.get_summary()
-                reply_msg = f"{msg}\n\n{summary}"
+        # 同一請求內的設定讀取只打一次 Google Sheets，並統計此指令用了幾次 API
+        with sheet.request_snapshot(), sheet.api_calls.scope() as api_calls:
+            # --- 查詢指令 (短時間內相同的查詢合併成一次) ---
+            if read_key is not None:
+                reply_msg = _recent_answers.get(read_key, lambda: _answer_query(sheet, command, user_id))
+
+            # --- 處理報名相關指令 ---
+            elif isinstance(command, SignupDelta):
+                # 本人報名需要的顯示名稱，與過期的設定 / 名單同時讀取
+                needs_profile = not command.cancel and not command.name and not _profile_cache.contains(group_id, user_id)
+                # (設定排在最前面，在目前的執行緒讀取，才會記入本次請求的設定快照)
+                reads = sheet.pending_reads()
+                if needs_profile:
+                    reads.append(lambda: _profile_cache.get_display_name(line_bot_api, group_id, user_id))
+                fetched = _fan_out(sheet, reads)
+
+                # 檢查報名功能開關
+                # 依照需求: 報名開關如關閉, +, -, ? 功能無效 (直接忽略)
+                if not sheet.is_signup_enabled():
+                    return
 
-            elif match_minus:
-                count = int(match_minus.group('num'))
-                name_prefix = match_minus.group('name')
-                
                 target_id = user_id
-                
-                if name_prefix:
-                     # 代理取消
-                     target_id = f"PROXY_{name_prefix}"
-                
-                msg = sheet.remove_signup(target_id, count)
-                summary = sheet.get_summary()
+                target_name = "" # 取消時不需要名字
+
+                if command.name:
+                    # 代理報名 / 代理取消
+                    target_id = f"PROXY_{command.name}"
+                if not command.cancel:
+                    if command.name:
+                        target_name = command.name
+                    elif needs_profile:
+                        target_name = fetched[-1] or "未知用戶"
+                    else:
+                        # 本人報名 -> 取得 Profile (優先使用快取)
+                        target_name = _profile_cache.get_display_name(line_bot_api, group_id, user_id) or "未知用戶"
+
+                if _signup_batcher is not None:
+                    # 加入批次後立即釋放 webhook worker，由送出批次的執行緒回覆
+                    reply_token = event.reply_token
+                    _signup_batcher.submit(
+                        sheet, target_id, target_name, command.delta,
+                        callback=lambda msg, summary, error: _finish_batched_signup(
+                            line_bot_api, reply_token, sheet, command, text, msg, summary, error),
+                    )
+                    return
+
+                msg, summary = _apply_signup(sheet, target_id, target_name, command.delta)
+                _recent_answers.invalidate(sheet.storage_key)
                 reply_msg = f"{msg}\n\n{summary}"
-            
-            elif is_query_signup:
-                summary = sheet.get_summary()
-                reply_msg = summary
-
-        # --- 處理資料查詢指令 ---
-        elif match_query_self or match_query_all or match_query_other:
-            # 檢查查詢功能開關
-            if not sheet.is_query_enabled():
-                # line_bot_api.reply_message(event.reply_token, TextSendMessage(text="查詢功能目前已關閉。"))
-                return # 直接忽略
-
-            if match_query_all:
-                reply_msg = sheet.get_all_stats()
-            
-            elif match_query_self:
-                # 查自己 (利用 user_id)
-                results = sheet.query_stats(user_id=user_id)
-                if results:
-                    reply_msg = "\n".join(results)
-                else:
-                    reply_msg = "查無您的相關資料。"
-            
-            elif match_query_other:
-                target_name = match_query_other.group(1)
-                results = sheet.query_stats(name=target_name)
-                if results:
-                    reply_msg = "\n".join(results)
-                else:
-                    reply_msg = f"查無 {target_name} 的相關資料。"
+
+            # --- 管理指令 ---
+            elif isinstance(command, CloseEvent):
+                # 非管理員直接忽略
+                if user_id not in _admin_user_ids:
+                    logger.info("非管理員 %s 嘗試結算活動", user_id)
+                    return
+                reply_msg = format_rollover(sheet.close_event())
+                _recent_answers.invalidate(sheet.storage_key)
+
+        if api_calls:
+            logger.info("指令 %r 使用 %d 次 Google Sheets API: %s", text, sum(api_calls.values()), api_calls)
 
         # 4. 回覆 Line 訊息 (如果有產生物件)
         if reply_msg:
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text=reply_msg)
-            )
+            _reply(line_bot_api, event.reply_token, reply_msg)
 
     except Exception as e:
-        print(f"處理指令時發生錯誤: {e}")
-        # line_bot_api.reply_message(
-        #     event.reply_token,
-        #     TextSendMessage(text="處理您的請求時發生錯誤，請稍後再試。")
-        # )
+        _report_failure(line_bot_api, event.reply_token, command, text, e)
+
+def _finish_batched_signup(line_bot_api, reply_token, sheet, command, text, msg, summary, error):
+    """微批次套用後 (在送出批次的執行緒) 回覆其中一個指令"""
+    if error is not None:
+        _report_failure(line_bot_api, reply_token, command, text, error)
+        return
+    _recent_answers.invalidate(sheet.storage_key)
+    _reply(line_bot_api, reply_token, f"{msg}\n\n{summary}")
+
+def _report_failure(line_bot_api, reply_token, command, text, error):
+    if is_overload_error(error):
+        # 超過配額 / 本機限流 / 斷路器開啟：請用戶稍後再試，不當成故障
+        metrics.inc("commands_degraded_total", kind=type(command).__name__)
+        logger.warning("Google Sheets 忙碌中，指令 %r 未處理: %s", text, error)
+        try:
+            _reply(line_bot_api, reply_token, BUSY_REPLY)
+        except Exception:
+            logger.exception("回覆忙碌訊息失敗")
+        return
+    metrics.inc("command_errors_total", kind=type(command).__name__)
+    logger.error("處理指令時發生錯誤: %r", text, exc_info=error)
+    # line_bot_api.reply_message(
+    #     reply_token,
+    #     TextSendMessage(text="處理您的請求時發生錯誤，請稍後再試。")
+    # )
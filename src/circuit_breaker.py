@@ -0,0 +1,86 @@
+import random
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """斷路器開啟中，暫時不嘗試連線"""
+
+    def __init__(self, name, retry_in):
+        super().__init__(f"{name} 暫停連線，{retry_in:.1f} 秒後再試")
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    連線失敗時的斷路器 (指數退避)
+
+    - 連續失敗 failure_threshold 次後開啟，開啟期間 allow() 直接回傳 False，
+      不再讓每個指令都等一次注定失敗的連線
+    - 開啟時間從 base_delay 秒開始，每多失敗一次加倍 (最多 max_delay 秒，含隨機抖動)
+    - 時間到了只放行一個嘗試 (half open)：成功就關閉，失敗就再開啟更久
+    """
+
+    def __init__(self, name="", failure_threshold=1, base_delay=1.0, max_delay=300.0, jitter=0.2):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_until = 0.0
+        self.rejections = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """是否可以嘗試連線 (half open 時只放行一個)"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() >= self.opened_until:
+                self.state = HALF_OPEN
+                return True
+            self.rejections += 1
+            return False
+
+    def retry_in(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return 0.0
+            return max(0.0, self.opened_until - time.monotonic())
+
+    def check(self):
+        """不允許嘗試時拋出 CircuitOpenError"""
+        if not self.allow():
+            raise CircuitOpenError(self.name, self.retry_in())
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                exponent = max(0, self.failures - self.failure_threshold)
+                delay = min(self.max_delay, self.base_delay * (2 ** exponent))
+                delay *= 1 + self.jitter * (2 * random.random() - 1)
+                self.state = OPEN
+                self.opened_until = time.monotonic() + delay
+                return delay
+            return 0.0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "rejections": self.rejections,
+                "retry_in": max(0.0, self.opened_until - time.monotonic()) if self.state != CLOSED else 0.0,
+            }
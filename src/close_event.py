@@ -0,0 +1,41 @@
+"""
+排程結算活動 (與群組中的 #結算 相同)，例如活動結束後由 cron 執行：
+
+    python src/close_event.py                 # SPREADSHEET_URL (或 SQLite) 的活動
+    python src/close_event.py --group Cxxxx   # TENANTS_FILE 中該群組對應的活動
+
+使用與機器人相同的 .env 設定；多個群組對應到同一份報名表時只結算一次。
+"""
+import argparse
+import sys
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import bot_logic  # noqa: E402
+from rollover import format_rollover  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--group", action="append", default=[], help="LINE 群組 ID (可重複指定)")
+    args = parser.parse_args()
+
+    closed = set()
+    failed = False
+    for group_id in args.group or [None]:
+        sheet = bot_logic.get_sheet_manager(group_id)
+        if sheet is None:
+            print(f"找不到 {group_id or '預設活動'} 的報名表")
+            failed = True
+            continue
+        if sheet.storage_key in closed:
+            continue
+        closed.add(sheet.storage_key)
+        print(format_rollover(sheet.close_event()))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
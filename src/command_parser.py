@@ -0,0 +1,106 @@
+"""
+群組訊息的指令解析
+
+支援:
+  報名: +N, -N, Name+N, Name-N
+  查詢: ?, ?N (名單第 N 頁), $, Name$, $$
+  管理: #結算 (結束目前的活動，僅限 ADMIN_USER_IDS)
+
+一般對話訊息只看最後一個字元就能排除 (查表 O(1))，不需要跑任何 Regex 或 I/O。
+新增指令時以 register(結尾字元) 註冊解析函式即可。
+"""
+from collections import namedtuple
+
+
+class SignupDelta(namedtuple('SignupDelta', ['name', 'count', 'cancel'])):
+    """+N / -N / Name+N / Name-N (name 為代理報名的名字，本人報名時為 None)"""
+    __slots__ = ()
+
+    @property
+    def delta(self):
+        return -self.count if self.cancel else self.count
+
+
+RosterQuery = namedtuple('RosterQuery', ['page'], defaults=(1,))
+"""? 查看目前名單，?N 查看第 N 頁 (SUMMARY_PAGE_SIZE 分頁時)"""
+
+StatsQuery = namedtuple('StatsQuery', ['scope', 'name'])
+"""$ (scope='self')、$$ (scope='all')、Name$ (scope='name')"""
+
+CloseEvent = namedtuple('CloseEvent', [])
+"""#結算 結束目前的活動 (封存名單、出席次數併入 Stats、清空報名表)"""
+
+STATS_SELF = 'self'
+STATS_ALL = 'all'
+STATS_NAME = 'name'
+
+# 所有數字結尾的指令共用的 key (Unicode 十進位數字太多，不逐一列出)
+DIGIT = object()
+
+# 結尾字元 -> 解析函式
+_parsers = {}
+
+
+def register(*last_chars):
+    """註冊指令解析函式：訊息以 last_chars 之一結尾時呼叫，無法解析時回傳 None"""
+    def decorator(func):
+        for ch in last_chars:
+            _parsers[ch] = func
+        return func
+    return decorator
+
+
+def parse_command(text):
+    """解析訊息 (呼叫端應先 strip)，不是指令時回傳 None"""
+    if not text:
+        return None
+    last = text[-1]
+    parser = _parsers.get(DIGIT if last.isdecimal() else last)
+    if parser is None:
+        return None
+    return parser(text)
+
+
+@register(DIGIT)
+def _parse_signup(text):
+    # 從結尾往前取出數字，前一個字元必須是 + 或 - (或 ?N 的 ?)
+    i = len(text)
+    while i > 0 and text[i - 1].isdecimal():
+        i -= 1
+    if i == 0:
+        return None
+    sign = text[i - 1]
+    if sign == '?':
+        return RosterQuery(int(text[i:])) if i == 1 else None
+    if sign != '+' and sign != '-':
+        return None
+    name = text[:i - 1]
+    if '+' in name or '-' in name:
+        return None
+    return SignupDelta(name or None, int(text[i:]), sign == '-')
+
+
+@register('?')
+def _parse_roster_query(text):
+    if text == '?':
+        return RosterQuery()
+    return None
+
+
+@register('$')
+def _parse_stats_query(text):
+    if text == '$':
+        return StatsQuery(STATS_SELF, None)
+    if text == '$$':
+        return StatsQuery(STATS_ALL, None)
+    name = text[:-1]
+    if '$' in name:
+        return None
+    return StatsQuery(STATS_NAME, name)
+
+
+@register('算')
+def _parse_close_event(text):
+    if text == '#結算':
+        return CloseEvent()
+    return None
@@ -0,0 +1,58 @@
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import metrics
+
+# LINE 的重送會在數分鐘內發生，保留已處理事件 ID 的秒數
+DEFAULT_DEDUP_TTL = 600
+
+
+class EventDeduplicator:
+    """
+    依 webhook event ID 去重，讓 LINE 重送的事件不會再被處理一次
+
+    - claim(event_id) 在處理前就標記 (不是處理完才標記)，同時送達的重複事件也只會有一個通過
+    - 記憶體中最多保留 maxsize 個 ID，超過 ttl 秒的自動過期
+    - 有 shared_state 時改用共用的標記，重送到其他 worker 的事件一樣會被擋下
+    - 標記後處理失敗也不會解除：Sheets 的寫入是整批的，但重送的 +N 若再套用一次就會重複報名
+    """
+
+    def __init__(self, ttl=DEFAULT_DEDUP_TTL, maxsize=10000, shared_state=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.shared_state = shared_state
+        self._seen = OrderedDict()  # event_id -> 到期時間
+        self._lock = threading.Lock()
+        self.duplicates = 0
+
+    def claim(self, event_id):
+        """第一次看到這個事件回傳 True；沒有 event ID 的事件一律放行"""
+        if not event_id:
+            return True
+        if self.shared_state is not None:
+            claimed = self.shared_state.claim("event:" + event_id, self.ttl)
+        else:
+            claimed = self._claim_local(event_id)
+        if not claimed:
+            with self._lock:
+                self.duplicates += 1
+            metrics.inc("webhook_duplicates_total")
+        return claimed
+
+    def _claim_local(self, event_id):
+        now = time.monotonic()
+        with self._lock:
+            # 由最舊的開始清除過期的 ID
+            while self._seen:
+                oldest, expires_at = next(iter(self._seen.items()))
+                if expires_at > now and len(self._seen) < self.maxsize:
+                    break
+                del self._seen[oldest]
+            if event_id in self._seen:
+                return False
+            self._seen[event_id] = now + self.ttl
+            return True
+
+    def __len__(self):
+        return len(self._seen)
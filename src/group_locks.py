@@ -0,0 +1,56 @@
+import threading
+from contextlib import contextmanager
+
+
+class KeyedLocks:
+    """
+    依 key 取得各自獨立的鎖
+
+    同一個 key (同一個群組 / 試算表) 的變動會被序列化，
+    不同 key 之間互不影響，可以同時執行。
+    hold() 會記錄持有 / 等待中的人數，不再使用的 key 以 discard() 移除。
+    """
+
+    def __init__(self):
+        self._locks = {}
+        self._holders = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        """須持有 _lock"""
+        lock = self._locks.get(key)
+        if lock is None:
+            # 使用 RLock：持有鎖的執行緒在變動流程中可以再次取得 (例如重新同步名單)
+            lock = threading.RLock()
+            self._locks[key] = lock
+        return lock
+
+    def get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    @contextmanager
+    def hold(self, key):
+        with self._lock:
+            lock = self._get(key)
+            self._holders[key] = self._holders.get(key, 0) + 1
+        try:
+            with lock:
+                yield
+        finally:
+            with self._lock:
+                remaining = self._holders[key] - 1
+                if remaining:
+                    self._holders[key] = remaining
+                else:
+                    del self._holders[key]
+
+    def discard(self, key):
+        """移除不再使用的 key 的鎖 (還有人在 hold 中持有或等待時保留)"""
+        with self._lock:
+            if not self._holders.get(key):
+                self._locks.pop(key, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._locks)
@@ -0,0 +1,228 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "signup_bot_"
+
+# 延遲分佈的 bucket 上界 (秒)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Trace:
+    """一個指令內的所有 span (名稱, 毫秒)，依完成順序排列"""
+
+    def __init__(self, name):
+        self.name = name
+        self.spans = []
+        self.started = time.perf_counter()
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def describe(self):
+        parts = [f"{name}={ms:.1f}ms" for name, ms in self.spans]
+        return f"{self.name} {self.elapsed_ms():.1f}ms: " + " ".join(parts)
+
+
+class Metrics:
+    """
+    程序內的計數器與延遲分佈，以 Prometheus 文字格式輸出 (/metrics)
+
+    - inc(name, **labels)：計數器 (例如 429 配額錯誤、重試次數)
+    - span(name, **labels)：量測一段程式的耗時，記錄到 span_seconds 分佈；
+      在 trace() 範圍內時也會記到該指令的 trace，指令結束時輸出一行日誌
+    - add_collector(func)：輸出時呼叫 func() 取得即時數值 [(名稱, labels, 值), ...]
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, slow_trace_ms=1000):
+        self.buckets = tuple(buckets)
+        self.slow_trace_ms = slow_trace_ms
+        self._lock = threading.Lock()
+        self._counters = {}     # name -> {label_key: value}
+        self._histograms = {}   # name -> {label_key: _Histogram}
+        self._collectors = []
+        self._local = threading.local()
+
+    # --- 記錄 ---
+
+    def inc(self, name, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = _Histogram(self.buckets)
+            hist.observe(value)
+
+    @contextmanager
+    def span(self, name, **labels):
+        """量測區塊耗時；區塊拋出例外時另外計入 span_errors_total"""
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc("span_errors_total", span=name, **labels)
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            self.observe("span_seconds", seconds, span=name, **labels)
+            trace = getattr(self._local, 'trace', None)
+            if trace is not None:
+                label = ".".join([name] + [str(v) for _, v in _label_key(labels)])
+                trace.spans.append((label, seconds * 1000))
+
+    @contextmanager
+    def trace(self, name):
+        """
+        收集一個指令的所有 span；超過 slow_trace_ms 時以 warning 輸出，其餘為 debug
+        (巢狀呼叫時沿用外層的 trace)
+        """
+        if getattr(self._local, 'trace', None) is not None:
+            yield self._local.trace
+            return
+        trace = Trace(name)
+        self._local.trace = trace
+        try:
+            yield trace
+        finally:
+            self._local.trace = None
+            if self.slow_trace_ms and trace.elapsed_ms() >= self.slow_trace_ms:
+                logger.warning("慢指令 %s", trace.describe())
+            elif logger.isEnabledFor(logging.DEBUG):
+                logger.debug("指令 %s", trace.describe())
+
+    def current_trace(self):
+        return getattr(self._local, 'trace', None)
+
+    @contextmanager
+    def attach(self, trace):
+        """在其他執行緒中把 span 記到同一個 trace (例如平行讀取)"""
+        parent = getattr(self._local, 'trace', None)
+        self._local.trace = trace
+        try:
+            yield trace
+        finally:
+            self._local.trace = parent
+
+    def add_collector(self, func):
+        self._collectors.append(func)
+
+    # --- 讀取 ---
+
+    def counter_value(self, name, **labels):
+        with self._lock:
+            return self._counters.get(name, {}).get(_label_key(labels), 0)
+
+    def span_count(self, name, **labels):
+        key = _label_key(dict(labels, span=name))
+        with self._lock:
+            hist = self._histograms.get("span_seconds", {}).get(key)
+            return hist.count if hist else 0
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+
+    def render(self):
+        """Prometheus text exposition format (0.0.4)"""
+        lines = []
+        with self._lock:
+            counters = {n: dict(s) for n, s in self._counters.items()}
+            histograms = {
+                n: {k: (list(h.counts), h.sum, h.count) for k, h in s.items()}
+                for n, s in self._histograms.items()
+            }
+
+        for name in sorted(counters):
+            lines.append(f"# TYPE {PREFIX}{name} counter")
+            for key, value in sorted(counters[name].items()):
+                lines.append(f"{PREFIX}{name}{_format_labels(key)} {_format_value(value)}")
+
+        for name in sorted(histograms):
+            lines.append(f"# TYPE {PREFIX}{name} histogram")
+            for key, (counts, total, count) in sorted(histograms[name].items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += n
+                    le = (("le", _format_value(bound)),)
+                    lines.append(f"{PREFIX}{name}_bucket{_format_labels(key, le)} {cumulative}")
+                lines.append(f"{PREFIX}{name}_sum{_format_labels(key)} {_format_value(total)}")
+                lines.append(f"{PREFIX}{name}_count{_format_labels(key)} {count}")
+
+        gauges = {}
+        for collector in self._collectors:
+            try:
+                for name, labels, value in collector():
+                    gauges.setdefault(name, []).append((_label_key(labels), value))
+            except Exception:
+                logger.exception("metrics collector 執行失敗")
+        for name in sorted(gauges):
+            lines.append(f"# TYPE {PREFIX}{name} gauge")
+            for key, value in gauges[name]:
+                lines.append(f"{PREFIX}{name}{_format_labels(key)} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+# 全程式共用的 metrics
+metrics = Metrics()
+
+
+def api_error_status(error):
+    """gspread APIError 的 HTTP 狀態碼 (取不到時為 None)"""
+    return getattr(getattr(error, 'response', None), 'status_code', None)
+
+
+def record_sheets_error(call, error):
+    """記錄一次 Google Sheets API 錯誤 (429 另外計入配額錯誤)"""
+    status = api_error_status(error)
+    metrics.inc("sheets_api_errors_total", call=call, status=status or "unknown")
+    if status == 429:
+        metrics.inc("sheets_quota_errors_total", call=call)
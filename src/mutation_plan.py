@@ -0,0 +1,124 @@
+from roster import SIGNUP_HEADERS
+
+# 更新既有列時改寫的欄位範圍：報名人數 / 狀態 / 報名時間 (C:E)
+UPDATE_FIRST_COL = SIGNUP_HEADERS.index("報名人數")
+UPDATE_LAST_COL = SIGNUP_HEADERS.index("報名時間")
+
+
+def _cell(value):
+    """轉成 Sheets API 的 CellData (等同 append_row 預設的 RAW 輸入)"""
+    if isinstance(value, bool):
+        return {"userEnteredValue": {"boolValue": value}}
+    if isinstance(value, (int, float)):
+        return {"userEnteredValue": {"numberValue": value}}
+    return {"userEnteredValue": {"stringValue": "" if value is None else str(value)}}
+
+
+def _row_data(values):
+    return {"values": [_cell(v) for v in values]}
+
+
+class MutationPlan:
+    """
+    收集一次指令 (一次重新分配或一整輪遞補) 對 Signups 分頁的所有變動，
+    最後以單一 spreadsheet.batch_update 送出。
+    (活動結算時也包含其他分頁的變動，以 sheet_id 指定)
+
+    變動依記錄順序執行，且 batch_update 在 Google 端是整批成功或整批失敗，
+    所以每個動作的列號只要以「前面動作都已套用」為準即可，
+    不會出現只寫入一半的狀態。
+    """
+
+    def __init__(self, sheet_id, roster=None):
+        self.sheet_id = sheet_id
+        # 計算列號用的名單複本 (Roster.copy())，寫入成功後才取代記憶體名單
+        self.roster = roster
+        self.requests = []
+
+    def __len__(self):
+        return len(self.requests)
+
+    def append_row(self, values):
+        self.requests.append({
+            "appendCells": {
+                "sheetId": self.sheet_id,
+                "rows": [_row_data(values)],
+                "fields": "userEnteredValue",
+            }
+        })
+
+    def append_rows(self, rows, sheet_id=None):
+        """一次新增多列 (sheet_id 預設為 Signups 分頁)"""
+        if not rows:
+            return
+        self.requests.append({
+            "appendCells": {
+                "sheetId": self.sheet_id if sheet_id is None else sheet_id,
+                "rows": [_row_data(values) for values in rows],
+                "fields": "userEnteredValue",
+            }
+        })
+
+    def update_cell(self, row, col, value, sheet_id=None):
+        """改寫第 row 列、第 col 欄 (皆為 1-based) 的一格"""
+        self.requests.append({
+            "updateCells": {
+                "start": {"sheetId": self.sheet_id if sheet_id is None else sheet_id,
+                          "rowIndex": row - 1, "columnIndex": col - 1},
+                "rows": [_row_data([value])],
+                "fields": "userEnteredValue",
+            }
+        })
+
+    def update_row(self, row, values):
+        """改寫第 row 列 (1-based) 的 報名人數 / 狀態 / 報名時間"""
+        self.requests.append({
+            "updateCells": {
+                "start": {"sheetId": self.sheet_id, "rowIndex": row - 1, "columnIndex": UPDATE_FIRST_COL},
+                "rows": [_row_data(values[UPDATE_FIRST_COL:UPDATE_LAST_COL + 1])],
+                "fields": "userEnteredValue",
+            }
+        })
+
+    def delete_row(self, row):
+        """刪除第 row 列 (1-based)"""
+        self.requests.append({
+            "deleteDimension": {
+                "range": {
+                    "sheetId": self.sheet_id,
+                    "dimension": "ROWS",
+                    "startIndex": row - 1,
+                    "endIndex": row,
+                }
+            }
+        })
+
+    def delete_rows(self, first_row, last_row):
+        """刪除第 first_row ~ last_row 列 (1-based，含頭尾)"""
+        if last_row < first_row:
+            return
+        self.requests.append({
+            "deleteDimension": {
+                "range": {
+                    "sheetId": self.sheet_id,
+                    "dimension": "ROWS",
+                    "startIndex": first_row - 1,
+                    "endIndex": last_row,
+                }
+            }
+        })
+
+    def targets_existing_rows(self):
+        """是否有以列號指定 Signups 既有列的動作 (改寫或刪除；新增列不需要列號)"""
+        for req in self.requests:
+            for kind in ("updateCells", "deleteDimension"):
+                spec = req.get(kind)
+                if spec is None:
+                    continue
+                target = spec["start"] if kind == "updateCells" else spec["range"]
+                if target["sheetId"] == self.sheet_id:
+                    return True
+        return False
+
+    def to_body(self):
+        return {"requests": list(self.requests)}
@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ProfileCache:
+    """
+    LINE 顯示名稱快取 (LRU + TTL)，以 (group_id, user_id) 為 key
+
+    命中時完全不呼叫 LINE API；prefetch=True 時在看到用戶的第一則訊息就先在背景查詢，
+    等到他報名時通常已經在快取中。
+    """
+
+    def __init__(self, maxsize=2000, ttl=6 * 3600, prefetch=False, prefetch_workers=2):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.prefetch_enabled = prefetch
+        self._data = OrderedDict()   # key -> (expires_at, display_name)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=prefetch_workers, thread_name_prefix="profile-prefetch") if prefetch else None
+
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.prefetches = 0
+        self._fetch_time = 0.0
+        self._fetches = 0
+
+    def _lookup(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, name = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return name
+
+    def _store(self, key, name):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, name)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def _fetch(self, line_bot_api, group_id, user_id):
+        started = time.monotonic()
+        call = 'get_group_member_profile' if group_id else 'get_profile'
+        try:
+            with metrics.span("line", call=call):
+                if group_id:
+                    profile = line_bot_api.get_group_member_profile(group_id, user_id)
+                else:
+                    profile = line_bot_api.get_profile(user_id)
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            metrics.inc("line_api_errors_total", call=call)
+            logger.warning("取得 LINE 用戶資料失敗 (%s): %s", user_id, e)
+            return None
+        with self._lock:
+            self._fetches += 1
+            self._fetch_time += time.monotonic() - started
+        name = profile.display_name
+        self._store((group_id, user_id), name)
+        return name
+
+    def get_display_name(self, line_bot_api, group_id, user_id):
+        """取得顯示名稱；查詢失敗時回傳 None"""
+        name = self._lookup((group_id, user_id))
+        if name is not None:
+            with self._lock:
+                self.hits += 1
+            return name
+        with self._lock:
+            self.misses += 1
+        return self._fetch(line_bot_api, group_id, user_id)
+
+    def contains(self, group_id, user_id):
+        """快取中是否已有 (未過期的) 顯示名稱"""
+        return self._lookup((group_id, user_id)) is not None
+
+    def prefetch(self, line_bot_api, group_id, user_id):
+        """快取中沒有時，在背景先查詢 (未啟用 prefetch 時不做任何事)"""
+        if self._executor is None:
+            return
+        key = (group_id, user_id)
+        if self._lookup(key) is not None:
+            return
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+            self.prefetches += 1
+
+        def run():
+            try:
+                self._fetch(line_bot_api, group_id, user_id)
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+
+        self._executor.submit(run)
+
+    def stats(self):
+        with self._lock:
+            avg_fetch = self._fetch_time / self._fetches if self._fetches else 0.0
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "errors": self.errors,
+                "prefetches": self.prefetches,
+                "avg_fetch_ms": avg_fetch * 1000,
+                # 命中的次數 x 平均一次 LINE API 的耗時 = 省下的報名延遲
+                "saved_ms": self.hits * avg_fetch * 1000,
+            }
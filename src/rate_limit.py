@@ -0,0 +1,206 @@
+"""
+流量控制：Google Sheets 呼叫的 token bucket、每個用戶 / 群組的指令頻率限制，
+以及短時間內相同查詢的合併
+
+超過 Google Sheets 配額後每個指令都會失敗；在這之前先限制呼叫速度，
+真的忙不過來時改用最近一次的答案或請用戶稍後再試，而不是隨機失敗。
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from gspread.exceptions import APIError
+
+from circuit_breaker import CircuitOpenError
+from metrics import api_error_status, metrics
+
+# 回覆給用戶的忙碌訊息
+BUSY_REPLY = "目前使用人數較多，請稍後再試。"
+
+
+class SheetsBusyError(Exception):
+    """等不到 Google Sheets 的呼叫額度 (本機限流)"""
+
+    def __init__(self, call):
+        super().__init__(f"Google Sheets 呼叫額度已用完 ({call})")
+        self.call = call
+
+
+def is_overload_error(error):
+    """是否為「太忙」類的錯誤 (本機限流、配額 429、斷路器開啟)，可以降級處理而不是當成故障"""
+    if isinstance(error, (SheetsBusyError, CircuitOpenError)):
+        return True
+    return isinstance(error, APIError) and api_error_status(error) == 429
+
+
+class TokenBucket:
+    """
+    每秒補充 rate 個 token、最多累積 capacity 個
+
+    pause(seconds) 讓之後的 acquire 至少等到指定時間 (例如收到 429 之後)
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = None
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _wait_time(self, now):
+        """還要等幾秒才有 token (0 = 已取得)，須持有 _lock"""
+        if self._paused_until is not None:
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._paused_until = None
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def try_acquire(self):
+        with self._lock:
+            return self._wait_time(time.monotonic()) == 0.0
+
+    def acquire(self, timeout=0.0):
+        """取得一個 token，最多等待 timeout 秒；等不到時回傳 False"""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._wait_time(now)
+            if wait == 0.0:
+                return True
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self._lock:
+            until = time.monotonic() + seconds
+            if self._paused_until is None or until > self._paused_until:
+                self._paused_until = until
+            self.tokens = 0.0
+
+
+class KeyedThrottle:
+    """每個 key (用戶 / 群組) 各自的 token bucket，最多記住 maxsize 個 key (LRU)"""
+
+    def __init__(self, per_minute, burst=None, maxsize=10000):
+        self.rate = per_minute / 60.0
+        self.burst = burst if burst is not None else max(1, per_minute // 4)
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+                while len(self._buckets) > self.maxsize:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+        return bucket.try_acquire()
+
+
+class _Answer:
+    __slots__ = ("lock", "text", "at", "version")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.text = None
+        self.at = None
+        self.version = None
+
+
+class RecentAnswers:
+    """
+    唯讀查詢 (?, $, $$, Name$) 的最近答案
+
+    - window 秒內相同的查詢直接回覆上一次的答案；同時進來的相同查詢只計算一次
+    - 計算時遇到「太忙」的錯誤，有舊答案就回覆舊答案
+    - key 的第一個元素為報名表 (storage_key)，名單變動後以 invalidate(storage_key) 清除
+      (其他 worker 的變動最晚在 window 秒後反映)
+    - 每個報名表有版本號，invalidate 時 +1；答案記錄計算開始時的版本，
+      計算期間有變動 (版本已更新) 的答案不保存，避免變動前讀到的名單在 invalidate 之後才寫入快取
+    """
+
+    def __init__(self, window=2.0, maxsize=1000):
+        self.window = window
+        self.maxsize = maxsize
+        self._answers = OrderedDict()
+        self._versions = {}              # storage_key -> 版本號
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale = 0
+
+    def _entry(self, key):
+        with self._lock:
+            entry = self._answers.get(key)
+            if entry is None:
+                entry = self._answers[key] = _Answer()
+                while len(self._answers) > self.maxsize:
+                    self._answers.popitem(last=False)
+            else:
+                self._answers.move_to_end(key)
+            return entry
+
+    def _version(self, storage_key):
+        with self._lock:
+            return self._versions.get(storage_key, 0)
+
+    def _fresh(self, entry, version):
+        return entry.at is not None and entry.version == version and time.monotonic() - entry.at < self.window
+
+    def get(self, key, compute):
+        entry = self._entry(key)
+        version = self._version(key[0])
+        if self._fresh(entry, version):
+            self.hits += 1
+            metrics.inc("read_queries_collapsed_total")
+            return entry.text
+        with entry.lock:
+            # 等待期間其他請求已經算好
+            version = self._version(key[0])
+            if self._fresh(entry, version):
+                self.hits += 1
+                metrics.inc("read_queries_collapsed_total")
+                return entry.text
+            try:
+                text = compute()
+            except Exception as e:
+                if entry.text is None or not is_overload_error(e):
+                    raise
+                self.stale += 1
+                metrics.inc("read_queries_stale_total")
+                return entry.text
+            if self._version(key[0]) != version:
+                # 計算期間名單有變動：這份答案可能是變動前的，不保存
+                metrics.inc("read_answers_discarded_total")
+                return text
+            entry.text = text
+            entry.at = time.monotonic()
+            entry.version = version
+            return text
+
+    def peek(self, key):
+        """最近一次的答案 (不論新舊)，沒有時回傳 None"""
+        with self._lock:
+            entry = self._answers.get(key)
+        return entry.text if entry is not None else None
+
+    def invalidate(self, storage_key):
+        """清除該報名表的所有答案 (保留文字給 peek 使用，只讓它不再算是新的)"""
+        with self._lock:
+            self._versions[storage_key] = self._versions.get(storage_key, 0) + 1
+            for key, entry in self._answers.items():
+                if key[0] == storage_key:
+                    entry.at = None
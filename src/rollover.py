@@ -0,0 +1,70 @@
+"""
+活動結算：封存最後的名單、把出席次數併入 Stats，並清空目前的報名表
+
+Signups 分頁 (以及 SQLite 的 signups 表) 只保留進行中的活動，
+查詢與報名流程不會隨著一季下來的活動數變慢。
+"""
+import re
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+
+from roster import STATUS_APPROVED
+
+# 封存分頁 / 資料表的欄位 (所有活動共用一份，以 活動 + 結算時間 區分)
+ARCHIVE_HEADERS = ["活動", "結算時間", "User ID", "顯示名稱", "報名人數", "狀態", "報名時間"]
+
+ATTENDANCE_FORMAT = "出席 {} 次"
+_ATTENDANCE = re.compile(r"^出席\s*(\d+)\s*次$")
+
+RolloverResult = namedtuple("RolloverResult", "title closed_at archived attended")
+"""title: 活動標題、closed_at: 結算時間、archived: 封存的報名列數、attended: 出席次數 +1 的人數"""
+
+
+def closed_at_now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def archive_rows(title, closed_at, entries):
+    """名單 -> 封存列 (略過空白列)"""
+    return [
+        [title, closed_at, e.user_id, e.name, e.count, e.status, e.timestamp]
+        for e in entries if e.user_id
+    ]
+
+
+def attendees(entries):
+    """正取的用戶 (依報名順序)：{user_id: 顯示名稱}"""
+    result = OrderedDict()
+    for e in entries:
+        if e.user_id and e.status == STATUS_APPROVED and e.count > 0:
+            result.setdefault(e.user_id, e.name)
+    return result
+
+
+def roll_attendance(stats_rows, entries):
+    """
+    把本次正取的人併入 Stats 的「出席 N 次」
+
+    stats_rows 為 [(user_id, name, description), ...]；每位出席者的第一筆「出席 N 次」改為 N + 1，
+    沒有的話新增一列「出席 1 次」。回傳 (updates {stats_rows 的索引: 新的 description}, 新增的列)
+    """
+    counter_index = {}
+    for i, (user_id, _, description) in enumerate(stats_rows):
+        if str(user_id) not in counter_index and _ATTENDANCE.match(str(description).strip()):
+            counter_index[str(user_id)] = i
+
+    updates = {}
+    appends = []
+    for user_id, name in attendees(entries).items():
+        i = counter_index.get(user_id)
+        if i is None:
+            appends.append((user_id, name, ATTENDANCE_FORMAT.format(1)))
+        else:
+            count = int(_ATTENDANCE.match(str(stats_rows[i][2]).strip()).group(1))
+            updates[i] = ATTENDANCE_FORMAT.format(count + 1)
+    return updates, appends
+
+
+def format_rollover(result):
+    return (f"📦 已結算「{result.title}」({result.closed_at})\n"
+            f"封存 {result.archived} 筆報名，{result.attended} 人出席次數 +1，報名表已清空。")
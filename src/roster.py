@@ -0,0 +1,206 @@
+import threading
+import time
+
+# Signups 分頁的欄位順序 (與 SheetManager._init_headers 一致)
+SIGNUP_HEADERS = ["User ID", "顯示名稱", "報名人數", "狀態", "報名時間", "備註"]
+
+STATUS_APPROVED = '正取'
+STATUS_WAITLIST = '候補'
+
+
+class RosterEntry:
+    """Signups 分頁中的一列"""
+
+    def __init__(self, user_id, name, count, status, timestamp="", note="", row_id=None):
+        self.user_id = user_id
+        self.name = name
+        self.count = count
+        self.status = status
+        self.timestamp = timestamp
+        self.note = note
+        # 儲存端的識別碼 (例如 SQLite 的 id)；Google Sheets 以列順序定位，不使用
+        self.row_id = row_id
+
+    @classmethod
+    def from_record(cls, record):
+        """由 get_all_records() 的 dict 轉成 RosterEntry"""
+        try:
+            count = int(record.get('報名人數', 0))
+        except:
+            count = 0
+        return cls(
+            user_id=str(record.get('User ID')),
+            name=record.get('顯示名稱', ''),
+            count=count,
+            status=record.get('狀態', STATUS_APPROVED),
+            timestamp=str(record.get('報名時間', '')),
+            note=record.get('備註', ''),
+        )
+
+    def copy(self):
+        return RosterEntry(self.user_id, self.name, self.count, self.status, self.timestamp, self.note,
+                           row_id=self.row_id)
+
+    def to_row(self):
+        return [self.user_id, self.name, self.count, self.status, self.timestamp, self.note]
+
+    def __repr__(self):
+        return f"RosterEntry({self.user_id!r}, {self.name!r}, {self.count}, {self.status!r})"
+
+
+def allocate_promotions(waiting, free):
+    """
+    單次掃描分配空出的正取名額
+
+    waiting 為候補列 (任意順序)，依 報名時間 排序 (相同時間維持原順序)，
+    先報名的先遞補，名額不足時只遞補部分人數。回傳 [(候補 entry, 遞補人數), ...]
+    """
+    promotions = []
+    if free <= 0:
+        return promotions
+    for entry in sorted(waiting, key=lambda e: e.timestamp):
+        if free <= 0:
+            break
+        if entry.count <= 0:
+            continue
+        move = min(entry.count, free)
+        promotions.append((entry, move))
+        free -= move
+    return promotions
+
+
+class Roster:
+    """
+    Signups 分頁的記憶體鏡像
+
+    - entries 依照 Sheet 上的列順序排列 (第 i 筆 = 第 i + 2 列)
+    - 以 User ID 建立索引，並維護 正取 / 候補 總人數，
+      讓重新分配與統計不需要掃描整張表
+    - version 在每次變動時遞增
+    - loaded_at 為最後一次與 Sheet 同步的時間 (None = 需要重新下載)
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.version = 0
+        self.loaded_at = None
+        self.approved_total = 0
+        self.waitlist_total = 0
+        self._by_user = {}
+        self._lock = threading.RLock()
+
+    def load(self, records):
+        """以 get_all_records() 的結果重建整份名單"""
+        with self._lock:
+            self.entries = []
+            self._by_user = {}
+            self.approved_total = 0
+            self.waitlist_total = 0
+            for record in records:
+                self._add(RosterEntry.from_record(record))
+            self.loaded_at = time.monotonic()
+            self.version += 1
+
+    def touch(self):
+        """確認 Sheet 上的內容沒有變動，視為剛同步過"""
+        with self._lock:
+            self.loaded_at = time.monotonic()
+
+    def invalidate(self):
+        """記憶體名單可能與 Sheet 不一致，下一次使用前重新下載"""
+        with self._lock:
+            self.loaded_at = None
+
+    def copy(self):
+        """變動用的複本 (entries 也複製，變動不會影響原本的名單與查詢中的 snapshot)"""
+        with self._lock:
+            other = Roster()
+            for entry in self.entries:
+                other._add(entry.copy())
+            other.version = self.version
+            other.loaded_at = self.loaded_at
+            return other
+
+    def adopt(self, other):
+        """以 copy() 出來並套用完變動的名單取代目前內容 (寫入 Sheet 成功之後)"""
+        with self._lock:
+            self.entries = other.entries
+            self._by_user = other._by_user
+            self.approved_total = other.approved_total
+            self.waitlist_total = other.waitlist_total
+            self.version = max(self.version + 1, other.version)
+
+    def _add(self, entry):
+        self.entries.append(entry)
+        self._by_user.setdefault(entry.user_id, []).append(entry)
+        self._adjust_totals(entry, 1)
+
+    def _adjust_totals(self, entry, sign):
+        if entry.status == STATUS_APPROVED:
+            self.approved_total += sign * entry.count
+        elif entry.status == STATUS_WAITLIST:
+            self.waitlist_total += sign * entry.count
+
+    # --- 查詢 ---
+
+    def user_entries(self, user_id):
+        """該用戶的所有列 (依 Sheet 順序)"""
+        with self._lock:
+            return list(self._by_user.get(user_id, []))
+
+    def row_of(self, entry):
+        """entry 在 Sheet 上的實際列號 (1-based，含標題列)"""
+        with self._lock:
+            return self.entries.index(entry) + 2
+
+    def snapshot(self):
+        """取得目前名單的複本 (給查詢使用，不會被之後的變動影響)"""
+        with self._lock:
+            return list(self.entries)
+
+    def versioned_snapshot(self):
+        """(version, 名單複本)，兩者對應同一個狀態"""
+        with self._lock:
+            return self.version, list(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def plan_promotions(self, max_people):
+        """依報名時間分配空出的名額 (見 allocate_promotions)"""
+        with self._lock:
+            free = max_people - self.approved_total
+            if free <= 0 or self.waitlist_total <= 0:
+                return []
+            waiting = [e for e in self.entries if e.status == STATUS_WAITLIST]
+        return allocate_promotions(waiting, free)
+
+    # --- 變動 ---
+
+    def append(self, entry):
+        with self._lock:
+            self._add(entry)
+            self.version += 1
+            return len(self.entries) + 1
+
+    def update(self, entry, count=None, status=None, timestamp=None):
+        with self._lock:
+            self._adjust_totals(entry, -1)
+            if count is not None:
+                entry.count = count
+            if status is not None:
+                entry.status = status
+            if timestamp is not None:
+                entry.timestamp = timestamp
+            self._adjust_totals(entry, 1)
+            self.version += 1
+
+    def remove(self, entry):
+        with self._lock:
+            self.entries.remove(entry)
+            user_rows = self._by_user.get(entry.user_id, [])
+            user_rows.remove(entry)
+            if not user_rows:
+                self._by_user.pop(entry.user_id, None)
+            self._adjust_totals(entry, -1)
+            self.version += 1
@@ -0,0 +1,177 @@
+import fcntl
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from group_locks import KeyedLocks
+from metrics import metrics
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shared_state (
+    key TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS claims (
+    key TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_claims_expires ON claims (expires_at);
+"""
+
+
+class SharedState:
+    """
+    多個 gunicorn worker (行程) 之間共用的鎖與快取，本機版以檔案 + SQLite 實作
+
+    - lock(key)：跨行程的互斥鎖 (fcntl.flock)，同一個執行緒可以重入
+    - put / get / version：有版本號的共用快取 (值為 JSON)，每次 put 版本號 +1，
+      各 worker 只要比對版本號 (一次本機 SQLite 查詢) 就知道自己的記憶體資料是否過期
+    - claim(key, ttl)：ttl 秒內只有第一個呼叫者成功 (例如 webhook 事件去重)
+
+    多台機器部署時，以相同介面改用 Redis 等共用服務即可。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_dir = path + ".locks"
+        os.makedirs(self.lock_dir, exist_ok=True)
+        self._local = threading.local()
+        self._thread_locks = KeyedLocks()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # --- 跨行程鎖 ---
+
+    def _lock_file(self, key):
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.lock_dir, name + ".lock")
+
+    @contextmanager
+    def lock(self, key):
+        """同一個 key 在所有行程之間互斥 (同一個執行緒再次取得時直接通過)"""
+        held = getattr(self._local, 'held', None)
+        if held is None:
+            held = self._local.held = {}
+        if held.get(key):
+            held[key] += 1
+            try:
+                yield
+            finally:
+                held[key] -= 1
+            return
+
+        # 先在行程內排隊，再以 flock 與其他行程互斥
+        with self._thread_locks.hold(key):
+            with open(self._lock_file(key), "a+") as f:
+                with metrics.span("shared_lock_wait"):
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                held[key] = 1
+                try:
+                    yield
+                finally:
+                    held.pop(key, None)
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    # --- 有版本號的共用快取 ---
+
+    def put(self, key, value):
+        """寫入並回傳新的版本號"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO shared_state (key, version, value, updated_at) VALUES (?, 1, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET version = version + 1, value = excluded.value, "
+                "updated_at = excluded.updated_at",
+                (key, json.dumps(value, ensure_ascii=False), time.time()),
+            )
+            version = conn.execute("SELECT version FROM shared_state WHERE key = ?", (key,)).fetchone()[0]
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return version
+
+    def get(self, key):
+        """回傳 (版本號, 值, 寫入時間)；沒有資料時為 (0, None, 0.0)"""
+        row = self._conn().execute(
+            "SELECT version, value, updated_at FROM shared_state WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return 0, None, 0.0
+        return row[0], json.loads(row[1]), row[2]
+
+    def version(self, key):
+        row = self._conn().execute("SELECT version FROM shared_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    # --- 一次性標記 ---
+
+    def claim(self, key, ttl):
+        """ttl 秒內第一次 claim 回傳 True，之後 (包含其他行程) 回傳 False"""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM claims WHERE expires_at <= ?", (now,))
+            cur = conn.execute("INSERT OR IGNORE INTO claims (key, expires_at) VALUES (?, ?)", (key, now + ttl))
+            claimed = cur.rowcount == 1
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return claimed
+
+
+class FileLease:
+    """
+    以 flock 實作的領導者租約：同一個檔案同時只有一個持有者
+    (例如每個 SQLite 檔案只讓一個 gunicorn worker 執行 SheetMirror)
+
+    acquire() 不等待；持有者的行程結束時作業系統會釋放 flock，其他行程下一次 acquire() 即可接手
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    @property
+    def held(self):
+        return self._file is not None
+
+    def acquire(self):
+        """已持有或成功取得時回傳 True，其他持有者還在時回傳 False"""
+        with self._lock:
+            if self._file is not None:
+                return True
+            f = open(self.path, "a+")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                return False
+            self._file = f
+            return True
+
+    def release(self):
+        with self._lock:
+            if self._file is not None:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+                self._file.close()
+                self._file = None
@@ -0,0 +1,320 @@
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from gspread.exceptions import APIError
+
+from metrics import api_error_status, metrics, record_sheets_error
+from rollover import ARCHIVE_HEADERS
+from roster import RosterEntry, SIGNUP_HEADERS
+from sheets_api import STATS_HEADERS, open_worksheets
+from sqlite_backend import OUTBOX_ARCHIVE, OUTBOX_STATS
+
+logger = logging.getLogger(__name__)
+
+# 遇到這些 HTTP 狀態碼時以指數退避重試 (429 = 超過配額)
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+def _normalize(rows):
+    """轉成可比較的形式：全部轉字串、去掉列尾空白格與結尾的空白列"""
+    result = []
+    for row in rows:
+        cells = ["" if v is None else str(v) for v in row]
+        while cells and cells[-1] == "":
+            cells.pop()
+        result.append(tuple(cells))
+    while result and not result[-1]:
+        result.pop()
+    return result
+
+
+def _rows_by_user(rows):
+    users = OrderedDict()
+    for row in rows:
+        if row:
+            users.setdefault(row[0], []).append(row)
+    return users
+
+
+def _entry_from_sheet_row(row):
+    padded = list(row) + [""] * (len(SIGNUP_HEADERS) - len(row))
+    return RosterEntry.from_record(dict(zip(SIGNUP_HEADERS, padded)))
+
+
+class SheetMirror:
+    """
+    把 SQLite 名單同步到 Google Sheets 的背景工作
+
+    - 報名流程只寫入 SQLite 的 journal 表，webhook 不需等待 Google Sheets
+    - 每 interval 秒把新的日誌套用到鏡像名單，整張 Signups 分頁以一次寫入更新
+    - 每次寫入前 (以及每 edit_check_interval 秒) 以一次 values_batch_get
+      讀回 Signups / Setting / Stats，偵測主辦人在 Sheet 上的手動修改並合併回 SQLite
+    - 結算 (close_event) 的封存列與出席次數記在 outbox 表，寫入 Archive / Stats 分頁後才刪除；
+      還沒寫入前不以 Sheet 上的 Stats 覆蓋 SQLite
+    - 第一次同步前以 sheets_api.open_worksheets 取得分頁 (與 SheetManager 相同的備援與建立規則)
+    - 遇到 429 / 5xx 以指數退避重試，放棄時日誌保留到下一輪
+    - 有 lease (shared_state.FileLease) 時只有持有者同步，多個 worker 共用同一個資料庫也只有一個鏡像；
+      日誌只刪到自己已寫入 Sheet 的序號，還有未同步日誌的用戶不以 Sheet 的內容覆蓋
+    """
+
+    def __init__(self, backend, doc, interval=5, edit_check_interval=30,
+                 signups_title="Signups", setting_title="Setting", stats_title="Stats",
+                 archive_title="Archive", max_retries=5, backoff_base=1.0, backoff_max=60.0, lease=None):
+        self.backend = backend
+        self.doc = doc
+        self.lease = lease
+        self.interval = interval
+        self.edit_check_interval = edit_check_interval
+        self.signups_title = signups_title
+        self.setting_title = setting_title
+        self.stats_title = stats_title
+        self.archive_title = archive_title
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._mirrored = OrderedDict()   # row_id -> row (SQLite 名單的鏡像)
+        self._seq = 0                    # 已套用到 _mirrored 的日誌序號
+        self._written_seq = 0            # 已寫入 Sheet 的日誌序號 (只刪除到這裡)
+        self._last_written = None        # 上次寫入 Sheet 的內容 (不含標題列)
+        self._last_settings = None
+        self._last_stats = None
+        self._remote_stats_rows = 0      # Sheet 上 Stats 的資料列數 (覆寫時清掉多出來的舊列)
+        self._worksheets_ready = False
+        self._archive_ready = False
+        self._last_check = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.flushes = 0
+        self.retries = 0
+        self.merges = 0
+        self.errors = 0
+
+    # --- 背景執行 ---
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sheet-mirror", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.lease is not None:
+            self.lease.release()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sync_once()
+            except Exception:
+                self.errors += 1
+                logger.exception("同步 Google Sheets 失敗，下一輪再試")
+            self._stop.wait(self.interval)
+
+    # --- 同步 ---
+
+    def sync_once(self):
+        """執行一輪同步，回傳是否有寫入 Sheet (沒有取得 lease 時不做任何事)"""
+        if self.lease is not None and not self.lease.acquire():
+            # 其他 worker 負責同步；之後接手時從 SQLite 的最新狀態重新開始
+            self._last_written = None
+            return False
+        if not self._worksheets_ready:
+            self._open_worksheets()
+        if self._last_written is None:
+            self._reset_from_backend()
+
+        pending = self.backend.read_journal(self._seq)
+        outbox = self.backend.read_outbox()
+        check_due = time.monotonic() - self._last_check >= self.edit_check_interval
+        if not pending and not outbox and not check_due and self._last_written is not None:
+            return False
+
+        # 寫入前先讀回 Sheet，避免覆蓋主辦人的手動修改
+        stats_pending = any(kind == OUTBOX_STATS for _, kind, _ in outbox)
+        sheet_rows = self._read_remote(merge_stats=not stats_pending)
+        if self._last_written is None:
+            if sheet_rows and not self._mirrored and not self.backend.read_journal(0, limit=1):
+                # 第一次啟動且 SQLite 為空 (也沒有尚未同步的取消)：以 Sheet 上既有的名單為準
+                self._merge_users(_rows_by_user(sheet_rows).keys(), sheet_rows)
+            self._last_written = sheet_rows
+        elif sheet_rows != self._last_written:
+            # 還有未同步日誌的用戶以 SQLite 為準 (Sheet 上的差異可能只是還沒寫入)
+            unmirrored = self.backend.journal_user_ids(self._seq)
+            changed = [uid for uid in self._changed_users(self._last_written, sheet_rows) if uid not in unmirrored]
+            if changed:
+                self._merge_users(changed, sheet_rows)
+            self._last_written = sheet_rows
+
+        for seq, op, entry in self.backend.read_journal(self._seq):
+            if op == 'delete':
+                self._mirrored.pop(entry.row_id, None)
+            else:
+                self._mirrored[entry.row_id] = entry.to_row()
+            self._seq = seq
+
+        desired = _normalize(self._mirrored.values())
+        wrote = False
+        if desired != self._last_written:
+            self._write(desired)
+            self._last_written = desired
+            self.flushes += 1
+            wrote = True
+        # Sheet 已包含 _seq 以前的所有變動，只刪除這些日誌
+        if self._seq > self._written_seq:
+            self._written_seq = self._seq
+            self.backend.trim_journal(self._written_seq)
+
+        for seq, kind, payload in outbox:
+            if kind == OUTBOX_ARCHIVE:
+                self._append_archive(payload)
+            elif kind == OUTBOX_STATS:
+                self._write_stats()
+            self.backend.trim_outbox(seq)
+            wrote = True
+        return wrote
+
+    def _reset_from_backend(self):
+        entries, seq = self.backend.snapshot_with_seq()
+        self._mirrored = OrderedDict((e.row_id, e.to_row()) for e in entries)
+        self._seq = seq
+        self._written_seq = 0
+
+    def _changed_users(self, before, after):
+        old = _rows_by_user(before)
+        new = _rows_by_user(after)
+        return [uid for uid in set(old) | set(new) if old.get(uid) != new.get(uid)]
+
+    def _merge_users(self, user_ids, sheet_rows):
+        """把 Sheet 上手動修改過的用戶資料寫回 SQLite (該用戶以 Sheet 為準)"""
+        by_user = _rows_by_user(sheet_rows)
+        for uid in user_ids:
+            entries = [_entry_from_sheet_row(r) for r in by_user.get(uid, [])]
+            self.backend.replace_user_entries(uid, entries)
+            self.merges += 1
+        logger.info("偵測到 Sheet 手動修改，已合併 %d 位用戶", len(user_ids))
+
+    # --- Google Sheets I/O ---
+
+    def _open_worksheets(self):
+        """
+        取得 (沒有時建立) Signups / Setting / Stats 分頁；新建立的分頁寫入標題列，
+        Setting / Stats 同時寫入 SQLite 目前的內容，之後讀回時才不會把 SQLite 清空
+        """
+        signups, _, _, created = open_worksheets(
+            self.doc, lambda name, func, *args, **kwargs: self._with_retry(func, *args, **kwargs),
+            self.signups_title, self.setting_title, self.stats_title)
+        # 沒有 Signups 分頁時改用 工作表1 / 第一個分頁
+        self.signups_title = signups.title
+        if self.signups_title in created:
+            self._with_retry(self.doc.values_update, f"'{self.signups_title}'!A1",
+                             params={"valueInputOption": "RAW"}, body={"values": [list(SIGNUP_HEADERS)]})
+        if self.setting_title in created:
+            values = [["項目", "內容"]] + [[k, v] for k, v in self.backend.get_settings().items()]
+            self._with_retry(self.doc.values_update, f"'{self.setting_title}'!A1",
+                             params={"valueInputOption": "RAW"}, body={"values": values})
+        if self.stats_title in created:
+            self._write_stats()
+        self._worksheets_ready = True
+
+    def _read_remote(self, merge_stats=True):
+        """
+        一次讀回 Signups / Setting / Stats；設定與統計有變動時更新 SQLite
+
+        merge_stats=False 時 (SQLite 有尚未寫入 Sheet 的出席次數) 不以 Sheet 上的 Stats 覆蓋 SQLite
+        """
+        self._last_check = time.monotonic()
+        ranges = [f"'{self.signups_title}'!A:F", f"'{self.setting_title}'!A:B", f"'{self.stats_title}'!A:C"]
+        response = self._with_retry(self.doc.values_batch_get, ranges)
+        value_ranges = [vr.get('values', []) for vr in response.get('valueRanges', [])]
+        signups, setting, stats = (value_ranges + [[], [], []])[:3]
+
+        settings = {row[0]: row[1] for row in setting[1:] if len(row) >= 2}
+        if settings and settings != self._last_settings:
+            self.backend.update_settings(settings)
+            self._last_settings = settings
+
+        stats_rows = [tuple((list(r) + ["", "", ""])[:3]) for r in stats[1:] if r]
+        self._remote_stats_rows = len(stats) - 1 if stats else 0
+        if merge_stats and stats_rows != self._last_stats:
+            self.backend.replace_stats(stats_rows)
+            self._last_stats = stats_rows
+
+        return _normalize(signups[1:])
+
+    def _write(self, rows):
+        """以一次 values_update 寫入整份名單 (多出來的舊列以空白覆蓋)"""
+        width = len(SIGNUP_HEADERS)
+        values = [list(SIGNUP_HEADERS)]
+        for row in rows:
+            values.append(list(row) + [""] * (width - len(row)))
+        for _ in range(len(self._last_written or []) - len(rows)):
+            values.append([""] * width)
+        self._with_retry(
+            self.doc.values_update,
+            f"'{self.signups_title}'!A1",
+            params={"valueInputOption": "RAW"},
+            body={"values": values},
+        )
+
+    def _write_stats(self):
+        """以 SQLite 的 stats 表覆寫 Stats 分頁 (結算後的出席次數)"""
+        rows = [tuple(str(v) for v in row) for row in self.backend.get_stats_rows()]
+        values = [list(STATS_HEADERS)] + [list(row) for row in rows]
+        for _ in range(self._remote_stats_rows - len(rows)):
+            values.append(["", "", ""])
+        self._with_retry(
+            self.doc.values_update,
+            f"'{self.stats_title}'!A1",
+            params={"valueInputOption": "RAW"},
+            body={"values": values},
+        )
+        self._remote_stats_rows = len(rows)
+        self._last_stats = rows
+
+    def _append_archive(self, rows):
+        """把結算的名單附加到封存分頁 (沒有時建立；分頁是空的時先加上標題列)"""
+        if not self._archive_ready:
+            worksheets = {ws.title: ws for ws in self._with_retry(self.doc.worksheets)}
+            archive = worksheets.get(self.archive_title)
+            if archive is None:
+                archive = self._with_retry(self.doc.add_worksheet, title=self.archive_title, rows=100,
+                                           cols=len(ARCHIVE_HEADERS))
+            # 上次建立分頁後寫入失敗的話分頁是空的，同樣要補上標題列
+            if not self._with_retry(archive.row_values, 1):
+                rows = [ARCHIVE_HEADERS] + rows
+            self._archive_ready = True
+        self._with_retry(
+            self.doc.values_append,
+            f"'{self.archive_title}'!A1",
+            params={"valueInputOption": "RAW", "insertDataOption": "INSERT_ROWS"},
+            body={"values": rows},
+        )
+
+    def _with_retry(self, func, *args, **kwargs):
+        name = getattr(func, '__name__', 'sheets')
+        attempt = 0
+        while True:
+            try:
+                with metrics.span("sheets", call=name):
+                    return func(*args, **kwargs)
+            except APIError as e:
+                record_sheets_error(name, e)
+                status = api_error_status(e)
+                if status not in RETRYABLE_STATUS or attempt >= self.max_retries:
+                    raise
+                delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+                delay *= 0.5 + random.random() / 2
+                attempt += 1
+                self.retries += 1
+                metrics.inc("sheets_retries_total", call=name)
+                logger.warning("Google Sheets 回應 %s，%.1f 秒後重試 (%d/%d)", status, delay, attempt, self.max_retries)
+                if self._stop.wait(delay):
+                    raise
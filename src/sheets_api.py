@@ -1,77 +1,230 @@
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+from gspread.exceptions import APIError
+import json
+import logging
 import os
-import re
-from datetime import datetime
+import threading
+import time
+from contextlib import contextmanager
 
-class SheetManager:
-    def __init__(self, credentials_file, spreadsheet_url):
-        self.scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+from group_locks import KeyedLocks
+from metrics import api_error_status, metrics, record_sheets_error
+from mutation_plan import MutationPlan
+from roster import Roster, SIGNUP_HEADERS
+from rate_limit import SheetsBusyError, TokenBucket
+from rollover import ARCHIVE_HEADERS, RolloverResult, archive_rows, closed_at_now, roll_attendance
+from sheets_auth import SCOPE, authorize_client
+from stats_index import StatsIndex
+from storage import DEFAULT_SETTINGS, StorageBackend
+
+logger = logging.getLogger(__name__)
+
+# Setting 分頁快取秒數 (在 Sheet 上切換 報名功能 / 人數上限 最晚在這段時間內生效)
+DEFAULT_SETTINGS_TTL = 30
+# 記憶體名單定期與 Signups 分頁重新同步的間隔秒數 (0 = 只在連線時載入)
+DEFAULT_ROSTER_RESYNC_INTERVAL = 60
+
+# Stats 分頁快取秒數 (超過後重新下載；內容沒變時沿用既有索引與 $$ 文字)
+DEFAULT_STATS_TTL = 300
+
+# Signups / Stats 分頁只下載用到的欄位 (Signups 不含 備註)
+SIGNUPS_READ_RANGE = "A1:E"
+STATS_READ_RANGE = "A1:C"
+# 寫入前核對列順序用：Signups 的 User ID 欄 (不含標題列)
+SIGNUPS_ID_RANGE = "A2:A"
+STATS_HEADERS = ["User ID", "Name", "Description"]
+
+# 以試算表為單位序列化名單變動 (同一份試算表的 SheetManager 共用同一把鎖)
+_mutation_locks = KeyedLocks()
+
+
+def discard_mutation_lock(spreadsheet_url):
+    """不再使用的試算表 (例如連線池釋放了它的 manager)：移除它的變動鎖"""
+    _mutation_locks.discard(spreadsheet_url)
+
+# 收到 429 (超過配額) 後暫停所有呼叫的秒數
+QUOTA_PAUSE_SECONDS = 10
+# 等待呼叫額度的最長秒數，超過就拋出 SheetsBusyError
+DEFAULT_RATE_LIMIT_WAIT = 2
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+def sheets_rate_limiter():
+    """
+    所有 SheetManager 共用的 token bucket (同一個服務帳號共用配額)
+
+    SHEETS_RATE_PER_MINUTE 為每分鐘呼叫次數 (0 = 不限制，回傳 None)；
+    多個 worker 行程時請設為 配額 / worker 數
+    """
+    global _rate_limiter
+    per_minute = float(os.getenv('SHEETS_RATE_PER_MINUTE', 0))
+    if per_minute <= 0:
+        return None
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            burst = float(os.getenv('SHEETS_RATE_BURST') or max(1.0, per_minute / 6))
+            _rate_limiter = TokenBucket(per_minute / 60.0, burst)
+        return _rate_limiter
+
+def open_worksheets(doc, call, signups_title="Signups", setting_title="Setting", stats_title="Stats"):
+    """
+    一次列出所有分頁，取得 Signups / Setting / Stats，缺少的分頁建立起來 (SheetManager 與 SheetMirror 共用)
+
+    Signups 找不到時依序使用 工作表1、第一個分頁 (自訂名稱的活動則建立自己的分頁)；
+    新建立的分頁是空白的，標題列由呼叫端補上。call(name, func, *args, **kwargs) 執行 API 呼叫，
+    回傳 (signups, setting, stats, 新建立的分頁名稱)
+    """
+    # 一次列出所有分頁，不逐一嘗試 worksheet()
+    worksheets = {ws.title: ws for ws in call('worksheets', doc.worksheets)}
+    created = set()
+
+    def get_or_add(title, rows, cols):
+        if title in worksheets:
+            return worksheets[title]
+        created.add(title)
+        return call('add_worksheet', doc.add_worksheet, title=title, rows=rows, cols=cols)
+
+    # 取得指定名稱的主分頁 (優先順序: Signups > 工作表1 > 第一個分頁)；
+    # 共用試算表的其他活動 (自訂名稱) 沒有分頁時建立自己的分頁
+    if signups_title in worksheets or signups_title != "Signups":
+        signups = get_or_add(signups_title, 100, len(SIGNUP_HEADERS))
+    elif "工作表1" in worksheets:
+        signups = worksheets["工作表1"]
+    else:
+        # 如果都找不到，就使用第一個分頁
+        signups = doc.sheet1
+
+    setting = get_or_add(setting_title, 20, 2)
+    stats = get_or_add(stats_title, 100, len(STATS_HEADERS))
+    return signups, setting, stats, created
+
+class SheetManager(StorageBackend):
+    """
+    以 Google Sheets 為儲存的報名表 (Signups / Setting / Stats 三個分頁)
+
+    多個活動可以共用同一份試算表，各自使用不同名稱的分頁 (signups_title 等)
+    """
+
+    def __init__(self, credentials_file, spreadsheet_url, settings_ttl=None, roster_resync_interval=None, client=None,
+                 stats_ttl=None, signups_title="Signups", setting_title="Setting", stats_title="Stats",
+                 shared_state=None, conditional_reads=None, archive_title="Archive", rate_limiter=None):
+        self.scope = SCOPE
+        super().__init__()
         self.credentials_file = credentials_file
         self.spreadsheet_url = spreadsheet_url
-        self.client = None
+        self.signups_title = signups_title
+        self.setting_title = setting_title
+        self.stats_title = stats_title
+        self.archive_title = archive_title
+        self.storage_key = spreadsheet_url
+        if signups_title != "Signups":
+            self.storage_key = f"{spreadsheet_url}#{signups_title}"
+        # 可傳入已授權的 gspread client (例如測試用的假 client)，否則在 connect() 時授權
+        self.client = client
         self.sheet = None
+
+        # Google Sheets 呼叫的 token bucket (None 時使用 sheets_rate_limiter() 的設定)
+        self.rate_limiter = rate_limiter if rate_limiter is not None else sheets_rate_limiter()
+        self.rate_limit_wait = float(os.getenv('SHEETS_RATE_LIMIT_WAIT', DEFAULT_RATE_LIMIT_WAIT))
+
+        if settings_ttl is None:
+            settings_ttl = float(os.getenv('SETTINGS_CACHE_TTL', DEFAULT_SETTINGS_TTL))
+        self.settings_ttl = settings_ttl
+        self._settings_cache = None
+        self._settings_cached_at = 0.0
+        self._settings_lock = threading.Lock()
+        # 每個執行緒 (= 每個請求) 各自的設定快照
+        self._local = threading.local()
+
+        if roster_resync_interval is None:
+            roster_resync_interval = float(os.getenv('ROSTER_RESYNC_INTERVAL', DEFAULT_ROSTER_RESYNC_INTERVAL))
+        self.roster_resync_interval = roster_resync_interval
+        self.roster = Roster()
+
+        # 重新下載 Signups / Stats 前先比對試算表的最後修改時間，沒有修改就沿用記憶體中的資料
+        if conditional_reads is None:
+            conditional_reads = os.getenv('SHEETS_CONDITIONAL_READS', 'true').lower() == 'true'
+        self.conditional_reads = conditional_reads
+        self._roster_revision = None
+        # 本機成功寫入 (batch_update) 的次數：自己的寫入也會更新試算表的修改時間，
+        # 下載後寫入過就不必先比對修改時間 (一定不相符)，直接下載
+        self._local_writes = 0
+        self._roster_writes = 0
+        # resync_roster 的次數 (判斷名單在這次變動中是否剛與 Sheet 核對過)
+        self._roster_syncs = 0
+        # 最近一次下載的大小 (bytes)，略過下載時記為節省的流量
+        self._read_sizes = {}
+
+        # 多個 worker 行程共用的鎖與名單 / 設定快取 (SharedState)；None = 只有單一行程
+        self.shared_state = shared_state
+        self._shared_roster_version = None
+
+        if stats_ttl is None:
+            stats_ttl = float(os.getenv('STATS_CACHE_TTL', DEFAULT_STATS_TTL))
+        self.stats_ttl = stats_ttl
+        self.stats_sheet = None
+        self._stats_index = None
+        self._stats_loaded_at = None
+        self._stats_revision = None
+        self._stats_writes = 0
+        self._stats_lock = threading.Lock()
+
         self.connect()
 
+    def _call(self, name, func, *args, **kwargs):
+        """
+        所有 Google Sheets API 呼叫都經過這裡，方便統計次數與耗時
+
+        有 rate_limiter 時先取得呼叫額度，等待超過 rate_limit_wait 秒拋出 SheetsBusyError；
+        收到 429 時暫停所有呼叫 QUOTA_PAUSE_SECONDS 秒
+        """
+        if self.rate_limiter is not None and not self.rate_limiter.acquire(self.rate_limit_wait):
+            metrics.inc("sheets_throttled_total", call=name)
+            raise SheetsBusyError(name)
+        self.api_calls.record(name)
+        with metrics.span("sheets", call=name):
+            try:
+                return func(*args, **kwargs)
+            except APIError as e:
+                record_sheets_error(name, e)
+                if self.rate_limiter is not None and api_error_status(e) == 429:
+                    self.rate_limiter.pause(QUOTA_PAUSE_SECONDS)
+                raise
+
     def connect(self):
         """連線至 Google Sheets"""
         try:
-            creds = ServiceAccountCredentials.from_json_keyfile_name(self.credentials_file, self.scope)
-            self.client = gspread.authorize(creds)
+            if self.client is None:
+                self.client = authorize_client(self.credentials_file, self.scope)
             # 透過 URL 開啟試算表
-            self.doc = self.client.open_by_url(self.spreadsheet_url)
-            
-            # 嘗試取得指定名稱的主分頁 (優先順序: Signups > 工作表1 > 第一個分頁)
-            try:
-                self.sheet = self.doc.worksheet("Signups")
-            except:
-                try:
-                    self.sheet = self.doc.worksheet("工作表1")
-                except:
-                    # 如果都找不到，就使用第一個分頁
-                    self.sheet = self.doc.sheet1
+            self.doc = self._call('open_by_url', self.client.open_by_url, self.spreadsheet_url)
             
-            # 嘗試取得或建立 Setting 分頁
-            try:
-                self.setting_sheet = self.doc.worksheet("Setting")
-            except:
-                self.setting_sheet = self.doc.add_worksheet(title="Setting", rows=20, cols=2)
-                self.setting_sheet.append_row(["項目", "內容"])
-            
-            # 檢查並補齊預設設定
-            current_settings = self.get_settings()
-            default_settings = {
-                "活動標題": "歡樂活動報名",
-                "活動說明": "請準時參加！",
-                "人數上限": "10",
-                "報名功能": "TRUE", # 預設開啟 (CheckBox Checked = TRUE)
-                "查詢功能": "TRUE"
-            }
-            
-            rows_to_append = []
-            for key, value in default_settings.items():
-                if key not in current_settings:
-                    rows_to_append.append([key, value])
-            
-            if rows_to_append:
-                for row in rows_to_append:
-                    self.setting_sheet.append_row(row)
-                    # 如果是開關類的功能，嘗試加入 Checkbox 驗證 (需視 gspread 版本支援度，最簡單是使用者手動設，這裡先只填值)
-                    # 註：API 設定 Checkbox 較複雜，這裡先填入 "TRUE" 字串，使用者在 Sheet 上可選取該格 -> 插入 -> 核取方塊
+            self.sheet, self.setting_sheet, self.stats_sheet, created = open_worksheets(
+                self.doc, self._call, self.signups_title, self.setting_title, self.stats_title)
+
+            # 新建立的 Setting 分頁寫入標題列與預設設定，既有的分頁以一次 append_rows 補齊缺少的設定
+            if self.setting_title in created:
+                rows_to_append = [["項目", "內容"]] + [[k, v] for k, v in DEFAULT_SETTINGS.items()]
+            else:
+                self.invalidate_settings()
+                current_settings = self.get_settings()
+                rows_to_append = [[k, v] for k, v in DEFAULT_SETTINGS.items() if k not in current_settings]
 
+            if rows_to_append:
+                # 註：開關類的功能先填入 "TRUE" 字串，使用者在 Sheet 上可選取該格 -> 插入 -> 核取方塊
+                self._call('append_rows', self.setting_sheet.append_rows, rows_to_append)
+                self.invalidate_settings()
 
             # 確保主表標題列存在
             self._init_headers()
+            # 載入記憶體名單
+            self.resync_roster()
             
-            # 嘗試取得或建立 Stats 分頁
-            try:
-                self.stats_sheet = self.doc.worksheet("Stats")
-            except:
-                self.stats_sheet = self.doc.add_worksheet(title="Stats", rows=100, cols=3)
-                self.stats_sheet.append_row(["User ID", "Name", "Description"])
+            if self.stats_title in created:
+                self._call('append_row', self.stats_sheet.append_row, STATS_HEADERS)
 
         except Exception as e:
-            print(f"Google Sheets 連線失敗: {e}")
+            logger.error("Google Sheets 連線失敗: %s", e)
             raise
 
     def _init_headers(self):
@@ -79,264 +232,414 @@ class SheetManager:
         if not self.sheet:
             return
         
-        headers = ["User ID", "顯示名稱", "報名人數", "狀態", "報名時間", "備註"]
-        current_headers = self.sheet.row_values(1)
+        headers = SIGNUP_HEADERS
+        current_headers = self._call('row_values', self.sheet.row_values, 1)
         if not current_headers:
-            self.sheet.append_row(headers)
+            self._call('append_row', self.sheet.append_row, headers)
+
+    @contextmanager
+    def request_snapshot(self):
+        """請求範圍：範圍內所有 get_settings() 共用同一份設定 (整個請求最多讀取一次)"""
+        local = self._local
+        depth = getattr(local, 'snapshot_depth', 0)
+        local.snapshot_depth = depth + 1
+        try:
+            yield self
+        finally:
+            local.snapshot_depth = depth
+            if depth == 0:
+                local.settings_snapshot = None
+
+    def invalidate_settings(self):
+        """清除設定快取，下一次 get_settings() 會重新讀取 Setting 分頁"""
+        with self._settings_lock:
+            self._settings_cache = None
+            self._settings_cached_at = 0.0
+        self._local.settings_snapshot = None
 
     def get_settings(self):
-        """讀取活動設定"""
+        """讀取活動設定 (快取 settings_ttl 秒)"""
+        local = self._local
+        snapshot = getattr(local, 'settings_snapshot', None)
+        if snapshot is not None:
+            return dict(snapshot)
+
+        with self._settings_lock:
+            cached = self._settings_cache
+            if cached is None or time.monotonic() - self._settings_cached_at >= self.settings_ttl:
+                stale = cached
+                cached = self._shared_settings()
+                if cached is None:
+                    cached = self._fetch_settings()
+                    if cached is None and stale is not None:
+                        # 讀取失敗 (例如超過配額) 時沿用舊的設定，不要退回預設的人數上限
+                        metrics.inc("settings_stale_total")
+                        return dict(stale)
+                    if cached is None:
+                        return {"活動標題": "活動", "人數上限": "10", "報名功能": "開啟", "查詢功能": "開啟"}
+                    if self.shared_state is not None:
+                        self.shared_state.put("settings:" + self.storage_key, cached)
+                self._settings_cache = cached
+                self._settings_cached_at = time.monotonic()
+
+        if getattr(local, 'snapshot_depth', 0) > 0:
+            local.settings_snapshot = cached
+        return dict(cached)
+
+    def _settings_expired(self):
+        if getattr(self._local, 'settings_snapshot', None) is not None:
+            return False
+        with self._settings_lock:
+            return self._settings_cache is None or time.monotonic() - self._settings_cached_at >= self.settings_ttl
+
+    def pending_reads(self):
+        """過期的設定與名單可以同時下載 (兩者互不相依)；設定一定排在第一個"""
+        reads = []
+        if self._settings_expired():
+            reads.append(self.get_settings)
+        if self._roster_is_stale():
+            reads.append(self._ensure_roster)
+        return reads
+
+    def _shared_settings(self):
+        """其他 worker 在 settings_ttl 秒內讀過的設定 (沒有時回傳 None)"""
+        if self.shared_state is None:
+            return None
+        _, settings, updated_at = self.shared_state.get("settings:" + self.storage_key)
+        if settings is None or time.time() - updated_at >= self.settings_ttl:
+            return None
+        return settings
+
+    def _fetch_settings(self):
+        """從 Setting 分頁讀取設定，失敗時回傳 None"""
         try:
-            records = self.setting_sheet.get_all_values()
+            records = self._call('get_all_values', self.setting_sheet.get_all_values)
             settings = {}
             # 跳過標題列，轉成 dict
             for row in records[1:]:
                 if len(row) >= 2:
                     settings[row[0]] = row[1]
             return settings
-        except:
-            return {"活動標題": "活動", "人數上限": "10", "報名功能": "開啟", "查詢功能": "開啟"}
-
-    def is_signup_enabled(self):
-        """檢查報名功能是否開啟 (支援 '開啟' 中文或 'TRUE' 布林字串)"""
-        settings = self.get_settings()
-        val = str(settings.get("報名功能", "TRUE")).upper()
-        return val == "開啟" or val == "TRUE"
+        except Exception as e:
+            logger.warning("讀取 Setting 分頁失敗: %s", e)
+            return None
 
-    def is_query_enabled(self):
-        """檢查查詢功能是否開啟 (支援 '開啟' 中文或 'TRUE' 布林字串)"""
-        settings = self.get_settings()
-        val = str(settings.get("查詢功能", "TRUE")).upper()
-        return val == "開啟" or val == "TRUE"
-
-    def add_signup(self, user_id, user_name, count):
-        """新增或更新報名 (支援部分正取/部分候補)"""
-        return self._reconcile_user_status(user_id, user_name, count)
-
-    def remove_signup(self, user_id, count):
-        """取消報名"""
-        msg = self._reconcile_user_status(user_id, "", -count)
-        # 取消後觸發自動遞補
-        self._check_and_promote_waitlist()
-        return msg
-
-    def _reconcile_user_status(self, user_id, user_name, delta):
-        """核心邏輯：重新計算並分配用戶的 正取/候補 狀態"""
-        settings = self.get_settings()
-        try:
-            max_people = int(settings.get("人數上限", 10))
-        except:
-            max_people = 10
-            
-        records = self.get_all_records_with_row_index()
-        
-        # 1. 蒐集當前用戶資訊與全域正取計數
-        user_rows = [] # (index_in_list, record_dict)
-        other_approved_count = 0
-        current_user_total = 0
-        current_user_name = user_name # 優先使用傳入的名字
-        
-        for i, r in enumerate(records):
-            r_uid = str(r.get('User ID'))
-            r_count = 0
-            try:
-                r_count = int(r.get('報名人數', 0))
-            except: pass
-            
-            status = r.get('狀態')
-            
-            if r_uid == user_id:
-                user_rows.append((i, r))
-                current_user_total += r_count
-                if not current_user_name and r.get('顯示名稱'):
-                    current_user_name = r.get('顯示名稱')
+    @contextmanager
+    def mutation_lock(self):
+        """同一份試算表的名單變動互斥 (查詢不需要取得)；有 shared_state 時跨行程互斥"""
+        with _mutation_locks.hold(self.spreadsheet_url):
+            if self.shared_state is None:
+                yield
             else:
-                if status == '正取':
-                    other_approved_count += r_count
+                with self.shared_state.lock(self.spreadsheet_url):
+                    yield
 
-        # 2. 計算新總數
-        new_total = current_user_total + delta
-        if new_total < 0: new_total = 0
-        
-        if new_total == 0 and current_user_total == 0:
-            return "您尚未報名喔！"
-        
-        if new_total == 0:
-            # 刪除所有該用戶資料 (從後面刪避免 index 跑掉)
-            # 需先將 row index 轉為實際 sheet row index (1-based header + 1-based list = +2)
-            rows_to_delete = sorted([x[0] + 2 for x in user_rows], reverse=True)
-            for r_idx in rows_to_delete:
-                self.sheet.delete_rows(r_idx)
-            return "已取消您的所有報名。"
-
-        # 3. 分配 正取 vs 候補
-        # 剩餘名額 = 上限 - 其他人已佔用的
-        remaining_for_user = max_people - other_approved_count
-        if remaining_for_user < 0: remaining_for_user = 0
-        
-        new_approved = min(new_total, remaining_for_user)
-        new_waitlist = new_total - new_approved
-        
-        # 4. 更新 Google Sheet
-        # 策略：重複利用既有的 row，多餘的刪除，不足的 append
-        # 分類既有 row
-        row_approved_idx = None
-        row_waitlist_idx = None
-        
-        # 尋找既有的正取與候補 row (取第一個找到的)
-        for idx, r in user_rows:
-            if r.get('狀態') == '正取' and row_approved_idx is None:
-                row_approved_idx = idx + 2
-            elif r.get('狀態') == '候補' and row_waitlist_idx is None:
-                row_waitlist_idx = idx + 2
-        
-        # 收集需要刪除的 row (多餘的)
-        rows_to_delete = []
-        used_indices = set()
-        if row_approved_idx: used_indices.add(row_approved_idx)
-        if row_waitlist_idx: used_indices.add(row_waitlist_idx)
-        
-        for idx, r in user_rows:
-            sheet_idx = idx + 2
-            if sheet_idx not in used_indices:
-                rows_to_delete.append(sheet_idx)
-        
-        # 執行刪除 (倒序)
-        for r_idx in sorted(rows_to_delete, reverse=True):
-            self.sheet.delete_rows(r_idx)
-            # 調整 index: 如果刪除的在我們保留的前面，保留的 index 要扣 (稍微複雜，簡單一點：重新整理或相信 gspread)
-            # 為了安全，如果發生刪除，後續的 update 操作可能會有風險。
-            # 但因為我們通常只有 1-2 筆資料，刪除重來可能更簡單？
-            # 不，保留 row 可以保留「報名時間」。
-            # 簡單解法：如果刪了 row，我們手動更新 local 的 row_approved_idx / row_waitlist_idx
-            if row_approved_idx and r_idx < row_approved_idx: row_approved_idx -= 1
-            if row_waitlist_idx and r_idx < row_waitlist_idx: row_waitlist_idx -= 1
-
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        # 更新/建立 正取 Row
-        if new_approved > 0:
-            if row_approved_idx:
-                self.sheet.update_cell(row_approved_idx, 3, new_approved)
-                self.sheet.update_cell(row_approved_idx, 5, timestamp)
-            else:
-                self.sheet.append_row([user_id, current_user_name, new_approved, "正取", timestamp, ""])
-                # Append 後，如果緊接著要 update waitlist，要注意 row count 變了，但 waitlist 是找既有的 index，不受 append 影響
-        else:
-            # 如果原本有正取但現在變成 0 (例如人數上限變少)，前面已經規劃刪除多餘 row
-            # 若 row_approved_idx 仍然存在 (被選為保留的)，則需刪除
-            if row_approved_idx:
-                self.sheet.delete_rows(row_approved_idx)
-                if row_waitlist_idx and row_approved_idx < row_waitlist_idx: row_waitlist_idx -= 1
-
-        # 更新/建立 候補 Row
-        if new_waitlist > 0:
-            if row_waitlist_idx:
-                self.sheet.update_cell(row_waitlist_idx, 3, new_waitlist)
-                self.sheet.update_cell(row_waitlist_idx, 5, timestamp)
-            else:
-                self.sheet.append_row([user_id, current_user_name, new_waitlist, "候補", timestamp, ""])
-        else:
-             if row_waitlist_idx:
-                self.sheet.delete_rows(row_waitlist_idx)
-
-        # 回傳訊息
-        status_msg = ""
-        if new_approved > 0 and new_waitlist > 0:
-            status_msg = f"已更新！ {new_approved} 人正取，{new_waitlist} 人候補。"
-        elif new_approved > 0:
-            status_msg = f"已更新！ {new_approved} 人正取。"
-        elif new_waitlist > 0:
-            status_msg = f"已更新！ {new_waitlist} 人排入候補。"
-            
-        return status_msg
-
-    def _check_and_promote_waitlist(self):
-        """檢查並遞補"""
-        # 取得所有非重複的候補名單 User IDs
-        records = self.sheet.get_all_records()
-        waitlist_users = set()
-        for r in records:
-            if r.get('狀態') == '候補':
-                waitlist_users.add(str(r.get('User ID')))
-        
-        # 逐一重新計算 (因為邏輯共用，直接帶入 delta=0 即可觸發重分配)
-        for uid in waitlist_users:
-            # 找出該 uid 對應名字 (雖然 _reconcile 會自找，但傳入較保險)
-            name = ""
-            for r in records:
-                if str(r.get('User ID')) == uid:
-                    name = r.get('顯示名稱')
+    def apply_signups(self, ops):
+        """
+        依序套用多筆報名變動 [(user_id, user_name, delta), ...]，回傳每筆的結果訊息
+
+        delta > 0 為報名、delta < 0 為取消 (取消後立即觸發遞補，維持先來先遞補)；
+        所有 Sheet 變動合併成一次 batch_update。
+        """
+        with self.mutation_lock():
+            syncs = self._roster_syncs
+            self._ensure_roster()
+            verified = self._roster_syncs != syncs
+            while True:
+                plan = self._new_plan()
+                messages = []
+                for user_id, user_name, delta in ops:
+                    messages.append(self._reconcile_user_status(user_id, user_name, delta, plan))
+                    if delta < 0:
+                        self._check_and_promote_waitlist(plan)
+                # 改寫 / 刪除既有列時，列號來自記憶體名單 (最多 roster_resync_interval 秒前下載)；
+                # 主辦人在這段時間內手動插入或刪除列的話，改以最新的名單重新計算
+                if verified or not plan.targets_existing_rows() or self._rows_match(self.roster):
                     break
-            self._reconcile_user_status(uid, name, 0)
-                    
-    def get_summary(self):
-        """取得統計資訊文字"""
+                metrics.inc("roster_row_mismatch_total")
+                self.resync_roster()
+                verified = True
+            self._flush_plan(plan)
+        return messages
+
+    def _rows_match(self, roster):
+        """Sheet 上的 User ID 欄是否與名單的列順序一致 (只下載一欄)"""
+        values = self._call('get', self.sheet.get, SIGNUPS_ID_RANGE)
+        actual = [str(row[0]) if row else "" for row in values]
+        expected = [entry.user_id for entry in roster.snapshot()]
+        # API 不會回傳結尾的空白列
+        while expected and not expected[-1]:
+            expected.pop()
+        while actual and not actual[-1]:
+            actual.pop()
+        return actual == expected
+
+    def resync_roster(self, conditional=False):
+        """
+        重新下載 Signups 分頁並重建記憶體名單 (用來同步在 Sheet 上的手動修改)
+
+        conditional=True 時試算表自上次下載後沒有修改過就不下載
+        (下載後本機寫入過的話不比對修改時間，直接下載)
+        """
+        with self.mutation_lock():
+            self._roster_syncs += 1
+            writes = self._local_writes
+            revision = self._spreadsheet_revision() if writes == self._roster_writes else None
+            if conditional and revision is not None and revision == self._roster_revision:
+                self.roster.touch()
+                self._skip_read("signups")
+                return self.roster
+            records = self.get_all_records_with_row_index()
+            self.roster.load(records)
+            self._roster_revision = revision
+            self._roster_writes = writes
+            self._publish_roster()
+        return self.roster
+
+    def _spreadsheet_revision(self):
+        """
+        試算表的最後修改時間 (Drive API 的 modifiedTime，只有幾十 bytes)
+
+        會在下載前先取得，下載期間的修改一定會讓下一次比對不相符；
+        停用或取得失敗時回傳 None (一律完整下載)
+        """
+        if not self.conditional_reads:
+            return None
+        try:
+            return self._call('get_lastUpdateTime', self.doc.get_lastUpdateTime)
+        except Exception as e:
+            if isinstance(e, APIError) and api_error_status(e) in (403, 404):
+                # 沒有啟用 Drive API 或沒有權限：之後不再嘗試
+                self.conditional_reads = False
+            logger.warning("無法取得試算表修改時間，改為完整下載: %s", e)
+            return None
+
+    def _skip_read(self, sheet):
+        metrics.inc("sheets_reads_skipped_total", sheet=sheet)
+        metrics.inc("sheets_read_bytes_saved_total", self._read_sizes.get(sheet, 0), sheet=sheet)
+
+    def _read_records(self, worksheet, range_name, sheet):
+        """
+        只下載 range_name 範圍 (API 不會回傳結尾的空白列)，轉成 {標題: 值} 的 list
+
+        值一律是字串；中間的空白列保留，列號才會與 Sheet 一致
+        """
+        values = self._call('get', worksheet.get, range_name)
+        size = len(json.dumps(values, ensure_ascii=False).encode("utf-8"))
+        self._read_sizes[sheet] = size
+        metrics.inc("sheets_read_bytes_total", size, sheet=sheet)
+        rows = [list(row) for row in values]
+        while rows and not any(str(v) for v in rows[-1]):
+            rows.pop()
+        if not rows:
+            return []
+        headers = [str(h) for h in rows[0]]
+        return [dict(zip(headers, row + [""] * (len(headers) - len(row)))) for row in rows[1:]]
+
+    def _publish_roster(self):
+        """把目前名單寫入共用快取，其他 worker 比對版本號後直接載入 (須持有 mutation_lock)"""
+        if self.shared_state is None:
+            return
+        rows = [entry.to_row() for entry in self.roster.snapshot()]
+        self._shared_roster_version = self.shared_state.put("roster:" + self.storage_key, rows)
+
+    def _sync_shared_roster(self):
+        """其他 worker 改過名單時 (版本號不同)，從共用快取載入，不需讀取 Google Sheets"""
+        key = "roster:" + self.storage_key
+        if self.shared_state.version(key) == self._shared_roster_version:
+            return
+        with self.mutation_lock():
+            version, rows, _ = self.shared_state.get(key)
+            if version == self._shared_roster_version or rows is None:
+                return
+            self.roster.load([dict(zip(SIGNUP_HEADERS, row)) for row in rows])
+            self._shared_roster_version = version
+        metrics.inc("shared_roster_reloads_total")
+
+    def _roster_is_stale(self):
+        loaded_at = self.roster.loaded_at
+        if loaded_at is None:
+            return True
+        return self.roster_resync_interval > 0 and time.monotonic() - loaded_at >= self.roster_resync_interval
+
+    def _ensure_roster(self):
+        """
+        取得記憶體名單，超過 roster_resync_interval 秒就重新同步一次
+
+        有 shared_state 時先確認其他 worker 是否改過名單 (變動流程在鎖內呼叫，
+        因此一定以最新的名單計算名額，不會超收)
+        """
+        if self.shared_state is not None:
+            self._sync_shared_roster()
+        if self._roster_is_stale():
+            with self.mutation_lock():
+                # 取得鎖後再確認一次，避免多個請求同時重新下載
+                if self._roster_is_stale():
+                    self.resync_roster(conditional=True)
+        return self.roster
+
+    # --- 名單變動：套用在名單複本 (plan.roster) 上，Sheet 的對應動作收集到 MutationPlan 中 ---
+    # 因為兩邊依相同順序套用，記錄當下的列號在 batch_update 執行時仍然正確；
+    # batch_update 成功後複本才取代記憶體名單，失敗時記憶體名單維持原狀
+
+    def _user_entries(self, user_id, plan):
+        return plan.roster.user_entries(user_id)
+
+    def _approved_total(self, plan):
+        return plan.roster.approved_total
+
+    def _plan_promotions(self, max_people, plan):
+        return plan.roster.plan_promotions(max_people)
+
+    def _append_entry(self, entry, plan):
+        plan.append_row(entry.to_row())
+        plan.roster.append(entry)
+
+    def _update_entry(self, entry, plan, count=None, status=None, timestamp=None):
+        plan.roster.update(entry, count=count, status=status, timestamp=timestamp)
+        plan.update_row(plan.roster.row_of(entry), entry.to_row())
+
+    def _delete_entry(self, entry, plan):
+        plan.delete_row(plan.roster.row_of(entry))
+        plan.roster.remove(entry)
+
+    def _new_plan(self):
+        return MutationPlan(self.sheet.id, roster=self.roster.copy())
+
+    def _flush_plan(self, plan):
+        """
+        以單一 batch_update 寫入所有變動，成功後以 plan.roster 取代記憶體名單 (須持有 mutation_lock)
+
+        失敗時記憶體名單維持原狀，但逾時等情況無法確定 Sheet 端是否已套用，因此標記名單過期，
+        下一次變動前重新下載；不在這裡立即重新下載 (收到 429 後呼叫額度暫停中，重新下載也只會失敗)
+        """
+        if not len(plan):
+            return
+        try:
+            self._call('batch_update', self.doc.batch_update, plan.to_body())
+        except Exception:
+            self._invalidate_roster()
+            raise
+        self._local_writes += 1
+        self.roster.adopt(plan.roster)
+        self._publish_roster()
+
+    def _invalidate_roster(self):
+        self.roster.invalidate()
+        self._roster_revision = None
+
+    def get_summary(self, page=1):
+        """取得統計資訊文字 (名單版本與設定都沒變時直接使用快取的文字)"""
         settings = self.get_settings()
-        title = settings.get("活動標題", "活動報名")
-        desc = settings.get("活動說明", "")
-        
-        records = self.sheet.get_all_records()
-        total_count = 0
-        summary_lines = []
-        
-        summary_lines.append(f"🎉 {title}")
-        if desc:
-            summary_lines.append(f"� {desc}")
-        summary_lines.append("----------------")
-        
-        for idx, record in enumerate(records):
-             try:
-                 c = int(record.get('報名人數', 0))
-             except:
-                 c = 0
-             status = record.get('狀態', '正取')
-             if status == '正取':
-                 total_count += c
-             
-             name = record.get('顯示名稱', 'Unknown')
-             # 簡單排版
-             icon = "✅" if status == "正取" else "⏳"
-             summary_lines.append(f"{idx+1}. {name} (+{c}) {icon}{status}")
-             
-        summary_lines.append("----------------")
-        summary_lines.append(f"目前正取人數: {total_count} / 上限 {settings.get('人數上限', 10)}")
-        
-        return "\n".join(summary_lines)
+        roster = self._ensure_roster()
+        text = self.summary_renderer.cached(settings, roster.version, page)
+        if text is not None:
+            return text
+        version, entries = roster.versioned_snapshot()
+        return self.summary_renderer.render(settings, entries, version=version, page=page)
+
+    # --- 結算 ---
+
+    def _archive_sheet(self):
+        """
+        封存分頁 (沒有時建立)，回傳 (worksheet, 是否需要標題列)
+
+        建立分頁不在 batch_update 內，上次結算在建立後寫入失敗的話分頁會是空的，因此以第一列是否為空判斷
+        """
+        worksheets = {ws.title: ws for ws in self._call('worksheets', self.doc.worksheets)}
+        archive = worksheets.get(self.archive_title)
+        if archive is not None:
+            return archive, not self._call('row_values', archive.row_values, 1)
+        archive = self._call('add_worksheet', self.doc.add_worksheet, title=self.archive_title, rows=100,
+                             cols=len(ARCHIVE_HEADERS))
+        return archive, True
+
+    def close_event(self):
+        """
+        結算目前的活動
+
+        封存列、Stats 的出席次數與清空 Signups 合併成一次 batch_update (整批成功或整批失敗)；
+        結算期間其他報名指令會等待 mutation_lock
+        """
+        with self.mutation_lock():
+            self.resync_roster(conditional=True)
+            entries = self.roster.snapshot()
+            title = self.get_settings().get("活動標題", "")
+            closed_at = closed_at_now()
+
+            stats_records = self._read_records(self.stats_sheet, STATS_READ_RANGE, "stats")
+            stats_rows = [(r.get('User ID'), r.get('Name'), r.get('Description')) for r in stats_records]
+            updates, appends = roll_attendance(stats_rows, entries)
+
+            archive, needs_header = self._archive_sheet()
+            rows = archive_rows(title, closed_at, entries)
+            plan = self._new_plan()
+            plan.append_rows(([ARCHIVE_HEADERS] if needs_header else []) + rows, sheet_id=archive.id)
+            for i, description in sorted(updates.items()):
+                # Stats 的 Description 在第 3 欄，第 i 筆資料在第 i + 2 列
+                plan.update_cell(i + 2, 3, description, sheet_id=self.stats_sheet.id)
+            plan.append_rows([list(row) for row in appends], sheet_id=self.stats_sheet.id)
+            plan.delete_rows(2, len(entries) + 1)
+            if len(plan):
+                # 與 _flush_plan 相同：失敗時無法確定 Sheet 端是否已套用，標記名單過期
+                try:
+                    self._call('batch_update', self.doc.batch_update, plan.to_body())
+                except Exception:
+                    self._invalidate_roster()
+                    raise
+                self._local_writes += 1
+
+            self.roster.load([])
+            self._roster_revision = None
+            self._publish_roster()
+        self.invalidate_stats()
+        metrics.inc("events_closed_total")
+        return RolloverResult(title, closed_at, len(rows), len(updates) + len(appends))
 
     def get_all_records_with_row_index(self):
-        """輔助函式：取得資料並自行處理 (get_all_records 有時標題對不上會怪怪的)"""
-        return self.sheet.get_all_records()
+        """輔助函式：取得資料並自行處理 (只下載 User ID ~ 報名時間 五欄)"""
+        return self._read_records(self.sheet, SIGNUPS_READ_RANGE, "signups")
+
+    def invalidate_stats(self):
+        """清除 Stats 快取，下一次查詢會重新下載"""
+        with self._stats_lock:
+            self._stats_loaded_at = None
+            self._stats_revision = None
+
+    def _get_stats_index(self):
+        """
+        取得 Stats 索引，超過 stats_ttl 秒先比對試算表修改時間，有修改才重新下載；
+        內容相同時沿用原本的索引 (含 $$ 文字)
+        """
+        with self._stats_lock:
+            loaded_at = self._stats_loaded_at
+            if self._stats_index is not None and loaded_at is not None and time.monotonic() - loaded_at < self.stats_ttl:
+                return self._stats_index
+            writes = self._local_writes
+            revision = self._spreadsheet_revision() if writes == self._stats_writes else None
+            if self._stats_index is not None and revision is not None and revision == self._stats_revision:
+                self._stats_loaded_at = time.monotonic()
+                self._skip_read("stats")
+                return self._stats_index
+            records = self._read_records(self.stats_sheet, STATS_READ_RANGE, "stats")
+            rows = [(r.get('User ID'), r.get('Name'), r.get('Description')) for r in records]
+            current = self._stats_index
+            if current is None or [(str(u), str(n), str(d)) for u, n, d in rows] != current.rows:
+                version = current.version + 1 if current else 1
+                self._stats_index = StatsIndex(rows, version=version)
+            self._stats_loaded_at = time.monotonic()
+            self._stats_revision = revision
+            self._stats_writes = writes
+            return self._stats_index
 
     def query_stats(self, user_id=None, name=None):
-        """查詢統計資料"""
+        """查詢統計資料 (User ID 完全相符；名稱忽略全半形 / 大小寫 / 空白，找不到時以前綴比對)"""
         if not self.stats_sheet:
             return []
-            
-        records = self.stats_sheet.get_all_records()
-        results = []
-        
-        for record in records:
-            # 根據 User ID 查詢
-            if user_id and str(record.get('User ID')) == user_id:
-                results.append(f"{record.get('Description')} ({record.get('Name')})")
-            # 根據 Name 查詢 (如果不完全匹配，可以改用 in)
-            elif name and str(record.get('Name')) == name:
-                results.append(f"{record.get('Description')} ({record.get('Name')})")
-                
-        return results
+        return self._get_stats_index().query(user_id=user_id, name=name)
 
     def get_all_stats(self):
         """取得所有統計資料"""
         if not self.stats_sheet:
             return "尚無資料"
-            
-        records = self.stats_sheet.get_all_records()
-        if not records:
-             return "尚無資料"
-
-        lines = ["📊 統計資料一覽:"]
-        for record in records:
-            lines.append(f"{record.get('Name')}: {record.get('Description')}")
-            
-        return "\n".join(lines)
+        return self._get_stats_index().render_all()
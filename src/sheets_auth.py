@@ -0,0 +1,122 @@
+import datetime
+import logging
+import os
+import threading
+
+import gspread
+from google.auth.transport.requests import AuthorizedSession, Request
+from google.oauth2.service_account import Credentials
+from requests.adapters import HTTPAdapter
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SCOPE = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+
+# 在 token 到期前多少秒就先在背景更新 (需大於 google-auth 自行更新的門檻 3 分 45 秒)
+DEFAULT_REFRESH_MARGIN = 600
+# 連線池大小 (同時進行的 Google Sheets 請求數)
+DEFAULT_POOL_SIZE = 10
+# 更新失敗後多久再試
+REFRESH_RETRY_SECONDS = 30
+# 兩次更新之間至少間隔的秒數 (token 有效期比 margin 還短時避免連續更新)
+MIN_REFRESH_INTERVAL = 10
+
+
+def _utcnow():
+    # google-auth 的 expiry 是不含時區的 UTC 時間
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def build_session(credentials, pool_size=DEFAULT_POOL_SIZE):
+    """
+    建立所有 Google Sheets 呼叫共用的 keep-alive session
+
+    連線池大小設為 pool_size，多個執行緒同時呼叫時不必各自重新建立 TLS 連線
+    """
+    session = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    return session
+
+
+class TokenRefresher:
+    """
+    在 access token 到期前 margin 秒，於背景執行緒更新 token
+
+    請求流程中 credentials 永遠是有效的，不會在處理指令時遇到更新 token 的等待。
+    """
+
+    def __init__(self, credentials, margin=DEFAULT_REFRESH_MARGIN, request=None):
+        self.credentials = credentials
+        self.margin = margin
+        self.request = request or Request()
+        self.refreshes = 0
+        self.failures = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="token-refresher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def seconds_until_refresh(self):
+        expiry = getattr(self.credentials, 'expiry', None)
+        if not getattr(self.credentials, 'token', None) or expiry is None:
+            return 0.0
+        return max(0.0, (expiry - _utcnow()).total_seconds() - self.margin)
+
+    def refresh(self):
+        """立即更新 token，成功回傳 True"""
+        try:
+            with metrics.span("token_refresh"):
+                self.credentials.refresh(self.request)
+        except Exception as e:
+            self.failures += 1
+            metrics.inc("token_refresh_failures_total")
+            logger.warning("更新 Google access token 失敗，%d 秒後再試: %s", REFRESH_RETRY_SECONDS, e)
+            return False
+        self.refreshes += 1
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            wait = self.seconds_until_refresh()
+            if wait <= 0:
+                if self.refresh():
+                    wait = max(self.seconds_until_refresh(), MIN_REFRESH_INTERVAL)
+                else:
+                    wait = REFRESH_RETRY_SECONDS
+            self._stop.wait(wait)
+
+
+def authorize_client(credentials_file, scope=SCOPE, pool_size=None, refresh_margin=None):
+    """
+    以 Service Account 金鑰檔授權 gspread client
+
+    - 使用 google-auth 的 credentials，token 由 TokenRefresher 在背景提前更新
+    - 所有呼叫共用同一個有連線池的 session (client.token_refresher 可取得更新狀態)
+    """
+    if pool_size is None:
+        pool_size = int(os.getenv('SHEETS_HTTP_POOL_SIZE', DEFAULT_POOL_SIZE))
+    if refresh_margin is None:
+        refresh_margin = float(os.getenv('SHEETS_TOKEN_REFRESH_MARGIN', DEFAULT_REFRESH_MARGIN))
+    credentials = Credentials.from_service_account_file(credentials_file, scopes=scope)
+    session = build_session(credentials, pool_size=pool_size)
+
+    refresher = TokenRefresher(credentials, margin=refresh_margin)
+    # 第一次取得 token 也在背景進行 (失敗時第一個請求會由 AuthorizedSession 自行取得)
+    refresher.start()
+
+    client = gspread.Client(credentials, session=session)
+    client.token_refresher = refresher
+    return client
@@ -0,0 +1,109 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class _Batch:
+    def __init__(self):
+        self.ops = []
+        self.callbacks = []
+        self.messages = None
+        self.summary = None
+        self.error = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class SignupBatcher:
+    """
+    報名尖峰的微批次處理
+
+    同一份試算表在 window 秒內收到的 +N / -N 會依到達順序合併：
+    第一個到達的請求負責等待視窗結束、以一次 apply_signups (一次 batch_update) 套用整批，
+    並只產生一次名單摘要；其他請求各自取得自己的狀態訊息。
+    idle 秒內沒有新的指令加入時提早送出 (預設為 window 的 1/4)，單獨的指令不必等完整個視窗。
+
+    有 callback 的請求加入批次後立即返回，由送出批次的執行緒呼叫 callback，
+    每份試算表只有負責送出的那個 webhook worker 在等待，其他 worker 可以繼續處理別的群組；
+    沒有 callback 時等待整批完成後回傳結果 (每個等待中的指令各佔用一個執行緒)。
+    """
+
+    def __init__(self, window=0.2, max_batch=50, idle=None):
+        self.window = window
+        self.idle = idle if idle is not None else window / 4
+        self.max_batch = max_batch
+        self._open = {}
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.commands = 0
+
+    def submit(self, manager, user_id, user_name, delta, callback=None):
+        """
+        沒有 callback 時回傳 (此指令的結果訊息, 整批套用後的名單摘要)；
+        有 callback 時整批套用後呼叫 callback(結果訊息, 名單摘要, 例外) (成功時例外為 None)
+        """
+        key = manager.storage_key
+        with self._lock:
+            batch = self._open.get(key)
+            is_leader = batch is None
+            if is_leader:
+                batch = _Batch()
+                self._open[key] = batch
+            index = len(batch.ops)
+            batch.ops.append((user_id, user_name, delta))
+            if callback is not None:
+                batch.callbacks.append((index, callback))
+            if len(batch.ops) >= self.max_batch:
+                # 批次已滿，不再接受新指令並通知負責的請求提早送出
+                self._open.pop(key, None)
+                batch.full.set()
+
+        if is_leader:
+            self._wait_for_batch(batch)
+            with self._lock:
+                if self._open.get(key) is batch:
+                    del self._open[key]
+                self.batches += 1
+                self.commands += len(batch.ops)
+            try:
+                batch.messages = manager.apply_signups(batch.ops)
+                batch.summary = manager.get_summary()
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+            self._run_callbacks(batch)
+        elif callback is None:
+            batch.done.wait()
+
+        if callback is not None:
+            return None
+        if batch.error is not None:
+            raise batch.error
+        return batch.messages[index], batch.summary
+
+    def _run_callbacks(self, batch):
+        for index, callback in batch.callbacks:
+            try:
+                if batch.error is not None:
+                    callback(None, None, batch.error)
+                else:
+                    callback(batch.messages[index], batch.summary, None)
+            except Exception:
+                logger.exception("批次報名的回覆失敗")
+
+    def _wait_for_batch(self, batch):
+        """等到批次已滿、視窗結束，或 idle 秒內沒有新的指令加入"""
+        deadline = time.monotonic() + self.window
+        seen = 1
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or batch.full.wait(min(self.idle, remaining)):
+                return
+            with self._lock:
+                count = len(batch.ops)
+            if count == seen:
+                return
+            seen = count
@@ -0,0 +1,354 @@
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from rollover import RolloverResult, archive_rows, closed_at_now, roll_attendance
+from roster import RosterEntry, STATUS_APPROVED, STATUS_WAITLIST, allocate_promotions
+from stats_index import StatsIndex
+from storage import DEFAULT_SETTINGS, StorageBackend
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS signups (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    name TEXT NOT NULL DEFAULT '',
+    count INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    signup_time TEXT NOT NULL DEFAULT '',
+    note TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_signups_user ON signups (user_id);
+CREATE INDEX IF NOT EXISTS idx_signups_status ON signups (status, signup_time);
+
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS stats (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL DEFAULT '',
+    name TEXT NOT NULL DEFAULT '',
+    description TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_stats_user ON stats (user_id);
+CREATE INDEX IF NOT EXISTS idx_stats_name ON stats (name);
+
+-- 已結算活動的名單 (欄位同 rollover.ARCHIVE_HEADERS)
+CREATE TABLE IF NOT EXISTS archive (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL DEFAULT '',
+    closed_at TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    name TEXT NOT NULL DEFAULT '',
+    count INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    signup_time TEXT NOT NULL DEFAULT ''
+);
+
+-- 報名變動日誌 (只增不改)，供背景同步至 Google Sheets 使用
+CREATE TABLE IF NOT EXISTS journal (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    op TEXT NOT NULL,
+    row_id INTEGER NOT NULL,
+    user_id TEXT NOT NULL DEFAULT '',
+    name TEXT NOT NULL DEFAULT '',
+    count INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT '',
+    signup_time TEXT NOT NULL DEFAULT '',
+    note TEXT NOT NULL DEFAULT ''
+);
+
+-- 結算後要寫到 Google Sheets 的封存列與 Stats (同 journal，由 SheetMirror 送出後刪除)
+CREATE TABLE IF NOT EXISTS outbox (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL DEFAULT ''
+);
+"""
+
+JOURNAL_INSERT = 'insert'
+JOURNAL_UPDATE = 'update'
+JOURNAL_DELETE = 'delete'
+
+# outbox 的種類：archive = 附加封存列 (payload 為列的 JSON)、stats = 以 stats 表覆寫 Stats 分頁
+OUTBOX_ARCHIVE = 'archive'
+OUTBOX_STATS = 'stats'
+
+_SIGNUP_COLUMNS = "id, user_id, name, count, status, signup_time, note"
+
+
+def _entry_from_row(row):
+    return RosterEntry(row[1], row[2], row[3], row[4], row[5], row[6], row_id=row[0])
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    以本機 SQLite 為儲存的報名表
+
+    每個執行緒使用自己的連線 (WAL 模式，查詢可與寫入同時進行)；
+    一次 apply_signups 的所有變動在同一個 BEGIN IMMEDIATE 交易內完成，
+    同一個資料庫檔案的寫入 (包含其他行程) 會自動序列化。
+
+    journal=True 時每筆名單變動會在同一個交易內寫入 journal 表 (結算的封存列與出席次數寫入 outbox 表)，
+    由 SheetMirror 在背景批次同步到 Google Sheets。
+    """
+
+    def __init__(self, path, journal=False):
+        super().__init__()
+        self.path = path
+        self.journal = journal
+        self.storage_key = "sqlite:" + os.path.abspath(path)
+        self._local = threading.local()
+        self._stats_index = None
+        self._stats_signature = None
+        self._stats_lock = threading.Lock()
+
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)",
+                list(DEFAULT_SETTINGS.items()),
+            )
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # isolation_level=None：由 _transaction 自行控制 BEGIN / COMMIT
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    # --- 設定 ---
+
+    def get_settings(self):
+        rows = self._conn().execute("SELECT key, value FROM settings").fetchall()
+        return dict(rows)
+
+    def set_setting(self, key, value):
+        self.update_settings({key: value})
+
+    # --- 報名 ---
+
+    def apply_signups(self, ops):
+        with self._transaction() as conn:
+            messages = []
+            for user_id, user_name, delta in ops:
+                messages.append(self._reconcile_user_status(user_id, user_name, delta, conn))
+                if delta < 0:
+                    self._check_and_promote_waitlist(conn)
+        return messages
+
+    def get_entries(self):
+        """目前名單 (依報名順序)"""
+        rows = self._conn().execute(f"SELECT {_SIGNUP_COLUMNS} FROM signups ORDER BY id").fetchall()
+        return [_entry_from_row(r) for r in rows]
+
+    def get_summary(self, page=1):
+        # 名單在本機，每次重新讀取；各列文字仍由 summary_renderer 快取
+        return self.summary_renderer.render(self.get_settings(), self.get_entries(), page=page)
+
+    def _user_entries(self, user_id, conn):
+        rows = conn.execute(
+            f"SELECT {_SIGNUP_COLUMNS} FROM signups WHERE user_id = ? ORDER BY id", (user_id,)
+        ).fetchall()
+        return [_entry_from_row(r) for r in rows]
+
+    def _approved_total(self, conn):
+        row = conn.execute(
+            "SELECT COALESCE(SUM(count), 0) FROM signups WHERE status = ?", (STATUS_APPROVED,)
+        ).fetchone()
+        return row[0]
+
+    def _plan_promotions(self, max_people, conn):
+        free = max_people - self._approved_total(conn)
+        if free <= 0:
+            return []
+        rows = conn.execute(
+            f"SELECT {_SIGNUP_COLUMNS} FROM signups WHERE status = ? ORDER BY signup_time, id",
+            (STATUS_WAITLIST,),
+        ).fetchall()
+        return allocate_promotions([_entry_from_row(r) for r in rows], free)
+
+    def _journal(self, conn, op, entry):
+        if not self.journal:
+            return
+        conn.execute(
+            "INSERT INTO journal (op, row_id, user_id, name, count, status, signup_time, note) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (op, entry.row_id, entry.user_id, entry.name, entry.count, entry.status, entry.timestamp, entry.note),
+        )
+
+    def _append_entry(self, entry, conn):
+        cur = conn.execute(
+            "INSERT INTO signups (user_id, name, count, status, signup_time, note) VALUES (?, ?, ?, ?, ?, ?)",
+            (entry.user_id, entry.name, entry.count, entry.status, entry.timestamp, entry.note),
+        )
+        entry.row_id = cur.lastrowid
+        self._journal(conn, JOURNAL_INSERT, entry)
+
+    def _update_entry(self, entry, conn, count=None, status=None, timestamp=None):
+        if count is not None:
+            entry.count = count
+        if status is not None:
+            entry.status = status
+        if timestamp is not None:
+            entry.timestamp = timestamp
+        conn.execute(
+            "UPDATE signups SET count = ?, status = ?, signup_time = ? WHERE id = ?",
+            (entry.count, entry.status, entry.timestamp, entry.row_id),
+        )
+        self._journal(conn, JOURNAL_UPDATE, entry)
+
+    def _delete_entry(self, entry, conn):
+        conn.execute("DELETE FROM signups WHERE id = ?", (entry.row_id,))
+        self._journal(conn, JOURNAL_DELETE, entry)
+
+    # --- 結算 ---
+
+    def close_event(self):
+        """封存、出席次數與清空名單在同一個交易內完成 (清空的列照常寫入 journal)"""
+        title = self.get_settings().get("活動標題", "")
+        closed_at = closed_at_now()
+        with self._transaction() as conn:
+            entries = [_entry_from_row(r) for r in conn.execute(f"SELECT {_SIGNUP_COLUMNS} FROM signups ORDER BY id")]
+            stats = conn.execute("SELECT id, user_id, name, description FROM stats ORDER BY id").fetchall()
+            updates, appends = roll_attendance([r[1:] for r in stats], entries)
+            rows = archive_rows(title, closed_at, entries)
+            conn.executemany(
+                "INSERT INTO archive (title, closed_at, user_id, name, count, status, signup_time) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            conn.executemany("UPDATE stats SET description = ? WHERE id = ?",
+                             [(description, stats[i][0]) for i, description in updates.items()])
+            conn.executemany("INSERT INTO stats (user_id, name, description) VALUES (?, ?, ?)", appends)
+            if self.journal:
+                if rows:
+                    conn.execute("INSERT INTO outbox (kind, payload) VALUES (?, ?)",
+                                 (OUTBOX_ARCHIVE, json.dumps(rows, ensure_ascii=False)))
+                if updates or appends:
+                    conn.execute("INSERT INTO outbox (kind) VALUES (?)", (OUTBOX_STATS,))
+            for entry in reversed(entries):
+                self._delete_entry(entry, conn)
+        # 只改 description 時 (MAX(id), COUNT(*)) 不變，強制下一次查詢重建索引
+        with self._stats_lock:
+            self._stats_signature = None
+        return RolloverResult(title, closed_at, len(rows), len(updates) + len(appends))
+
+    # --- 同步用 ---
+
+    def read_journal(self, after_seq, limit=1000):
+        """讀取 seq > after_seq 的日誌，回傳 [(seq, op, entry), ...]"""
+        rows = self._conn().execute(
+            "SELECT seq, op, row_id, user_id, name, count, status, signup_time, note "
+            "FROM journal WHERE seq > ? ORDER BY seq LIMIT ?",
+            (after_seq, limit),
+        ).fetchall()
+        return [(r[0], r[1], RosterEntry(r[3], r[4], r[5], r[6], r[7], r[8], row_id=r[2])) for r in rows]
+
+    def journal_user_ids(self, after_seq):
+        """seq > after_seq 的日誌涉及的用戶 (還沒同步到 Google Sheets 的變動)"""
+        rows = self._conn().execute("SELECT DISTINCT user_id FROM journal WHERE seq > ?", (after_seq,)).fetchall()
+        return {r[0] for r in rows}
+
+    def trim_journal(self, upto_seq):
+        """刪除已同步完成的日誌"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM journal WHERE seq <= ?", (upto_seq,))
+
+    def read_outbox(self):
+        """讀取尚未寫到 Google Sheets 的結算資料，回傳 [(seq, kind, payload), ...]"""
+        rows = self._conn().execute("SELECT seq, kind, payload FROM outbox ORDER BY seq").fetchall()
+        return [(seq, kind, json.loads(payload) if payload else None) for seq, kind, payload in rows]
+
+    def trim_outbox(self, upto_seq):
+        """刪除已寫入 Google Sheets 的結算資料"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM outbox WHERE seq <= ?", (upto_seq,))
+
+    def get_stats_rows(self):
+        """整份統計資料 [(user_id, name, description), ...] (依原本順序)"""
+        return self._conn().execute("SELECT user_id, name, description FROM stats ORDER BY id").fetchall()
+
+    def snapshot_with_seq(self):
+        """在同一個交易內取得目前名單與最新的日誌序號"""
+        with self._transaction() as conn:
+            rows = conn.execute(f"SELECT {_SIGNUP_COLUMNS} FROM signups ORDER BY id").fetchall()
+            seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM journal").fetchone()[0]
+        return [_entry_from_row(r) for r in rows], seq
+
+    def replace_user_entries(self, user_id, entries):
+        """
+        以外部 (例如在 Sheet 上手動修改) 的資料取代該用戶的報名列
+
+        盡量沿用既有列的 id，讓該用戶在名單中的位置不變
+        """
+        with self._transaction() as conn:
+            existing = self._user_entries(user_id, conn)
+            for old, new in zip(existing, entries):
+                conn.execute(
+                    "UPDATE signups SET name = ?, count = ?, status = ?, signup_time = ?, note = ? WHERE id = ?",
+                    (new.name, new.count, new.status, new.timestamp, new.note, old.row_id),
+                )
+                new.row_id = old.row_id
+                self._journal(conn, JOURNAL_UPDATE, new)
+            for old in existing[len(entries):]:
+                self._delete_entry(old, conn)
+            for new in entries[len(existing):]:
+                self._append_entry(new, conn)
+
+    def update_settings(self, settings):
+        """一次寫入多個設定值"""
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO settings (key, value) VALUES (?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                [(k, str(v)) for k, v in settings.items()],
+            )
+
+    # --- 統計 ---
+
+    def _get_stats_index(self):
+        """Stats 索引；replace_stats 會換掉所有 id，以 (MAX(id), COUNT(*)) 判斷是否需要重建"""
+        conn = self._conn()
+        signature = conn.execute("SELECT MAX(id), COUNT(*) FROM stats").fetchone()
+        with self._stats_lock:
+            if self._stats_index is None or signature != self._stats_signature:
+                rows = conn.execute("SELECT user_id, name, description FROM stats ORDER BY id").fetchall()
+                version = self._stats_index.version + 1 if self._stats_index else 1
+                self._stats_index = StatsIndex(rows, version=version)
+                self._stats_signature = signature
+            return self._stats_index
+
+    def query_stats(self, user_id=None, name=None):
+        return self._get_stats_index().query(user_id=user_id, name=name)
+
+    def get_all_stats(self):
+        return self._get_stats_index().render_all()
+
+    def replace_stats(self, rows):
+        """以 [(user_id, name, description), ...] 取代整份統計資料"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM stats")
+            conn.executemany(
+                "INSERT INTO stats (user_id, name, description) VALUES (?, ?, ?)",
+                [(str(u), str(n), str(d)) for u, n, d in rows],
+            )
@@ -0,0 +1,65 @@
+import bisect
+import unicodedata
+
+from storage import format_all_stats, format_stat_result
+
+
+def normalize_name(name):
+    """名稱比對用的正規化：全形轉半形、忽略大小寫與空白"""
+    text = unicodedata.normalize('NFKC', str(name or ''))
+    return "".join(text.split()).casefold()
+
+
+class StatsIndex:
+    """
+    Stats 資料的記憶體索引
+
+    - 以 User ID 與 (正規化後的) Name 建立索引，查詢不需掃描
+    - 名稱沒有完全相符時，以排序後的名稱清單做前綴比對
+    - $$ 的全文在同一個版本內只產生一次
+    """
+
+    def __init__(self, rows=(), version=0):
+        # rows: [(user_id, name, description), ...]，保留原本順序
+        self.rows = [(str(u), str(n), str(d)) for u, n, d in rows]
+        self.version = version
+        self.by_user = {}
+        self.by_name = {}
+        for i, (user_id, name, _) in enumerate(self.rows):
+            self.by_user.setdefault(user_id, []).append(i)
+            self.by_name.setdefault(normalize_name(name), []).append(i)
+        self._sorted_names = sorted(self.by_name)
+        self._all_text = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _format(self, indices):
+        return [format_stat_result(self.rows[i][1], self.rows[i][2]) for i in sorted(indices)]
+
+    def query(self, user_id=None, name=None):
+        """依 User ID 或名稱查詢，回傳文字列表 (依原本順序)"""
+        if user_id:
+            return self._format(self.by_user.get(str(user_id), []))
+        if not name:
+            return []
+
+        key = normalize_name(name)
+        if not key:
+            return []
+        if key in self.by_name:
+            return self._format(self.by_name[key])
+
+        # 前綴比對：在排序後的名稱中找出所有以 key 開頭的名稱
+        indices = []
+        pos = bisect.bisect_left(self._sorted_names, key)
+        while pos < len(self._sorted_names) and self._sorted_names[pos].startswith(key):
+            indices.extend(self.by_name[self._sorted_names[pos]])
+            pos += 1
+        return self._format(indices)
+
+    def render_all(self):
+        """$$ 的回覆文字 (同一版本只產生一次)"""
+        if self._all_text is None:
+            self._all_text = format_all_stats([(n, d) for _, n, d in self.rows])
+        return self._all_text
@@ -0,0 +1,311 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime
+
+from roster import RosterEntry, STATUS_APPROVED, STATUS_WAITLIST
+from summary import SummaryRenderer
+
+# 首次建立報名表時補齊的預設設定
+DEFAULT_SETTINGS = {
+    "活動標題": "歡樂活動報名",
+    "活動說明": "請準時參加！",
+    "人數上限": "10",
+    "報名功能": "TRUE", # 預設開啟 (CheckBox Checked = TRUE)
+    "查詢功能": "TRUE"
+}
+
+
+class ApiCallCounter:
+    """統計遠端 API 呼叫次數 (累計，以及每個指令範圍內的次數)"""
+
+    def __init__(self):
+        self.total = 0
+        self.by_name = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def record(self, name):
+        with self._lock:
+            self.total += 1
+            self.by_name[name] = self.by_name.get(name, 0) + 1
+        counts = getattr(self._local, 'counts', None)
+        if counts is not None:
+            counts[name] = counts.get(name, 0) + 1
+
+    def current(self):
+        """目前執行緒的範圍 dict (不在 scope 內時為 None)"""
+        return getattr(self._local, 'counts', None)
+
+    @contextmanager
+    def attach(self, counts):
+        """在其他執行緒 (例如平行讀取) 中把呼叫次數記到同一個範圍"""
+        parent = getattr(self._local, 'counts', None)
+        self._local.counts = counts
+        try:
+            yield counts
+        finally:
+            self._local.counts = parent
+
+    @contextmanager
+    def scope(self):
+        """記錄目前執行緒在範圍內的呼叫次數，yield 出的 dict 為 {API 名稱: 次數}"""
+        parent = getattr(self._local, 'counts', None)
+        counts = {}
+        self._local.counts = counts
+        try:
+            yield counts
+        finally:
+            self._local.counts = parent
+            if parent is not None:
+                for name, n in counts.items():
+                    parent[name] = parent.get(name, 0) + n
+
+
+def format_stat_result(name, description):
+    return f"{description} ({name})"
+
+
+def format_all_stats(rows):
+    """rows: [(name, description), ...]"""
+    if not rows:
+        return "尚無資料"
+    lines = ["📊 統計資料一覽:"]
+    for name, description in rows:
+        lines.append(f"{name}: {description}")
+    return "\n".join(lines)
+
+
+class StorageBackend(ABC):
+    """
+    報名 / 設定 / 統計資料的儲存介面
+
+    正取 / 候補 的分配與遞補邏輯寫在這裡，各儲存實作只需提供
+    讀取與單列變動的基本操作。變動以 txn 串起：
+    Google Sheets 為 MutationPlan，SQLite 為交易中的 cursor。
+    """
+
+    # 用來區分不同報名表 (批次合併、鎖都以此為單位)
+    storage_key = None
+
+    def __init__(self):
+        self.api_calls = ApiCallCounter()
+        # SUMMARY_PAGE_SIZE > 0 時 ? 只顯示第一頁，?N 查看第 N 頁
+        self.summary_renderer = SummaryRenderer(page_size=int(os.getenv('SUMMARY_PAGE_SIZE', 0)) or None)
+
+    # --- 設定 ---
+
+    @abstractmethod
+    def get_settings(self):
+        """讀取活動設定 dict"""
+
+    @contextmanager
+    def request_snapshot(self):
+        """請求範圍 (有快取的實作可以在範圍內共用同一份設定)"""
+        yield self
+
+    def pending_reads(self):
+        """
+        處理指令前需要的遠端讀取 (例如過期的設定、名單)，回傳彼此獨立的函式列表，
+        呼叫端可以平行執行；預設沒有需要預先讀取的資料
+        """
+        return []
+
+    def is_signup_enabled(self):
+        """檢查報名功能是否開啟 (支援 '開啟' 中文或 'TRUE' 布林字串)"""
+        settings = self.get_settings()
+        val = str(settings.get("報名功能", "TRUE")).upper()
+        return val == "開啟" or val == "TRUE"
+
+    def is_query_enabled(self):
+        """檢查查詢功能是否開啟 (支援 '開啟' 中文或 'TRUE' 布林字串)"""
+        settings = self.get_settings()
+        val = str(settings.get("查詢功能", "TRUE")).upper()
+        return val == "開啟" or val == "TRUE"
+
+    def _get_max_people(self, settings):
+        try:
+            return int(settings.get("人數上限", 10))
+        except:
+            return 10
+
+    # --- 報名 ---
+
+    def add_signup(self, user_id, user_name, count):
+        """新增或更新報名 (支援部分正取/部分候補)"""
+        return self.apply_signups([(user_id, user_name, count)])[0]
+
+    def remove_signup(self, user_id, count):
+        """取消報名"""
+        return self.apply_signups([(user_id, "", -count)])[0]
+
+    @abstractmethod
+    def apply_signups(self, ops):
+        """
+        依序套用多筆報名變動 [(user_id, user_name, delta), ...]，回傳每筆的結果訊息
+        (delta < 0 的取消之後要立即呼叫 _check_and_promote_waitlist)
+        """
+
+    @abstractmethod
+    def get_summary(self, page=1):
+        """取得統計資訊文字 (過長時截斷；summary_renderer 設定 page_size 時為第 page 頁)"""
+
+    # --- 結算 ---
+
+    @abstractmethod
+    def close_event(self):
+        """
+        結算目前的活動：封存最後的名單、正取者的出席次數併入統計、清空名單，
+        回傳 rollover.RolloverResult
+        """
+
+    # --- 統計 ---
+
+    @abstractmethod
+    def query_stats(self, user_id=None, name=None):
+        """查詢統計資料，回傳文字列表"""
+
+    @abstractmethod
+    def get_all_stats(self):
+        """取得所有統計資料文字"""
+
+    # --- 各實作提供的基本操作 ---
+
+    @abstractmethod
+    def _user_entries(self, user_id, txn):
+        """該用戶的所有報名列 (依報名順序)"""
+
+    @abstractmethod
+    def _approved_total(self, txn):
+        """目前全部正取人數"""
+
+    @abstractmethod
+    def _plan_promotions(self, max_people, txn):
+        """依報名時間分配空出的名額，回傳 [(候補 entry, 遞補人數), ...]"""
+
+    @abstractmethod
+    def _append_entry(self, entry, txn):
+        pass
+
+    @abstractmethod
+    def _update_entry(self, entry, txn, count=None, status=None, timestamp=None):
+        pass
+
+    @abstractmethod
+    def _delete_entry(self, entry, txn):
+        pass
+
+    # --- 分配邏輯 ---
+
+    def _reconcile_user_status(self, user_id, user_name, delta, txn):
+        """核心邏輯：重新計算並分配用戶的 正取/候補 狀態"""
+        settings = self.get_settings()
+        max_people = self._get_max_people(settings)
+
+        # 1. 蒐集當前用戶資訊與全域正取計數
+        user_rows = self._user_entries(user_id, txn)
+        current_user_total = 0
+        user_approved = 0
+        current_user_name = user_name # 優先使用傳入的名字
+        for entry in user_rows:
+            current_user_total += entry.count
+            if entry.status == STATUS_APPROVED:
+                user_approved += entry.count
+            if not current_user_name and entry.name:
+                current_user_name = entry.name
+        other_approved_count = self._approved_total(txn) - user_approved
+
+        # 2. 計算新總數
+        new_total = current_user_total + delta
+        if new_total < 0: new_total = 0
+
+        if new_total == 0 and current_user_total == 0:
+            return "您尚未報名喔！"
+
+        if new_total == 0:
+            # 刪除所有該用戶資料 (從後面刪避免列號跑掉)
+            for entry in reversed(user_rows):
+                self._delete_entry(entry, txn)
+            return "已取消您的所有報名。"
+
+        # 3. 分配 正取 vs 候補
+        # 剩餘名額 = 上限 - 其他人已佔用的
+        remaining_for_user = max_people - other_approved_count
+        if remaining_for_user < 0: remaining_for_user = 0
+
+        new_approved = min(new_total, remaining_for_user)
+        new_waitlist = new_total - new_approved
+
+        # 4. 寫入變動
+        # 策略：重複利用既有的 row (保留原本的列)，多餘的刪除，不足的 append
+        approved_entry = None
+        waitlist_entry = None
+        for entry in user_rows:
+            if entry.status == STATUS_APPROVED and approved_entry is None:
+                approved_entry = entry
+            elif entry.status == STATUS_WAITLIST and waitlist_entry is None:
+                waitlist_entry = entry
+
+        # 刪除多餘的 row (倒序)
+        for entry in reversed(user_rows):
+            if entry is not approved_entry and entry is not waitlist_entry:
+                self._delete_entry(entry, txn)
+
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        # 更新/建立 正取 Row
+        if new_approved > 0:
+            if approved_entry:
+                self._update_entry(approved_entry, txn, count=new_approved, timestamp=timestamp)
+            else:
+                self._append_entry(RosterEntry(user_id, current_user_name, new_approved, STATUS_APPROVED, timestamp), txn)
+        elif approved_entry:
+            # 原本有正取但現在變成 0 (例如人數上限變少)
+            self._delete_entry(approved_entry, txn)
+
+        # 更新/建立 候補 Row
+        if new_waitlist > 0:
+            if waitlist_entry:
+                self._update_entry(waitlist_entry, txn, count=new_waitlist, timestamp=timestamp)
+            else:
+                self._append_entry(RosterEntry(user_id, current_user_name, new_waitlist, STATUS_WAITLIST, timestamp), txn)
+        elif waitlist_entry:
+            self._delete_entry(waitlist_entry, txn)
+
+        # 回傳訊息
+        status_msg = ""
+        if new_approved > 0 and new_waitlist > 0:
+            status_msg = f"已更新！ {new_approved} 人正取，{new_waitlist} 人候補。"
+        elif new_approved > 0:
+            status_msg = f"已更新！ {new_approved} 人正取。"
+        elif new_waitlist > 0:
+            status_msg = f"已更新！ {new_waitlist} 人排入候補。"
+
+        return status_msg
+
+    def _check_and_promote_waitlist(self, txn):
+        """檢查並遞補：依報名時間先後，一次分配所有空出的名額"""
+        max_people = self._get_max_people(self.get_settings())
+
+        for entry, move in self._plan_promotions(max_people, txn):
+            # 遞補的人數併入該用戶既有的正取列 (維持每人最多一筆正取、一筆候補)
+            approved_entry = None
+            for e in self._user_entries(entry.user_id, txn):
+                if e.status == STATUS_APPROVED:
+                    approved_entry = e
+                    break
+
+            if approved_entry:
+                self._update_entry(approved_entry, txn, count=approved_entry.count + move)
+                if move == entry.count:
+                    self._delete_entry(entry, txn)
+                else:
+                    self._update_entry(entry, txn, count=entry.count - move)
+            elif move == entry.count:
+                # 整列轉為正取 (保留原報名時間)
+                self._update_entry(entry, txn, status=STATUS_APPROVED)
+            else:
+                # 部分遞補：候補列扣除人數，另外新增正取列
+                self._update_entry(entry, txn, count=entry.count - move)
+                self._append_entry(RosterEntry(entry.user_id, entry.name, move, STATUS_APPROVED, entry.timestamp), txn)
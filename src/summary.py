@@ -0,0 +1,132 @@
+import threading
+
+from roster import STATUS_APPROVED
+
+# LINE 單則文字訊息的字數上限
+LINE_TEXT_LIMIT = 5000
+
+DIVIDER = "----------------"
+
+
+def _settings_key(settings):
+    return (
+        settings.get("活動標題", "活動報名"),
+        settings.get("活動說明", ""),
+        str(settings.get("人數上限", 10)),
+    )
+
+
+def format_entry(entry):
+    """名單中一列的文字 (不含序號)"""
+    # 簡單排版
+    icon = "✅" if entry.status == STATUS_APPROVED else "⏳"
+    return f"{entry.name} (+{entry.count}) {icon}{entry.status}"
+
+
+class SummaryRenderer:
+    """
+    報名統計文字的排版與快取
+
+    - 以 (名單版本, 設定, 頁數) 快取整份文字，名單沒有變動時 ? 直接回傳
+    - 每一列的文字依 (名稱, 人數, 狀態) 快取，名單變動後只重排有變的列
+    - max_chars：超過 LINE 訊息上限時截斷，排到放不下就停，不先組出整份字串
+    - page_size：每頁顯示的筆數 (None = 不分頁)
+    """
+
+    def __init__(self, max_chars=LINE_TEXT_LIMIT, page_size=None):
+        self.max_chars = max_chars
+        self.page_size = page_size
+        self._lock = threading.Lock()
+        self._texts = {}        # page -> 文字 (只保留 _texts_key 這個版本)
+        self._texts_key = None
+        self._bodies = {}       # (name, count, status) -> 該列文字
+        self.hits = 0
+        self.renders = 0
+        self.lines_rendered = 0
+
+    def cached(self, settings, version, page=1):
+        """已排版過的文字；沒有快取時回傳 None"""
+        if version is None:
+            return None
+        with self._lock:
+            if self._texts_key == (version, _settings_key(settings)):
+                text = self._texts.get(page)
+                if text is not None:
+                    self.hits += 1
+                return text
+        return None
+
+    def render(self, settings, entries, version=None, page=1):
+        """
+        產生統計資訊文字
+
+        version 為名單版本 (None = 不快取整份文字)；entries 依報名順序排列
+        """
+        text = self.cached(settings, version, page)
+        if text is not None:
+            return text
+
+        with self._lock:
+            text = self._render(settings, entries, page)
+            self.renders += 1
+            if version is not None:
+                key = (version, _settings_key(settings))
+                if self._texts_key != key:
+                    self._texts = {}
+                    self._texts_key = key
+                self._texts[page] = text
+            # 避免已取消的列無限累積
+            if len(self._bodies) > 2 * len(entries) + 64:
+                self._bodies = {}
+        return text
+
+    def _body(self, entry):
+        key = (entry.name, entry.count, entry.status)
+        body = self._bodies.get(key)
+        if body is None:
+            body = format_entry(entry)
+            self._bodies[key] = body
+            self.lines_rendered += 1
+        return body
+
+    def _render(self, settings, entries, page):
+        title, desc, max_people = _settings_key(settings)
+
+        header = [f"🎉 {title}"]
+        if desc:
+            header.append(f"� {desc}")
+        header.append(DIVIDER)
+
+        total_count = sum(e.count for e in entries if e.status == STATUS_APPROVED)
+        footer = [DIVIDER]
+        start, stop = 0, len(entries)
+        if self.page_size:
+            pages = max(1, -(-len(entries) // self.page_size))
+            page = min(max(page, 1), pages)
+            start = (page - 1) * self.page_size
+            stop = min(start + self.page_size, len(entries))
+            if pages > 1:
+                more = f" (輸入 ?{page + 1} 看下一頁)" if page < pages else ""
+                footer.append(f"第 {page} / {pages} 頁{more}")
+        footer.append(f"目前正取人數: {total_count} / 上限 {max_people}")
+
+        lines = list(header)
+        used = sum(len(line) + 1 for line in header + footer) - 1
+        for idx in range(start, stop):
+            line = f"{idx+1}. {self._body(entries[idx])}"
+            remaining = stop - idx - 1
+            if self.max_chars:
+                # 後面還有列時，要預留截斷提示的空間
+                reserve = len(f"…還有 {remaining} 筆未顯示") + 1 if remaining else 0
+                if used + len(line) + 1 + reserve > self.max_chars:
+                    lines.append(f"…還有 {stop - idx} 筆未顯示")
+                    break
+            lines.append(line)
+            used += len(line) + 1
+        lines.extend(footer)
+        return "\n".join(lines)
+
+
+def format_summary(settings, entries):
+    """由設定與名單產生統計資訊文字 (完整名單，不截斷)"""
+    return SummaryRenderer(max_chars=None).render(settings, entries)
@@ -0,0 +1,216 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from circuit_breaker import CLOSED, CircuitBreaker, CircuitOpenError
+from group_locks import KeyedLocks
+from metrics import metrics
+from sheets_api import discard_mutation_lock
+
+logger = logging.getLogger(__name__)
+
+
+class Tenant(namedtuple("Tenant", "spreadsheet_url signups_title setting_title stats_title",
+                        defaults=("Signups", "Setting", "Stats"))):
+    """一個活動 (報名表)：試算表 + 分頁名稱；多個群組可以對應到同一個活動"""
+    __slots__ = ()
+
+    @property
+    def key(self):
+        return f"{self.spreadsheet_url}#{self.signups_title}"
+
+
+def tenant_from_config(value):
+    """
+    設定檔中的一筆對應：可以只寫試算表網址，或是
+    {"spreadsheet_url": ..., "worksheet": ..., "setting_worksheet": ..., "stats_worksheet": ...}
+    """
+    if isinstance(value, str):
+        return Tenant(value)
+    return Tenant(
+        value["spreadsheet_url"],
+        value.get("worksheet", "Signups"),
+        value.get("setting_worksheet", "Setting"),
+        value.get("stats_worksheet", "Stats"),
+    )
+
+
+def load_tenants(path):
+    """讀取 {group_id: 試算表網址 或 設定 dict} 格式的 JSON 檔"""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return {group_id: tenant_from_config(value) for group_id, value in data.items()}
+
+
+class TenantRegistry:
+    """
+    LINE 群組 -> 活動報名表 的對應，以及各活動 SheetManager 的連線池
+
+    - 第一次收到某個群組的指令時才建立該活動的 manager (factory(tenant, client))
+    - 所有 manager 共用同一個已授權的 gspread client (同一個 HTTP session)
+    - 最多保留 max_active 個 manager (LRU)，超過 idle_ttl 秒沒用到的也會釋放，
+      記憶體與連線成本只跟「最近活躍的活動數」有關 (釋放時一併移除該活動的斷路器與鎖)
+    - 沒有對應的群組 (以及一對一聊天) 使用 default，default 為 None 時不處理
+    - 連線失敗時該活動的斷路器開啟，退避期間直接拋出 CircuitOpenError，不重試完整的連線流程
+    """
+
+    def __init__(self, factory, tenants=None, default=None, client_factory=None, max_active=50, idle_ttl=3600,
+                 backoff_base=1.0, backoff_max=300.0):
+        self.factory = factory
+        self.tenants = dict(tenants or {})
+        self.default = default
+        self.client_factory = client_factory
+        self.max_active = max_active
+        self.idle_ttl = idle_ttl
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._pool = OrderedDict()      # tenant.key -> [manager, 最後使用時間, tenant]
+        self._lock = threading.Lock()
+        self._creating = KeyedLocks()   # 同一個活動同時只建立一個 manager
+        self._breakers = {}             # tenant.key -> CircuitBreaker
+
+        self.hits = 0
+        self.created = 0
+        self.evicted = 0
+
+    def tenant_for(self, group_id):
+        return self.tenants.get(group_id, self.default)
+
+    def shared_client(self):
+        """所有 manager 共用的 gspread client (第一次使用時才授權)"""
+        if self.client_factory is None:
+            return None
+        with self._client_lock:
+            if self._client is None:
+                self._client = self.client_factory()
+            return self._client
+
+    def _breaker(self, key):
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = CircuitBreaker(key, base_delay=self.backoff_base, max_delay=self.backoff_max)
+                self._breakers[key] = breaker
+            return breaker
+
+    def get(self, group_id):
+        """
+        取得該群組的 manager；沒有對應的活動時回傳 None
+
+        建立失敗時拋出該例外，退避期間拋出 CircuitOpenError
+        """
+        tenant = self.tenant_for(group_id)
+        if tenant is None:
+            return None
+
+        manager = self._lookup(tenant.key)
+        if manager is not None:
+            return manager
+
+        with self._creating.hold(tenant.key):
+            manager = self._lookup(tenant.key)
+            if manager is not None:
+                return manager
+            breaker = self._breaker(tenant.key)
+            if not breaker.allow():
+                metrics.inc("sheets_connect_rejected_total")
+                raise CircuitOpenError(tenant.key, breaker.retry_in())
+            try:
+                with metrics.span("sheets_connect"):
+                    manager = self.factory(tenant, self.shared_client())
+            except Exception:
+                delay = breaker.record_failure()
+                metrics.inc("sheets_connect_failures_total")
+                logger.warning("連線報名表 %s 失敗，%.1f 秒內不再嘗試", tenant.key, delay)
+                raise
+            breaker.record_success()
+            with self._lock:
+                self._pool[tenant.key] = [manager, time.monotonic(), tenant]
+                self.created += 1
+                self._evict()
+            logger.info("建立活動報名表 %s (目前 %d 個)", tenant.key, len(self._pool))
+            return manager
+
+    def peek(self, group_id):
+        """已在連線池中的 manager (不建立連線、不算一次使用)，沒有時回傳 None"""
+        tenant = self.tenant_for(group_id)
+        if tenant is None:
+            return None
+        with self._lock:
+            item = self._pool.get(tenant.key)
+            return item[0] if item is not None else None
+
+    def _lookup(self, key):
+        with self._lock:
+            item = self._pool.get(key)
+            if item is None:
+                return None
+            item[1] = time.monotonic()
+            self._pool.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def _evict(self):
+        """須持有 _lock"""
+        now = time.monotonic()
+        evicted = []
+        while self._pool:
+            key, (_, last_used, tenant) = next(iter(self._pool.items()))
+            if len(self._pool) <= self.max_active and now - last_used < self.idle_ttl:
+                break
+            del self._pool[key]
+            evicted.append(tenant)
+            self.evicted += 1
+        if not evicted:
+            return
+        in_use = {tenant.spreadsheet_url for _, _, tenant in self._pool.values()}
+        for tenant in evicted:
+            # 斷路器只在建立 manager 時使用；釋放時已連線成功 (CLOSED)，下次建立時重新產生
+            self._breakers.pop(tenant.key, None)
+            self._creating.discard(tenant.key)
+            # 同一份試算表的其他活動還在連線池中時保留共用的變動鎖
+            if tenant.spreadsheet_url not in in_use:
+                discard_mutation_lock(tenant.spreadsheet_url)
+
+    def warm_up(self, group_ids=(None,)):
+        """
+        在背景先建立連線 (預設只有 default 活動)，讓第一個報名的人不用等授權與開啟試算表
+
+        回傳背景執行緒
+        """
+        def run():
+            for group_id in group_ids:
+                try:
+                    self.get(group_id)
+                except Exception as e:
+                    logger.warning("預先連線 %s 失敗: %s", group_id, e)
+
+        thread = threading.Thread(target=run, name="sheets-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def evict_idle(self):
+        """釋放閒置超過 idle_ttl 的 manager (也會在建立新的 manager 時順便執行)"""
+        with self._lock:
+            self._evict()
+
+    def active(self):
+        with self._lock:
+            return list(self._pool)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": len(self._pool),
+                "max_active": self.max_active,
+                "tenants": len(self.tenants),
+                "hits": self.hits,
+                "created": self.created,
+                "evicted": self.evicted,
+                "breakers": {k: b.stats() for k, b in self._breakers.items() if b.state != CLOSED},
+            }
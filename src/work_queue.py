@@ -0,0 +1,147 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# LINE 的 reply token 有效時間很短，排隊超過這個秒數就視為可能過期
+REPLY_TOKEN_WARN_SECONDS = 20
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+class PushReplyApi:
+    """
+    把 reply_message 改成 push_message 的 LineBotApi 包裝 (reply token 已過期的事件使用)
+
+    to 為回覆對象 (群組 / 聊天室 / 用戶 ID)，其餘 API 直接交給原本的 line_bot_api
+    """
+
+    def __init__(self, line_bot_api, to):
+        self._api = line_bot_api
+        self.to = to
+
+    def reply_message(self, reply_token, messages, *args, **kwargs):
+        return self._api.push_message(self.to, messages)
+
+    def __getattr__(self, name):
+        return getattr(self._api, name)
+
+
+class EventWorkQueue:
+    """
+    Webhook 事件的背景處理佇列
+
+    callback 驗證簽章後把事件放進有上限的佇列，立即回應 LINE，
+    由固定數量的 worker 執行緒依序處理 (包含使用 reply token 回覆)。
+    排隊超過 reply_token_ttl 秒的事件改交給 late_func (例如以 push message 回覆)。
+    """
+
+    def __init__(self, process_func, workers=4, maxsize=200, latency_window=500,
+                 late_func=None, reply_token_ttl=REPLY_TOKEN_WARN_SECONDS):
+        self.process_func = process_func
+        self.late_func = late_func
+        self.reply_token_ttl = reply_token_ttl
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._busy_time = 0.0
+        self._started_at = None
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.late_replies = 0
+        # 最近 latency_window 筆事件的 (排隊秒數, 總處理秒數)
+        self._latencies = deque(maxlen=latency_window)
+
+    def start(self):
+        if self._threads:
+            return
+        self._started_at = time.monotonic()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"webhook-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, event):
+        """放入佇列；佇列已滿時回傳 False (由呼叫端決定是否改為同步處理)"""
+        try:
+            self._queue.put_nowait((time.monotonic(), event))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+
+    def _run(self):
+        while True:
+            enqueued_at, event = self._queue.get()
+            started = time.monotonic()
+            waited = started - enqueued_at
+            func = self.process_func
+            if waited > self.reply_token_ttl:
+                with self._lock:
+                    self.late_replies += 1
+                if self.late_func is not None:
+                    func = self.late_func
+                    logger.warning("事件在佇列中等待 %.1f 秒，改以 push message 回覆", waited)
+                else:
+                    logger.warning("事件在佇列中等待 %.1f 秒，reply token 可能已過期", waited)
+
+            with self._lock:
+                self._busy += 1
+            ok = True
+            try:
+                func(event)
+            except Exception:
+                ok = False
+                logger.exception("背景處理事件時發生錯誤")
+            finally:
+                finished = time.monotonic()
+                with self._lock:
+                    self._busy -= 1
+                    self._busy_time += finished - started
+                    self.processed += 1
+                    if not ok:
+                        self.failed += 1
+                    self._latencies.append((waited, finished - enqueued_at))
+                self._queue.task_done()
+
+    def join(self):
+        """等待佇列中的事件全部處理完 (測試與關機時使用)"""
+        self._queue.join()
+
+    def stats(self):
+        """佇列深度、worker 使用率與每個事件的延遲統計"""
+        with self._lock:
+            latencies = list(self._latencies)
+            busy = self._busy
+            busy_time = self._busy_time
+            result = {
+                "queue_depth": self._queue.qsize(),
+                "queue_capacity": self._queue.maxsize,
+                "workers": self.workers,
+                "busy_workers": busy,
+                "processed": self.processed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "late_replies": self.late_replies,
+            }
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+        result["utilization"] = busy_time / (elapsed * self.workers) if elapsed > 0 else 0.0
+
+        waits = sorted(w for w, _ in latencies)
+        totals = sorted(t for _, t in latencies)
+        result["wait_p50_ms"] = _percentile(waits, 50) * 1000
+        result["latency_p50_ms"] = _percentile(totals, 50) * 1000
+        result["latency_p99_ms"] = _percentile(totals, 99) * 1000
+        return result
@@ -0,0 +1,71 @@
+from bench_signup import run_workload
+from fakes import FakeLineBotApi, make_text_event
+
+import bot_logic
+
+
+def approved_and_waitlist(spreadsheet):
+    rows = spreadsheet.worksheet("Signups").rows[1:]
+    approved = sum(r[2] for r in rows if r[3] == "正取")
+    waitlist = sum(r[2] for r in rows if r[3] == "候補")
+    return approved, waitlist
+
+
+def test_signup_burst_budget():
+    result = run_workload("signup_burst", users=30, threads=6)
+    assert result["replies"] == 30
+    # 設定與名單都有快取：每個 +1 只有一次寫入
+    assert result["sheets_calls"] == {"batch_update": 30}
+    assert approved_and_waitlist(result["spreadsheet"]) == (15, 15)
+
+
+def test_signup_burst_batched_writes():
+    result = run_workload("signup_burst", users=30, threads=30, batch_window=0.05)
+    assert result["replies"] == 30
+    assert result["sheets_calls"]["batch_update"] < 30
+    assert approved_and_waitlist(result["spreadsheet"]) == (15, 15)
+
+
+def test_cancel_cascade_promotes_everyone():
+    result = run_workload("cancel_cascade", users=20, threads=4)
+    # 每次取消：核對列順序 (只下載 User ID 欄) + 取消與遞補合併的一次 batch_update
+    assert result["sheets_calls"] == {"get": 10, "batch_update": 10}
+    assert approved_and_waitlist(result["spreadsheet"]) == (10, 0)
+
+
+def test_query_storm_is_served_from_cache():
+    result = run_workload("query_storm", users=20, threads=8)
+    # 只有第一次查詢統計時下載 Stats；一般聊天不回覆
+    assert result["sheets_calls"] == {"get_lastUpdateTime": 1, "get": 1}
+    assert result["replies"] == result["commands"] * 6 // 8
+    assert result["line_calls"] == {"reply_message": result["replies"]}
+
+    # 同一個行程再跑一次：不會沿用上一次的查詢快取
+    again = run_workload("query_storm", users=20, threads=8)
+    assert again["sheets_calls"] == result["sheets_calls"]
+
+
+def test_chat_messages_do_no_io():
+    api = FakeLineBotApi()
+    saved = bot_logic._sheet_manager
+    bot_logic._sheet_manager = None
+    try:
+        bot_logic.handle_text_message(make_text_event("今天天氣真好"), api)
+    finally:
+        bot_logic._sheet_manager = saved
+    assert api.calls == []
+
+
+def test_cold_signup_reads_in_parallel():
+    kwargs = dict(users=4, threads=1, sheets_latency=0.05, line_latency=0.05, cold=True)
+    sequential = run_workload("signup_burst", fan_out=False, **kwargs)
+    parallel = run_workload("signup_burst", **kwargs)
+    # 每個指令都要讀設定、名單與顯示名稱，呼叫次數不變
+    # (第一個指令之前沒有寫入過：比對修改時間後不必重新下載；之後寫入過，直接下載)
+    for result in (sequential, parallel):
+        assert result["sheets_calls"] == {"get_all_values": 4, "get_lastUpdateTime": 1, "get": 3, "batch_update": 4}
+        assert result["line_calls"] == {"get_group_member_profile": 4, "reply_message": 4}
+    # 一次只執行一個指令：依序讀取時沒有重疊；平行時設定、名單與顯示名稱三個讀取同時進行
+    assert sequential["max_in_flight"] == 1
+    assert parallel["max_in_flight"] == 3
+    assert approved_and_waitlist(parallel["spreadsheet"]) == (2, 2)
@@ -0,0 +1,40 @@
+from bench_parser import chat_corpus, legacy_parse
+from command_parser import (
+    parse_command, register, SignupDelta, RosterQuery, StatsQuery, _parsers
+)
+
+
+def test_commands():
+    assert parse_command("+1") == SignupDelta(None, 1, False)
+    assert parse_command("+10").delta == 10
+    assert parse_command("-2").delta == -2
+    assert parse_command("小明+3") == SignupDelta("小明", 3, False)
+    assert parse_command("小明-1") == SignupDelta("小明", 1, True)
+    assert parse_command("?") == RosterQuery()
+    assert parse_command("?2") == RosterQuery(2)
+    assert parse_command("$") == StatsQuery("self", None)
+    assert parse_command("$$") == StatsQuery("all", None)
+    assert parse_command("小華$") == StatsQuery("name", "小華")
+
+
+def test_non_commands():
+    for text in ["", "哈哈", "1", "123", "a+b+1", "+", "-", "+1a", "??", "小明?2", "??2", "2?", "a$b$", "小明 +1 嗎"]:
+        assert parse_command(text) is None, text
+
+
+def test_matches_legacy_regex_chain():
+    extra = ["-0", "a-b-1", "+١٢", "x\n+1", "$ $", "1$", "+1$", "-$", "＋1", "名字 +5"]
+    for text in chat_corpus(2000, command_ratio=0.5) + extra:
+        assert parse_command(text) == legacy_parse(text), text
+
+
+def test_register_new_verb():
+    @register('!')
+    def parse_admin(text):
+        return ('admin', text[:-1]) if text.startswith('#') else None
+
+    try:
+        assert parse_command("#結算!") == ('admin', '#結算')
+        assert parse_command("好!") is None
+    finally:
+        del _parsers['!']
@@ -0,0 +1,88 @@
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fakes import FakeSpreadsheet, make_sheet_manager, make_signup_spreadsheet
+
+MAX_PEOPLE = 10
+
+
+class CapacityCheckingSpreadsheet(FakeSpreadsheet):
+    """每次 batch_update 後檢查 Sheet 上的正取人數沒有超過上限"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_seen = 0
+        self.overlapping_writes = 0
+        self._writing = threading.Lock()
+
+    def batch_update(self, body):
+        if not self._writing.acquire(blocking=False):
+            self.overlapping_writes += 1
+            self._writing.acquire()
+        try:
+            result = super().batch_update(body)
+            approved = sum(int(r[2]) for r in self.worksheet("Signups").rows[1:] if r[3] == "正取")
+            self.max_seen = max(self.max_seen, approved)
+            return result
+        finally:
+            self._writing.release()
+
+
+def make_manager(url="https://example.invalid/stress"):
+    spreadsheet = make_signup_spreadsheet(max_people=MAX_PEOPLE, latency=0.001, title="壓力測試",
+                                          cls=CapacityCheckingSpreadsheet)
+    return make_sheet_manager(spreadsheet, url), spreadsheet
+
+
+def test_concurrent_signups_never_exceed_capacity():
+    manager, spreadsheet = make_manager()
+    rng = random.Random(42)
+    commands = []
+    for _ in range(400):
+        user = f"U{rng.randint(0, 29)}"
+        n = rng.randint(1, 3)
+        commands.append((user, n if rng.random() < 0.6 else -n))
+
+    def run(command):
+        user, delta = command
+        if delta > 0:
+            manager.add_signup(user, user, delta)
+        else:
+            manager.remove_signup(user, -delta)
+        # 查詢與變動同時進行
+        manager.get_summary()
+
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        list(pool.map(run, commands))
+
+    rows = spreadsheet.worksheet("Signups").rows[1:]
+    approved = sum(int(r[2]) for r in rows if r[3] == "正取")
+    waitlist = sum(int(r[2]) for r in rows if r[3] == "候補")
+
+    assert spreadsheet.overlapping_writes == 0
+    assert spreadsheet.max_seen <= MAX_PEOPLE
+    assert approved <= MAX_PEOPLE
+    # 有人候補時名額必須是滿的
+    assert waitlist == 0 or approved == MAX_PEOPLE
+
+    # 記憶體名單與 Sheet 一致，且每人最多一筆正取、一筆候補
+    assert [e.to_row()[:4] for e in manager.roster.snapshot()] == [r[:4] for r in rows]
+    seen = set()
+    for r in rows:
+        assert (r[0], r[3]) not in seen
+        seen.add((r[0], r[3]))
+
+
+def test_different_spreadsheets_do_not_block_each_other():
+    manager_a, _ = make_manager("https://example.invalid/a")
+    manager_b, spreadsheet_b = make_manager("https://example.invalid/b")
+
+    with manager_a.mutation_lock():
+        done = threading.Event()
+        t = threading.Thread(target=lambda: (manager_b.add_signup("U1", "U1", 1), done.set()))
+        t.start()
+        assert done.wait(timeout=5)
+        t.join()
+
+    assert spreadsheet_b.worksheet("Signups").rows[1][:4] == ["U1", "U1", 1, "正取"]
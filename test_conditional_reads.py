@@ -0,0 +1,71 @@
+from fakes import make_sheet_manager, make_signup_spreadsheet
+from metrics import metrics
+
+
+def make_manager(spreadsheet, **kwargs):
+    return make_sheet_manager(spreadsheet, "https://example.invalid/conditional", stats_ttl=0, **kwargs)
+
+
+def test_roster_resync_skips_download_when_unchanged():
+    spreadsheet = make_signup_spreadsheet([["U1", "Amy", 2, "正取", "2024-01-01 10:00:00", "很長的備註" * 50]])
+    manager = make_manager(spreadsheet)
+    assert manager.roster.entries[0].count == 2
+    before = metrics.counter_value("sheets_read_bytes_saved_total", sheet="signups")
+
+    manager.resync_roster(conditional=True)
+    assert spreadsheet.calls == ["get_lastUpdateTime"]
+    saved = metrics.counter_value("sheets_read_bytes_saved_total", sheet="signups") - before
+    # 只下載 A:E，略過的下載不含 備註
+    assert 0 < saved < 200
+
+    # 在 Sheet 上手動修改 -> 修改時間不同，重新下載
+    spreadsheet.worksheet("Signups").rows[1][2] = 3
+    spreadsheet.reset_calls()
+    manager.resync_roster(conditional=True)
+    assert spreadsheet.calls == ["get_lastUpdateTime", "get"]
+    assert manager.roster.entries[0].count == 3
+
+
+def test_stats_reloaded_only_when_spreadsheet_changed():
+    spreadsheet = make_signup_spreadsheet()
+    spreadsheet.worksheet("Stats").rows.append(["U1", "Amy", "出席 3 次"])
+    manager = make_manager(spreadsheet)
+
+    assert manager.query_stats(user_id="U1") == ["出席 3 次 (Amy)"]
+    assert manager.query_stats(user_id="U1") == ["出席 3 次 (Amy)"]
+    assert spreadsheet.calls == ["get_lastUpdateTime", "get", "get_lastUpdateTime"]
+
+    spreadsheet.worksheet("Stats").rows.append(["U1", "Amy", "MVP"])
+    assert manager.query_stats(user_id="U1") == ["出席 3 次 (Amy)", "MVP (Amy)"]
+    assert spreadsheet.calls[-2:] == ["get_lastUpdateTime", "get"]
+
+
+def test_own_writes_skip_the_modified_time_check():
+    spreadsheet = make_signup_spreadsheet()
+    manager = make_manager(spreadsheet)
+    manager.query_stats(user_id="U1")
+    manager.add_signup("U1", "Amy", 1)
+    spreadsheet.reset_calls()
+
+    # 自己的 batch_update 也會更新修改時間：比對一定不相符，直接下載
+    manager.resync_roster(conditional=True)
+    manager.query_stats(user_id="U1")
+    assert spreadsheet.calls == ["get", "get"]
+
+    # 之後沒有再寫入：先重新記錄一次修改時間 (直接下載時沒有取得)，之後相符就沿用
+    spreadsheet.reset_calls()
+    manager.resync_roster(conditional=True)
+    assert spreadsheet.calls == ["get_lastUpdateTime", "get"]
+    manager.resync_roster(conditional=True)
+    assert spreadsheet.calls[2:] == ["get_lastUpdateTime"]
+
+
+def test_unavailable_modified_time_falls_back_to_full_reads():
+    spreadsheet = make_signup_spreadsheet()
+    manager = make_manager(spreadsheet)
+    spreadsheet.fail_next(status_code=403)
+    manager.resync_roster(conditional=True)
+    manager.resync_roster(conditional=True)
+    # 403 (未啟用 Drive API) 之後不再查詢修改時間
+    assert spreadsheet.calls == ["get_lastUpdateTime", "get", "get"]
+    assert manager.conditional_reads is False
@@ -0,0 +1,62 @@
+import threading
+import time
+
+import bot_logic
+from event_dedup import EventDeduplicator
+from fakes import FakeLineBotApi, make_sheet_manager, make_signup_spreadsheet, make_webhook_body, sign_body
+from shared_state import SharedState
+
+
+def test_claim_once_within_ttl():
+    dedup = EventDeduplicator(ttl=0.05)
+    assert dedup.claim("E1")
+    assert not dedup.claim("E1")
+    assert dedup.claim("E2")
+    assert dedup.claim(None) and dedup.claim(None)   # 沒有 ID 的事件不去重
+    time.sleep(0.06)
+    assert dedup.claim("E1")
+    assert dedup.duplicates == 1
+
+
+def test_memory_is_bounded():
+    dedup = EventDeduplicator(maxsize=100)
+    for i in range(1000):
+        dedup.claim(f"E{i}")
+    assert len(dedup) <= 100
+
+
+def test_shared_claims_across_workers(tmp_path):
+    path = str(tmp_path / "shared.db")
+    worker1 = EventDeduplicator(shared_state=SharedState(path))
+    worker2 = EventDeduplicator(shared_state=SharedState(path))
+    assert worker1.claim("E1")
+    assert not worker2.claim("E1")
+
+
+def test_concurrent_redelivery_is_applied_once(app_module, monkeypatch):
+    spreadsheet = make_signup_spreadsheet(max_people=10, latency=0.002)
+    manager = make_sheet_manager(spreadsheet, "https://example.invalid/dedup")
+    line_api = FakeLineBotApi()
+    monkeypatch.setattr(bot_logic, "_sheet_manager", manager)
+    monkeypatch.setattr(app_module, "line_bot_api", line_api)
+
+    body = make_webhook_body("+2", user_id="U1", event_id="E-dup")
+    redelivered = make_webhook_body("+2", user_id="U1", event_id="E-dup", redelivery=True)
+    client = app_module.app.test_client()
+    statuses = []
+
+    def post(payload):
+        response = client.post("/callback", data=payload, headers={"X-Line-Signature": sign_body(payload)})
+        statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=post, args=(body if i % 2 else redelivered,)) for i in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # 每次重送都回 200 (LINE 才不會再重送)，但只報名一次、只寫一次、只回覆一次
+    assert statuses == [200] * 10
+    assert spreadsheet.calls == ["batch_update"]
+    assert [r[:3] for r in spreadsheet.worksheet("Signups").rows[1:]] == [["U1", "name-U1", 2]]
+    assert len(line_api.replies) == 1
@@ -0,0 +1,118 @@
+import logging
+
+import bot_logic
+from fakes import FakeLineBotApi, make_sheet_manager, make_signup_spreadsheet, make_text_event, make_webhook_body, sign_body
+from metrics import Metrics, metrics
+from rate_limit import BUSY_REPLY
+
+
+def test_prometheus_text_format():
+    m = Metrics(buckets=(0.1, 1.0))
+    m.inc("retries_total", call="batch_update")
+    m.inc("retries_total", call="batch_update")
+    m.inc("errors_total", msg='say "hi"')
+    m.observe("span_seconds", 0.05, span="sheets")
+    m.observe("span_seconds", 0.5, span="sheets")
+    m.add_collector(lambda: [("queue_depth", {}, 3)])
+
+    lines = m.render().splitlines()
+    assert '# TYPE signup_bot_retries_total counter' in lines
+    assert 'signup_bot_retries_total{call="batch_update"} 2' in lines
+    assert 'signup_bot_errors_total{msg="say \\"hi\\""} 1' in lines
+    assert 'signup_bot_span_seconds_bucket{span="sheets",le="0.1"} 1' in lines
+    assert 'signup_bot_span_seconds_bucket{span="sheets",le="1"} 2' in lines
+    assert 'signup_bot_span_seconds_bucket{span="sheets",le="+Inf"} 2' in lines
+    assert 'signup_bot_span_seconds_count{span="sheets"} 2' in lines
+    assert 'signup_bot_queue_depth 3' in lines
+
+
+def test_trace_collects_spans_and_logs_slow_commands(caplog):
+    m = Metrics(slow_trace_ms=0.0001)
+    with caplog.at_level(logging.WARNING, logger="metrics"):
+        with m.trace("'+1'"):
+            with m.span("sheets", call="batch_update"):
+                pass
+            with m.span("line", call="reply_message"):
+                pass
+    assert "sheets.batch_update=" in caplog.text
+    assert "line.reply_message=" in caplog.text
+
+
+def test_quota_errors_and_command_spans_are_recorded(caplog):
+    spreadsheet = make_signup_spreadsheet(max_people=5)
+    manager = make_sheet_manager(spreadsheet, "https://example.invalid/metrics")
+    api = FakeLineBotApi()
+    quota_before = metrics.counter_value("sheets_quota_errors_total", call="batch_update")
+    degraded_before = metrics.counter_value("commands_degraded_total", kind="SignupDelta")
+    errors_before = metrics.counter_value("command_errors_total", kind="SignupDelta")
+    reply_before = metrics.span_count("line", call="reply_message")
+
+    saved = bot_logic._sheet_manager
+    bot_logic._sheet_manager = manager
+    try:
+        bot_logic.handle_text_message(make_text_event("+1", user_id="U1"), api)
+        # 超過配額：請用戶稍後再試，不當成故障
+        spreadsheet.fail_next(1, 429)
+        bot_logic.handle_text_message(make_text_event("+2", user_id="U2"), api)
+        # 寫入失敗後名單標記為過期，先重新下載，讓下一個錯誤落在 batch_update
+        manager.resync_roster()
+        spreadsheet.fail_next(1, 500)
+        with caplog.at_level(logging.ERROR, logger="bot_logic"):
+            bot_logic.handle_text_message(make_text_event("+2", user_id="U3"), api)
+    finally:
+        bot_logic._sheet_manager = saved
+
+    assert metrics.counter_value("sheets_quota_errors_total", call="batch_update") == quota_before + 1
+    assert metrics.counter_value("commands_degraded_total", kind="SignupDelta") == degraded_before + 1
+    assert metrics.counter_value("command_errors_total", kind="SignupDelta") == errors_before + 1
+    assert metrics.span_count("line", call="reply_message") == reply_before + 2
+    assert api.replies[-1][1] == [BUSY_REPLY]
+    # 錯誤會連同 traceback 記錄到 log，而不是只有 print
+    assert "處理指令時發生錯誤" in caplog.text and "Traceback" in caplog.text
+
+
+def test_signup_commands_use_expected_number_of_sheets_calls(caplog):
+    spreadsheet = make_signup_spreadsheet(max_people=3)
+    manager = make_sheet_manager(spreadsheet, "https://example.invalid/api-calls")
+    manager.get_settings()
+
+    # 設定已快取、名單在記憶體中：新增報名只需要一次 batch_update
+    with manager.api_calls.scope() as calls:
+        manager.add_signup("U1", "Amy", 2)
+    assert calls == {"batch_update": 1}
+    # 改寫 / 刪除既有列：先核對列順序 (一欄) 再寫入
+    with manager.api_calls.scope() as calls:
+        manager.add_signup("U1", "Amy", 2)
+    assert calls == {"get": 1, "batch_update": 1}
+    with manager.api_calls.scope() as calls:
+        manager.remove_signup("U1", 4)
+    assert calls == {"get": 1, "batch_update": 1}
+
+    # 經過 bot_logic 時同樣記錄在指令範圍內 (含平行讀取)
+    saved = bot_logic._sheet_manager
+    bot_logic._sheet_manager = manager
+    total_before = manager.api_calls.total
+    try:
+        with caplog.at_level(logging.INFO, logger="bot_logic"):
+            bot_logic.handle_text_message(make_text_event("+1", user_id="U2"), FakeLineBotApi())
+    finally:
+        bot_logic._sheet_manager = saved
+    assert manager.api_calls.total - total_before == 1
+    assert "使用 1 次 Google Sheets API: {'batch_update': 1}" in caplog.text
+
+
+def test_callback_and_metrics_endpoint(app_module):
+    client = app_module.app.test_client()
+    body = make_webhook_body("大家好", group_id=None)
+
+    assert client.post("/callback", data=body, headers={"X-Line-Signature": sign_body(body)}).status_code == 200
+    assert client.post("/callback", data=body, headers={"X-Line-Signature": "bad"}).status_code == 400
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    text = response.get_data(as_text=True)
+    assert "signup_bot_webhook_events_total" in text
+    assert "signup_bot_webhook_invalid_signature_total" in text
+    assert 'signup_bot_span_seconds_count{span="webhook_verify"}' in text
+    assert "signup_bot_profile_cache_hit_rate" in text
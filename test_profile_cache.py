@@ -0,0 +1,73 @@
+import time
+
+from profile_cache import ProfileCache
+
+
+class Profile:
+    def __init__(self, display_name):
+        self.display_name = display_name
+
+
+class CountingLineBotApi:
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+
+    def get_group_member_profile(self, group_id, user_id):
+        self.calls.append(('group', group_id, user_id))
+        if self.fail:
+            raise RuntimeError("LINE API down")
+        return Profile(f"name-{user_id}")
+
+    def get_profile(self, user_id):
+        self.calls.append(('user', user_id))
+        return Profile(f"name-{user_id}")
+
+
+def test_hits_skip_the_line_api():
+    api = CountingLineBotApi()
+    cache = ProfileCache()
+
+    assert cache.get_display_name(api, "G1", "U1") == "name-U1"
+    assert cache.get_display_name(api, "G1", "U1") == "name-U1"
+    assert cache.get_display_name(api, None, "U1") == "name-U1"
+
+    assert api.calls == [('group', 'G1', 'U1'), ('user', 'U1')]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+
+
+def test_lru_eviction_and_ttl():
+    api = CountingLineBotApi()
+    cache = ProfileCache(maxsize=2, ttl=0.05)
+    cache.get_display_name(api, "G", "U1")
+    cache.get_display_name(api, "G", "U2")
+    cache.get_display_name(api, "G", "U1")
+    cache.get_display_name(api, "G", "U3")   # 擠掉最久沒用的 U2
+    assert cache.stats()["size"] == 2
+
+    cache.get_display_name(api, "G", "U2")
+    assert api.calls.count(('group', 'G', 'U2')) == 2
+
+    time.sleep(0.06)
+    cache.get_display_name(api, "G", "U1")
+    assert api.calls.count(('group', 'G', 'U1')) == 2
+
+
+def test_errors_are_counted_and_not_cached():
+    api = CountingLineBotApi(fail=True)
+    cache = ProfileCache()
+    assert cache.get_display_name(api, "G", "U1") is None
+    assert cache.get_display_name(api, "G", "U1") is None
+    assert cache.stats()["errors"] == 2
+
+
+def test_prefetch_fills_cache_in_background():
+    api = CountingLineBotApi()
+    cache = ProfileCache(prefetch=True)
+    cache.prefetch(api, "G", "U1")
+    cache._executor.shutdown(wait=True)
+
+    assert cache.get_display_name(api, "G", "U1") == "name-U1"
+    assert len(api.calls) == 1
+    assert cache.stats()["hits"] == 1
@@ -0,0 +1,111 @@
+import pytest
+from gspread.exceptions import APIError
+
+from fakes import make_sheet_manager, make_signup_spreadsheet
+
+
+def make_manager(rows, max_people=4):
+    spreadsheet = make_signup_spreadsheet(rows, max_people=max_people)
+    manager = make_sheet_manager(spreadsheet)
+    return manager, spreadsheet
+
+
+def sheet_rows(spreadsheet):
+    return [r[:4] for r in spreadsheet.worksheet("Signups").rows[1:]]
+
+
+def test_promotes_in_signup_time_order():
+    # C 排在較前面的列，但 B 比較早報名，應由 B 先遞補
+    manager, spreadsheet = make_manager([
+        ["A", "A", 4, "正取", "2024-01-01 10:00:00", ""],
+        ["C", "C", 1, "候補", "2024-01-01 10:05:00", ""],
+        ["B", "B", 1, "候補", "2024-01-01 10:01:00", ""],
+    ])
+
+    manager.remove_signup("A", 1)
+
+    assert sheet_rows(spreadsheet) == [
+        ["A", "A", 3, "正取"],
+        ["C", "C", 1, "候補"],
+        ["B", "B", 1, "正取"],
+    ]
+
+
+def test_partial_promotion_splits_waitlist_row():
+    manager, spreadsheet = make_manager([
+        ["A", "A", 4, "正取", "2024-01-01 10:00:00", ""],
+        ["B", "B", 3, "候補", "2024-01-01 10:01:00", ""],
+    ])
+
+    manager.remove_signup("A", 2)
+
+    assert sheet_rows(spreadsheet) == [
+        ["A", "A", 2, "正取"],
+        ["B", "B", 1, "候補"],
+        ["B", "B", 2, "正取"],
+    ]
+    assert manager.roster.approved_total == 4
+    assert manager.roster.waitlist_total == 1
+
+
+def test_promotion_merges_into_existing_approved_row():
+    manager, spreadsheet = make_manager([
+        ["A", "A", 2, "正取", "2024-01-01 10:00:00", ""],
+        ["B", "B", 2, "正取", "2024-01-01 10:01:00", ""],
+        ["B", "B", 1, "候補", "2024-01-01 10:01:00", ""],
+    ])
+
+    manager.remove_signup("A", 2)
+
+    assert sheet_rows(spreadsheet) == [["B", "B", 3, "正取"]]
+
+
+def test_cancel_and_promotion_use_one_api_call():
+    manager, spreadsheet = make_manager([
+        ["A", "A", 4, "正取", "2024-01-01 10:00:00", ""],
+        ["B", "B", 2, "候補", "2024-01-01 10:01:00", ""],
+        ["C", "C", 2, "候補", "2024-01-01 10:02:00", ""],
+        ["D", "D", 2, "候補", "2024-01-01 10:03:00", ""],
+    ])
+
+    manager.remove_signup("A", 4)
+
+    # 設定已快取、名單在記憶體中：核對列順序後，取消 + 整輪遞補只需要一次 batch_update
+    assert spreadsheet.calls == ["get", "batch_update"]
+    assert sheet_rows(spreadsheet) == [
+        ["B", "B", 2, "正取"],
+        ["C", "C", 2, "正取"],
+        ["D", "D", 2, "候補"],
+    ]
+
+
+def test_failed_write_leaves_roster_untouched():
+    manager, spreadsheet = make_manager([])
+    spreadsheet.fail_next(1)
+    with pytest.raises(APIError):
+        manager.add_signup("U1", "U1", 2)
+    assert manager.roster.user_entries("U1") == []
+
+    # 下一次變動前重新下載名單，不會以錯誤的列號刪掉別人的報名
+    manager.add_signup("U2", "U2", 1)
+    manager.remove_signup("U1", 2)
+    assert sheet_rows(spreadsheet) == [["U2", "U2", 1, "正取"]]
+    assert [e.user_id for e in manager.roster.snapshot()] == ["U2"]
+
+
+def test_rows_edited_by_hand_are_resynced_before_writing():
+    manager, spreadsheet = make_manager([
+        ["A", "A", 1, "正取", "2024-01-01 10:00:00", ""],
+        ["B", "B", 1, "正取", "2024-01-01 10:01:00", ""],
+        ["C", "C", 1, "正取", "2024-01-01 10:02:00", ""],
+    ])
+    # 主辦人在 Sheet 上刪掉 A，記憶體名單還沒重新同步
+    del spreadsheet.worksheet("Signups").rows[1]
+
+    manager.add_signup("C", "C", 2)
+
+    assert sheet_rows(spreadsheet) == [
+        ["B", "B", 1, "正取"],
+        ["C", "C", 3, "正取"],
+    ]
+    assert [e.user_id for e in manager.roster.snapshot()] == ["B", "C"]
@@ -0,0 +1,155 @@
+import threading
+import time
+
+import pytest
+from gspread.exceptions import APIError
+
+import bot_logic
+from fakes import FakeClient, FakeLineBotApi, make_sheet_manager, make_signup_spreadsheet, make_text_event
+from rate_limit import BUSY_REPLY, KeyedThrottle, RecentAnswers, SheetsBusyError, TokenBucket
+from tenants import Tenant, TenantRegistry
+
+
+def test_token_bucket_waits_then_gives_up():
+    bucket = TokenBucket(rate=20, capacity=2)
+    assert bucket.acquire() and bucket.acquire()
+    assert not bucket.try_acquire()
+    # 20 個 / 秒：約 50ms 補一個
+    started = time.monotonic()
+    assert bucket.acquire(timeout=0.5)
+    assert 0.02 < time.monotonic() - started < 0.3
+    assert not bucket.acquire(timeout=0.01)
+
+    bucket.pause(0.2)
+    assert not bucket.acquire(timeout=0.1)
+
+
+def test_keyed_throttle_is_per_key():
+    throttle = KeyedThrottle(per_minute=60, burst=2)
+    assert [throttle.allow("U1") for _ in range(3)] == [True, True, False]
+    assert throttle.allow("U2")
+
+
+def test_identical_queries_are_collapsed_and_stale_answer_served_when_busy():
+    answers = RecentAnswers(window=0.2)
+    calls = []
+    gate = threading.Event()
+
+    def compute():
+        calls.append(1)
+        gate.wait(1)
+        return "名單"
+
+    threads = [threading.Thread(target=answers.get, args=(("S", "?"), compute)) for _ in range(5)]
+    for t in threads:
+        t.start()
+    gate.set()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert answers.get(("S", "?"), compute) == "名單"
+    assert len(calls) == 1
+
+    def busy():
+        raise SheetsBusyError("get")
+
+    answers.invalidate("S")
+    assert answers.get(("S", "?"), busy) == "名單"
+    with pytest.raises(SheetsBusyError):
+        answers.get(("S", "$$"), busy)
+
+
+def test_answer_computed_during_a_write_is_not_cached():
+    answers = RecentAnswers(window=60)
+    key = ("sheet", "?")
+
+    def compute_during_write():
+        # 計算途中有報名寫入並 invalidate：這份答案可能是寫入前的名單
+        answers.invalidate("sheet")
+        return "before"
+
+    assert answers.get(key, compute_during_write) == "before"
+    assert answers.get(key, lambda: "after") == "after"
+    assert answers.get(key, lambda: "again") == "after"
+
+
+def test_sheet_manager_rate_limit_raises_busy_and_keeps_stale_settings():
+    spreadsheet = make_signup_spreadsheet(max_people=3)
+    bucket = TokenBucket(rate=0.001, capacity=100)
+    manager = make_sheet_manager(spreadsheet, "https://example.invalid/limit", rate_limiter=bucket, settings_ttl=0)
+    manager.rate_limit_wait = 0
+    assert manager.get_settings()["人數上限"] == "3"
+
+    bucket.tokens = 0
+    # 設定讀取失敗時沿用舊值，不退回預設的人數上限 10
+    assert manager.get_settings()["人數上限"] == "3"
+    with pytest.raises(SheetsBusyError):
+        manager.add_signup("U1", "Amy", 1)
+
+
+def test_quota_error_on_write_invalidates_roster_without_rereading():
+    spreadsheet = make_signup_spreadsheet(max_people=3)
+    bucket = TokenBucket(rate=100, capacity=100)
+    manager = make_sheet_manager(spreadsheet, "https://example.invalid/quota", rate_limiter=bucket)
+    spreadsheet.fail_next(1, 429)
+
+    # 429 後呼叫額度暫停中：拋出原本的錯誤，不在暫停期間重新下載名單
+    with pytest.raises(APIError):
+        manager.add_signup("U1", "Amy", 2)
+    assert spreadsheet.calls == ["batch_update"]
+    assert manager.roster.user_entries("U1") == []
+    assert manager.roster.loaded_at is None
+
+    # 暫停結束後的下一次變動先重新下載名單
+    bucket._paused_until = None
+    bucket.tokens = bucket.capacity
+    manager.add_signup("U1", "Amy", 2)
+    assert "get" in spreadsheet.calls[1:]
+    assert manager.roster.approved_total == 2
+
+
+def test_throttled_users_get_cached_answers_or_busy_reply(monkeypatch):
+    spreadsheet = make_signup_spreadsheet(max_people=3)
+    manager = make_sheet_manager(spreadsheet, "https://example.invalid/throttle")
+    monkeypatch.setattr(bot_logic, "_sheet_manager", manager)
+    monkeypatch.setattr(bot_logic, "_user_throttle", KeyedThrottle(per_minute=60, burst=2))
+    monkeypatch.setattr(bot_logic, "_recent_answers", RecentAnswers(window=60))
+    api = FakeLineBotApi()
+
+    bot_logic.handle_text_message(make_text_event("+1", user_id="U1"), api)
+    bot_logic.handle_text_message(make_text_event("?", user_id="U1"), api)
+    summary = api.replies[-1][1][0]
+    # 超過頻率：查詢回覆最近的答案，報名請稍後再試 (不寫入)
+    bot_logic.handle_text_message(make_text_event("?", user_id="U1"), api)
+    bot_logic.handle_text_message(make_text_event("+1", user_id="U1"), api)
+    assert [r[1][0] for r in api.replies[-2:]] == [summary, BUSY_REPLY]
+    assert manager.roster.approved_total == 1
+
+    # 報名後其他人的 ? 不會拿到舊的名單
+    bot_logic.handle_text_message(make_text_event("+1", user_id="U2"), api)
+    bot_logic.handle_text_message(make_text_event("?", user_id="U2"), api)
+    assert api.replies[-1][1][0] != summary
+
+
+def test_throttled_commands_do_not_connect(monkeypatch):
+    created = []
+
+    def factory(tenant, client):
+        created.append(tenant)
+        return make_sheet_manager(url=tenant.spreadsheet_url, client=client, reset_calls=False)
+
+    registry = TenantRegistry(factory, default=Tenant("https://example.invalid/cold"),
+                              client_factory=lambda: FakeClient(make_signup_spreadsheet()))
+    throttle = KeyedThrottle(per_minute=60, burst=1)
+    assert throttle.allow("U1")
+    monkeypatch.delenv("STORAGE_BACKEND", raising=False)
+    monkeypatch.setattr(bot_logic, "_sheet_manager", None)
+    monkeypatch.setattr(bot_logic, "_tenant_registry", registry)
+    monkeypatch.setattr(bot_logic, "_user_throttle", throttle)
+    api = FakeLineBotApi()
+
+    # 超過頻率的指令在連線之前就被擋下：查詢沒有答案可回 (忽略)，報名請稍後再試
+    bot_logic.handle_text_message(make_text_event("?", user_id="U1"), api)
+    bot_logic.handle_text_message(make_text_event("+1", user_id="U1"), api)
+    assert created == []
+    assert [r[1][0] for r in api.replies] == [BUSY_REPLY]
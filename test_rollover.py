@@ -0,0 +1,104 @@
+import gspread
+import pytest
+
+import bot_logic
+from command_parser import CloseEvent, parse_command
+from fakes import FakeLineBotApi, api_error, make_sheet_manager, make_signup_spreadsheet, make_text_event
+from sqlite_backend import SQLiteBackend
+
+ROWS = [
+    ["U1", "Amy", 2, "正取", "2024-01-01 10:00:00", ""],
+    ["U2", "Bob", 1, "正取", "2024-01-01 10:01:00", ""],
+    ["U3", "Cat", 1, "候補", "2024-01-01 10:02:00", ""],
+]
+
+
+def make_manager():
+    spreadsheet = make_signup_spreadsheet(ROWS, max_people=3, title="週三羽球")
+    spreadsheet.worksheet("Stats").rows.extend([["U1", "Amy", "MVP"], ["U1", "Amy", "出席 3 次"]])
+    manager = make_sheet_manager(spreadsheet, "https://example.invalid/rollover")
+    return spreadsheet, manager
+
+
+def test_parse_close_event():
+    assert parse_command("#結算") == CloseEvent()
+    assert parse_command("今天的帳我來結算") is None
+
+
+def test_sheet_close_event_archives_rolls_stats_and_resets_in_one_write():
+    spreadsheet, manager = make_manager()
+    result = manager.close_event()
+    assert (result.title, result.archived, result.attended) == ("週三羽球", 3, 2)
+    assert spreadsheet.calls.count("batch_update") == 1
+
+    archive = spreadsheet.worksheet("Archive").rows
+    assert archive[0][:3] == ["活動", "結算時間", "User ID"]
+    assert [r[2] for r in archive[1:]] == ["U1", "U2", "U3"]
+    assert spreadsheet.worksheet("Stats").rows[1:] == [
+        ["U1", "Amy", "MVP"], ["U1", "Amy", "出席 4 次"], ["U2", "Bob", "出席 1 次"],
+    ]
+    assert spreadsheet.worksheet("Signups").rows == [spreadsheet.worksheet("Signups").rows[0]]
+    assert manager.query_stats(user_id="U2") == ["出席 1 次 (Bob)"]
+
+    # 下一場活動從空的名單開始，列號與 Sheet 一致
+    assert manager.add_signup("U4", "Dan", 1) == "已更新！ 1 人正取。"
+    assert spreadsheet.worksheet("Signups").rows[1][:4] == ["U4", "Dan", 1, "正取"]
+
+    # 第二次結算：封存分頁已存在，不再加標題列
+    manager.close_event()
+    archive = spreadsheet.worksheet("Archive").rows
+    assert [r[2] for r in archive[1:]] == ["U1", "U2", "U3", "U4"]
+
+
+def test_sqlite_close_event(tmp_path):
+    db = SQLiteBackend(str(tmp_path / "signups.db"), journal=True)
+    db.set_setting("人數上限", 1)
+    db.replace_stats([("U1", "Amy", "出席 3 次")])
+    db.add_signup("U1", "Amy", 1)
+    db.add_signup("U2", "Bob", 1)
+    assert db.query_stats(user_id="U1") == ["出席 3 次 (Amy)"]
+
+    result = db.close_event()
+    assert (result.archived, result.attended) == (2, 1)
+    assert db.get_entries() == []
+    assert db.query_stats(user_id="U1") == ["出席 4 次 (Amy)"]
+    assert db.query_stats(user_id="U2") == []
+    # 清空的列寫入 journal，SheetMirror 會同步刪除
+    assert [op for _, op, _ in db.read_journal(0)][-2:] == ["delete", "delete"]
+
+
+def test_close_event_command_requires_admin(monkeypatch):
+    spreadsheet, manager = make_manager()
+    monkeypatch.setattr(bot_logic, "_sheet_manager", manager)
+    monkeypatch.setattr(bot_logic, "_admin_user_ids", {"UADMIN"})
+    api = FakeLineBotApi()
+
+    bot_logic.handle_text_message(make_text_event("#結算", user_id="U1"), api)
+    assert api.replies == []
+    assert len(manager.roster) == 3
+
+    bot_logic.handle_text_message(make_text_event("#結算", user_id="UADMIN"), api)
+    assert "已結算「週三羽球」" in api.replies[0][1][0]
+    assert len(manager.roster) == 0
+
+
+def test_failed_close_event_keeps_archive_header_and_invalidates_roster():
+    spreadsheet, manager = make_manager()
+    # 建立封存分頁成功，但 batch_update 失敗
+    original = spreadsheet.batch_update
+
+    def failing_batch_update(body):
+        spreadsheet.batch_update = original
+        raise api_error(500, "backend error")
+
+    spreadsheet.batch_update = failing_batch_update
+    with pytest.raises(gspread.exceptions.APIError):
+        manager.close_event()
+    assert spreadsheet.worksheet("Archive").rows == []
+    assert manager.roster.loaded_at is None
+
+    # 重試時分頁已存在但仍是空的：照樣寫入標題列
+    manager.close_event()
+    archive = spreadsheet.worksheet("Archive").rows
+    assert archive[0][:3] == ["活動", "結算時間", "User ID"]
+    assert [r[2] for r in archive[1:]] == ["U1", "U2", "U3"]
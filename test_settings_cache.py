@@ -0,0 +1,67 @@
+import threading
+import time
+
+from fakes import make_sheet_manager, make_signup_spreadsheet
+
+
+def make_manager(settings_ttl):
+    spreadsheet = make_signup_spreadsheet(max_people=5)
+    manager = make_sheet_manager(spreadsheet, "https://example.invalid/settings", settings_ttl=settings_ttl)
+    manager.get_settings()
+    # 先取得 Setting 分頁 (測試中修改內容不計入 API 呼叫)
+    setting = spreadsheet.worksheet("Setting")
+    spreadsheet.reset_calls()
+    return manager, spreadsheet, setting
+
+
+def set_max_people(setting, value):
+    for row in setting.rows:
+        if row[0] == "人數上限":
+            row[1] = str(value)
+
+
+def test_settings_cached_until_ttl_expires():
+    manager, spreadsheet, setting = make_manager(settings_ttl=0.1)
+    set_max_people(setting, 8)
+
+    # TTL 內沿用快取，不讀取 Setting 分頁
+    assert manager.get_settings()["人數上限"] == "5"
+    assert spreadsheet.calls == []
+
+    time.sleep(0.12)
+    assert manager.get_settings()["人數上限"] == "8"
+    assert manager.get_settings()["人數上限"] == "8"
+    assert spreadsheet.calls == ["get_all_values"]
+
+
+def test_invalidate_settings_forces_reload():
+    manager, spreadsheet, setting = make_manager(settings_ttl=3600)
+    set_max_people(setting, 8)
+    assert manager.get_settings()["人數上限"] == "5"
+
+    manager.invalidate_settings()
+    assert manager.get_settings()["人數上限"] == "8"
+    assert spreadsheet.calls == ["get_all_values"]
+
+
+def test_request_snapshot_keeps_settings_consistent():
+    # TTL 為 0：範圍外每次都重新讀取
+    manager, spreadsheet, setting = make_manager(settings_ttl=0)
+    seen_by_other_thread = []
+
+    with manager.request_snapshot():
+        assert manager.get_settings()["人數上限"] == "5"
+        set_max_people(setting, 8)
+        # 同一個請求內 (包含巢狀範圍) 都是同一份設定，只讀取一次
+        assert manager.get_settings()["人數上限"] == "5"
+        with manager.request_snapshot():
+            assert manager.get_settings()["人數上限"] == "5"
+        assert spreadsheet.calls == ["get_all_values"]
+
+        # 其他執行緒 (其他請求) 不受這個範圍影響
+        t = threading.Thread(target=lambda: seen_by_other_thread.append(manager.get_settings()["人數上限"]))
+        t.start()
+        t.join()
+        assert seen_by_other_thread == ["8"]
+
+    assert manager.get_settings()["人數上限"] == "8"
@@ -0,0 +1,79 @@
+import multiprocessing
+
+from fakes import make_sheet_manager, make_signup_spreadsheet
+from shared_state import SharedState
+
+
+def _increment(path, counter_file, times):
+    state = SharedState(path)
+    for _ in range(times):
+        with state.lock("G1"):
+            with open(counter_file) as f:
+                value = int(f.read())
+            with open(counter_file, "w") as f:
+                f.write(str(value + 1))
+
+
+def test_lock_is_exclusive_across_processes(tmp_path):
+    path = str(tmp_path / "shared.db")
+    counter = tmp_path / "counter"
+    counter.write_text("0")
+    SharedState(path)
+
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=_increment, args=(path, str(counter), 50)) for _ in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    assert counter.read_text() == "200"
+
+
+def test_lock_is_reentrant_and_versions_increase(tmp_path):
+    state = SharedState(str(tmp_path / "shared.db"))
+    with state.lock("G1"):
+        with state.lock("G1"):
+            pass
+    assert state.get("k") == (0, None, 0.0)
+    assert state.put("k", {"a": 1}) == 1
+    assert state.put("k", {"a": 2}) == 2
+    version, value, _ = state.get("k")
+    assert (version, value, state.version("k")) == (2, {"a": 2}, 2)
+
+
+def make_worker(spreadsheet, state):
+    # 模擬另一個 worker：各自的 SheetManager / 記憶體名單
+    return make_sheet_manager(spreadsheet, "https://example.invalid/workers", shared_state=state,
+                              roster_resync_interval=0)
+
+
+def test_workers_share_roster_and_never_overbook(tmp_path):
+    state = SharedState(str(tmp_path / "shared.db"))
+    spreadsheet = make_signup_spreadsheet(max_people=3)
+    workers = [make_worker(spreadsheet, state), make_worker(spreadsheet, state)]
+    spreadsheet.reset_calls()
+
+    for i in range(6):
+        workers[i % 2].add_signup(f"U{i}", f"user{i}", 1)
+
+    # 另一個 worker 的變動由共用快取載入，不必重新讀取 Signups 分頁
+    assert spreadsheet.calls == ["batch_update"] * 6
+    rows = spreadsheet.worksheet("Signups").rows[1:]
+    assert sum(r[2] for r in rows if r[3] == "正取") == 3
+    assert sum(r[2] for r in rows if r[3] == "候補") == 3
+    # 兩個 worker 的名單摘要一致 (沒有過期的摘要)
+    assert workers[0].get_summary() == workers[1].get_summary()
+
+
+def test_settings_fetched_once_for_all_workers(tmp_path):
+    state = SharedState(str(tmp_path / "shared.db"))
+    spreadsheet = make_signup_spreadsheet(max_people=3)
+    first = make_worker(spreadsheet, state)
+    first.invalidate_settings()
+    first.get_settings()
+
+    spreadsheet.reset_calls()
+    second = make_worker(spreadsheet, state)
+    second.invalidate_settings()
+    assert second.get_settings()["人數上限"] == "3"
+    assert "get_all_values" not in spreadsheet.calls
@@ -0,0 +1,175 @@
+from fakes import FakeSpreadsheet, make_signup_spreadsheet
+from roster import SIGNUP_HEADERS
+from shared_state import FileLease
+from sheet_mirror import SheetMirror
+from sqlite_backend import SQLiteBackend
+
+
+def make_mirror(tmp_path, signups=()):
+    spreadsheet = make_signup_spreadsheet(signups, max_people=3, stats=[["U1", "小明", "出席 3 次"]])
+    backend = SQLiteBackend(str(tmp_path / "signups.db"), journal=True)
+    mirror = SheetMirror(backend, spreadsheet, edit_check_interval=3600, backoff_base=0)
+    return backend, mirror, spreadsheet
+
+
+def sheet_rows(spreadsheet):
+    rows = [[str(v) for v in r[:4]] for r in spreadsheet.worksheet("Signups").rows[1:]]
+    return [r for r in rows if any(r)]
+
+
+def test_journal_is_flushed_in_one_write(tmp_path):
+    backend, mirror, spreadsheet = make_mirror(tmp_path)
+    mirror.sync_once()
+    # Setting / Stats 分頁同步回 SQLite
+    assert backend.get_settings()["人數上限"] == "3"
+    assert backend.query_stats(user_id="U1") == ["出席 3 次 (小明)"]
+
+    spreadsheet.reset_calls()
+    for i in range(5):
+        backend.add_signup(f"U{i}", f"User{i}", 1)
+    backend.remove_signup("U0", 1)
+
+    assert mirror.sync_once() is True
+    assert spreadsheet.calls == ["values_batch_get", "values_update"]
+    assert sheet_rows(spreadsheet) == [
+        ["U1", "User1", "1", "正取"],
+        ["U2", "User2", "1", "正取"],
+        ["U3", "User3", "1", "正取"],
+        ["U4", "User4", "1", "候補"],
+    ]
+    assert backend.read_journal(0) == []
+
+    # 沒有新變動時不呼叫 API
+    spreadsheet.reset_calls()
+    assert mirror.sync_once() is False
+    assert spreadsheet.calls == []
+
+
+def test_manual_sheet_edits_are_merged_back(tmp_path):
+    backend, mirror, spreadsheet = make_mirror(tmp_path)
+    backend.add_signup("U1", "User1", 1)
+    backend.add_signup("U2", "User2", 1)
+    mirror.sync_once()
+
+    # 主辦人在 Sheet 上把 U1 改成 2 人，並刪掉 U2
+    rows = spreadsheet.worksheet("Signups").rows
+    rows[1][2] = 2
+    del rows[2]
+    backend.add_signup("U3", "User3", 1)
+    mirror.sync_once()
+
+    entries = [(e.user_id, e.count, e.status) for e in backend.get_entries()]
+    assert entries == [("U1", 2, "正取"), ("U3", 1, "正取")]
+    assert sheet_rows(spreadsheet) == [["U1", "User1", "2", "正取"], ["U3", "User3", "1", "正取"]]
+
+
+def test_existing_sheet_roster_is_imported_on_first_sync(tmp_path):
+    backend, mirror, spreadsheet = make_mirror(tmp_path, signups=[
+        ["U9", "既有用戶", 2, "正取", "2024-01-01 10:00:00", ""],
+    ])
+    mirror.sync_once()
+    assert [(e.user_id, e.count) for e in backend.get_entries()] == [("U9", 2)]
+
+
+def test_quota_errors_are_retried(tmp_path):
+    backend, mirror, spreadsheet = make_mirror(tmp_path)
+    mirror.sync_once()
+    backend.add_signup("U1", "User1", 1)
+
+    spreadsheet.fail_next(2, status_code=429)
+    assert mirror.sync_once() is True
+    assert mirror.retries == 2
+    assert sheet_rows(spreadsheet) == [["U1", "User1", "1", "正取"]]
+
+
+def test_close_event_is_written_to_archive_and_stats(tmp_path):
+    backend, mirror, spreadsheet = make_mirror(tmp_path)
+    mirror.sync_once()
+    backend.add_signup("U1", "小明", 1)
+    backend.add_signup("U2", "alice", 1)
+    backend.close_event()
+
+    # 重新啟動的鏡像第一次讀回 Stats 時，不會以 Sheet 上舊的內容蓋掉結算結果
+    mirror = SheetMirror(backend, spreadsheet, edit_check_interval=3600, backoff_base=0)
+    assert mirror.sync_once() is True
+    assert backend.query_stats(user_id="U2") == ["出席 1 次 (alice)"]
+    assert spreadsheet.worksheet("Stats").rows[1:] == [
+        ["U1", "小明", "出席 4 次"],
+        ["U2", "alice", "出席 1 次"],
+    ]
+    archive = spreadsheet.worksheet("Archive").rows
+    assert archive[0][2] == "User ID"
+    assert [r[2] for r in archive[1:]] == ["U1", "U2"]
+    assert sheet_rows(spreadsheet) == []
+    assert backend.read_outbox() == []
+
+    # 之後在 Sheet 上修改 Stats 照常合併回 SQLite
+    spreadsheet.worksheet("Stats").rows[2][2] = "出席 2 次"
+    backend.add_signup("U3", "User3", 1)
+    mirror.sync_once()
+    assert backend.query_stats(user_id="U2") == ["出席 2 次 (alice)"]
+
+
+def test_only_one_mirror_syncs_a_shared_database(tmp_path):
+    # 兩個 worker (各自的連線與鏡像) 共用同一個資料庫與租約
+    path = str(tmp_path / "signups.db")
+    spreadsheet = make_signup_spreadsheet(max_people=3)
+    backend1 = SQLiteBackend(path, journal=True)
+    backend2 = SQLiteBackend(path, journal=True)
+    lease_path = str(tmp_path / "signups.db.mirror.lock")
+    mirror1 = SheetMirror(backend1, spreadsheet, edit_check_interval=3600, backoff_base=0, lease=FileLease(lease_path))
+    mirror2 = SheetMirror(backend2, spreadsheet, edit_check_interval=3600, backoff_base=0, lease=FileLease(lease_path))
+
+    backend1.add_signup("U1", "User1", 1)
+    assert mirror1.sync_once() is True
+    backend2.add_signup("U2", "User2", 1)
+    backend2.remove_signup("U1", 1)
+
+    spreadsheet.reset_calls()
+    assert mirror2.sync_once() is False
+    assert spreadsheet.calls == []
+    mirror1.sync_once()
+
+    # 取消的報名不會被另一個鏡像寫回來
+    assert [e.user_id for e in backend1.get_entries()] == ["U2"]
+    assert sheet_rows(spreadsheet) == [["U2", "User2", "1", "正取"]]
+
+    # 持有者停止後，另一個 worker 從 SQLite 的最新狀態接手
+    mirror1.stop()
+    backend2.add_signup("U3", "User3", 1)
+    assert mirror2.sync_once() is True
+    assert [r[0] for r in sheet_rows(spreadsheet)] == ["U2", "U3"]
+    assert [e.user_id for e in backend2.get_entries()] == ["U2", "U3"]
+
+
+def test_local_changes_win_over_stale_sheet_rows(tmp_path):
+    backend, mirror, spreadsheet = make_mirror(tmp_path)
+    backend.add_signup("U1", "User1", 1)
+    mirror.sync_once()
+
+    # 主辦人改了 U1 的人數，但 U1 在下一輪同步前已經取消
+    spreadsheet.worksheet("Signups").rows[1][2] = 2
+    backend.remove_signup("U1", 1)
+    mirror.sync_once()
+
+    assert backend.get_entries() == []
+    assert sheet_rows(spreadsheet) == []
+
+
+def test_missing_worksheets_are_created_before_the_first_sync(tmp_path):
+    spreadsheet = FakeSpreadsheet({})
+    backend = SQLiteBackend(str(tmp_path / "signups.db"), journal=True)
+    backend.replace_stats([("U1", "小明", "出席 3 次")])
+    backend.add_signup("U1", "小明", 1)
+    mirror = SheetMirror(backend, spreadsheet, edit_check_interval=3600, backoff_base=0)
+
+    assert mirror.sync_once() is True
+    # 沒有 Signups 分頁時與 SheetManager 一樣使用第一個分頁
+    assert [r[:4] for r in spreadsheet.worksheet("Sheet1").rows] == [
+        SIGNUP_HEADERS[:4], ["U1", "小明", "1", "正取"],
+    ]
+    assert spreadsheet.worksheet("Setting").rows[0] == ["項目", "內容"]
+    assert backend.get_settings()["人數上限"] == "10"
+    assert spreadsheet.worksheet("Stats").rows == [["User ID", "Name", "Description"], ["U1", "小明", "出席 3 次"]]
+    assert backend.query_stats(user_id="U1") == ["出席 3 次 (小明)"]
+    assert backend.read_journal(0) == []
@@ -0,0 +1,64 @@
+import datetime
+import threading
+
+from sheets_auth import TokenRefresher, build_session
+
+
+class FakeCredentials:
+    """模擬 google-auth credentials：每次 refresh 取得有效 lifetime 秒的新 token"""
+
+    def __init__(self, lifetime, expires_in=None):
+        self.lifetime = lifetime
+        self.token = "initial" if expires_in is not None else None
+        self.expiry = self._from_now(expires_in) if expires_in is not None else None
+        self.refreshed = threading.Event()
+        self.count = 0
+
+    def _from_now(self, seconds):
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return now + datetime.timedelta(seconds=seconds)
+
+    def refresh(self, request):
+        self.count += 1
+        self.token = f"token-{self.count}"
+        self.expiry = self._from_now(self.lifetime)
+        self.refreshed.set()
+
+
+def test_refreshes_in_background_before_expiry():
+    # token 還有 600.2 秒到期，margin 600 秒 -> 約 0.2 秒後在背景更新
+    credentials = FakeCredentials(lifetime=3600, expires_in=600.2)
+    refresher = TokenRefresher(credentials, margin=600, request=object())
+    assert 0 < refresher.seconds_until_refresh() <= 0.2
+
+    refresher.start()
+    try:
+        assert credentials.refreshed.wait(2)
+        # 新的 token 要到 (3600 - 600) 秒後才需要再更新
+        assert refresher.seconds_until_refresh() > 2900
+    finally:
+        refresher.stop()
+    assert credentials.count == 1 and refresher.refreshes == 1
+
+
+def test_first_token_is_fetched_immediately():
+    credentials = FakeCredentials(lifetime=3600)
+    refresher = TokenRefresher(credentials, request=object())
+    assert refresher.seconds_until_refresh() == 0
+    assert refresher.refresh() and credentials.token == "token-1"
+
+
+def test_failed_refresh_is_counted():
+    class Broken(FakeCredentials):
+        def refresh(self, request):
+            raise OSError("network down")
+
+    refresher = TokenRefresher(Broken(lifetime=3600), request=object())
+    assert not refresher.refresh()
+    assert refresher.failures == 1
+
+
+def test_session_pool_size():
+    session = build_session(FakeCredentials(lifetime=3600, expires_in=3600), pool_size=25)
+    adapter = session.get_adapter("https://sheets.googleapis.com/v4/spreadsheets")
+    assert adapter._pool_maxsize == 25
@@ -0,0 +1,89 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fakes import make_sheet_manager, make_signup_spreadsheet
+from signup_batcher import SignupBatcher
+
+
+def make_manager(max_people=10):
+    spreadsheet = make_signup_spreadsheet(max_people=max_people, title="批次測試")
+    manager = make_sheet_manager(spreadsheet, "https://example.invalid/batch")
+    return manager, spreadsheet
+
+
+def test_burst_is_written_once_with_one_summary():
+    manager, spreadsheet = make_manager(max_people=10)
+    batcher = SignupBatcher(window=0.2)
+    results = {}
+    summary_calls = []
+    original_summary = manager.get_summary
+
+    def counting_summary():
+        summary_calls.append(1)
+        return original_summary()
+
+    manager.get_summary = counting_summary
+
+    def signup(i):
+        results[i] = batcher.submit(manager, f"U{i}", f"User{i}", 1)
+
+    threads = [threading.Thread(target=signup, args=(i,)) for i in range(12)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert spreadsheet.calls == ["batch_update"]
+    assert len(summary_calls) == 1
+    assert batcher.batches == 1 and batcher.commands == 12
+
+    messages = [msg for msg, _ in results.values()]
+    assert messages.count("已更新！ 1 人正取。") == 10
+    assert messages.count("已更新！ 1 人排入候補。") == 2
+    assert len({summary for _, summary in results.values()}) == 1
+
+
+def test_cancel_in_batch_promotes_waitlist_before_later_signups():
+    manager, spreadsheet = make_manager(max_people=1)
+    manager.add_signup("A", "A", 1)
+    manager.add_signup("B", "B", 1)
+
+    # 同一批中 A 取消後，空出的名額應先給候補的 B，而不是之後才報名的 C
+    messages = manager.apply_signups([("A", "", -1), ("C", "C", 1)])
+
+    assert messages == ["已取消您的所有報名。", "已更新！ 1 人排入候補。"]
+    rows = [r[:4] for r in spreadsheet.worksheet("Signups").rows[1:]]
+    assert rows == [["B", "B", 1, "正取"], ["C", "C", 1, "候補"]]
+
+
+def test_lone_signup_does_not_wait_for_the_whole_window():
+    manager, spreadsheet = make_manager(max_people=10)
+    batcher = SignupBatcher(window=1.0)
+
+    started = time.monotonic()
+    message, _ = batcher.submit(manager, "U1", "User1", 1)
+
+    # 沒有其他指令加入：idle (window 的 1/4) 後就送出
+    assert time.monotonic() - started < 0.5
+    assert message == "已更新！ 1 人正取。"
+    assert spreadsheet.calls == ["batch_update"]
+
+
+def test_callback_submitters_do_not_hold_worker_threads():
+    manager, spreadsheet = make_manager(max_people=10)
+    batcher = SignupBatcher(window=0.3, idle=0.3)
+    replies = []
+
+    def reply(msg, summary, error):
+        replies.append((msg, error))
+
+    # 只有送出批次的執行緒等待視窗，其他指令加入後立即返回：批次大小不受 worker 數限制
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        for i in range(12):
+            pool.submit(batcher.submit, manager, f"U{i}", f"User{i}", 1, reply)
+
+    assert spreadsheet.calls == ["batch_update"]
+    assert batcher.batches == 1 and batcher.commands == 12
+    assert len(replies) == 12
+    assert all(error is None for _, error in replies)
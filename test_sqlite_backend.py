@@ -0,0 +1,61 @@
+import random
+import threading
+
+from fakes import make_sheet_manager, make_signup_spreadsheet
+from sqlite_backend import SQLiteBackend
+from storage import DEFAULT_SETTINGS
+
+
+def make_parity_manager(max_people):
+    # 標題與說明同 SQLite 的預設設定，兩邊的名單文字才能直接比較
+    spreadsheet = make_signup_spreadsheet(max_people=max_people, title=DEFAULT_SETTINGS["活動標題"],
+                                          description=DEFAULT_SETTINGS["活動說明"])
+    return make_sheet_manager(spreadsheet, "https://example.invalid/parity")
+
+
+def test_sqlite_matches_sheets_backend(tmp_path):
+    sheets = make_parity_manager(max_people=6)
+    db = SQLiteBackend(str(tmp_path / "signups.db"))
+    db.set_setting("人數上限", 6)
+
+    rng = random.Random(7)
+    for _ in range(300):
+        user = f"U{rng.randint(0, 8)}"
+        n = rng.randint(1, 3)
+        if rng.random() < 0.55:
+            assert db.add_signup(user, user, n) == sheets.add_signup(user, user, n)
+        else:
+            assert db.remove_signup(user, n) == sheets.remove_signup(user, n)
+
+    assert db.get_summary() == sheets.get_summary()
+    assert db.api_calls.total == 0
+
+
+def test_sqlite_concurrent_signups_respect_capacity(tmp_path):
+    db = SQLiteBackend(str(tmp_path / "signups.db"))
+    db.set_setting("人數上限", 5)
+
+    def signup(i):
+        db.add_signup(f"U{i}", f"User{i}", 1)
+
+    threads = [threading.Thread(target=signup, args=(i,)) for i in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    entries = db.get_entries()
+    assert sum(e.count for e in entries if e.status == "正取") == 5
+    assert sum(e.count for e in entries if e.status == "候補") == 15
+
+
+def test_sqlite_stats_queries(tmp_path):
+    db = SQLiteBackend(str(tmp_path / "signups.db"))
+    assert db.get_all_stats() == "尚無資料"
+
+    db.replace_stats([("U1", "小明", "出席 3 次"), ("U2", "小華", "出席 1 次")])
+
+    assert db.query_stats(user_id="U1") == ["出席 3 次 (小明)"]
+    assert db.query_stats(name="小華") == ["出席 1 次 (小華)"]
+    assert db.query_stats(name="不存在") == []
+    assert db.get_all_stats() == "📊 統計資料一覽:\n小明: 出席 3 次\n小華: 出席 1 次"
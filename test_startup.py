@@ -0,0 +1,82 @@
+import time
+
+import pytest
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from fakes import FakeClient, FakeSpreadsheet, make_sheet_manager, make_signup_spreadsheet
+from storage import DEFAULT_SETTINGS
+from tenants import Tenant, TenantRegistry
+
+
+def test_new_spreadsheet_is_seeded_in_one_write():
+    spreadsheet = FakeSpreadsheet({})
+    manager = make_sheet_manager(spreadsheet, "https://example.invalid/new", reset_calls=False)
+
+    # 不逐一試探分頁；預設設定一次寫入
+    assert spreadsheet.calls.count('worksheets') == 1
+    assert 'worksheet' not in spreadsheet.calls
+    assert spreadsheet.calls.count('append_rows') == 1
+    assert spreadsheet.worksheet("Setting").rows == [["項目", "內容"]] + [[k, v] for k, v in DEFAULT_SETTINGS.items()]
+    assert manager.get_settings()["人數上限"] == "10"
+
+
+def test_missing_defaults_are_appended_together():
+    spreadsheet = make_signup_spreadsheet()
+    setting = spreadsheet.worksheet("Setting")
+    setting.rows = [r for r in setting.rows if r[0] not in ("報名功能", "查詢功能")]
+    make_sheet_manager(spreadsheet, "https://example.invalid/partial", reset_calls=False)
+
+    assert spreadsheet.calls.count('append_rows') == 1
+    assert setting.rows[-2:] == [["報名功能", "TRUE"], ["查詢功能", "TRUE"]]
+
+
+def test_breaker_backs_off_exponentially():
+    breaker = CircuitBreaker(base_delay=1.0, max_delay=5.0, jitter=0)
+    assert breaker.allow()
+    assert breaker.record_failure() == 1.0
+    assert not breaker.allow()
+    breaker.opened_until = 0                # 時間到，只放行一個嘗試
+    assert breaker.allow() and not breaker.allow()
+    assert breaker.record_failure() == 2.0
+    breaker.failures = 10
+    assert breaker.record_failure() == 5.0
+    breaker.record_success()
+    assert breaker.allow() and breaker.state == "closed"
+
+
+def test_failed_connect_is_not_retried_on_every_message():
+    attempts = []
+    spreadsheet = make_signup_spreadsheet()
+
+    def factory(tenant, client):
+        attempts.append(tenant)
+        if len(attempts) == 1:
+            raise ConnectionError("Sheets down")
+        return make_sheet_manager(url=tenant.spreadsheet_url, client=client, reset_calls=False)
+
+    registry = TenantRegistry(factory, default=Tenant("https://example.invalid/down"),
+                              client_factory=lambda: FakeClient(spreadsheet), backoff_base=0.05)
+    with pytest.raises(ConnectionError):
+        registry.get("G1")
+    for _ in range(5):
+        with pytest.raises(CircuitOpenError):
+            registry.get("G1")
+    assert len(attempts) == 1
+
+    time.sleep(0.08)
+    assert registry.get("G1") is not None
+    assert len(attempts) == 2
+
+
+def test_warm_up_connects_in_background():
+    spreadsheet = make_signup_spreadsheet()
+    registry = TenantRegistry(
+        lambda tenant, client: make_sheet_manager(url=tenant.spreadsheet_url, client=client, reset_calls=False),
+        default=Tenant("https://example.invalid/warm"),
+        client_factory=lambda: FakeClient(spreadsheet),
+    )
+    registry.warm_up().join()
+    spreadsheet.reset_calls()
+
+    registry.get("G1").get_summary()
+    assert spreadsheet.calls == []
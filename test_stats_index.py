@@ -0,0 +1,45 @@
+from fakes import make_sheet_manager, make_signup_spreadsheet
+from stats_index import StatsIndex
+
+ROWS = [
+    ("U1", "王小明", "出席 3 次"),
+    ("U2", "Amy Chen", "出席 5 次"),
+    ("U3", "王大明", "出席 1 次"),
+    ("U1", "王小明", "MVP"),
+]
+
+
+def test_lookup_by_user_id_and_name():
+    index = StatsIndex(ROWS)
+    assert index.query(user_id="U1") == ["出席 3 次 (王小明)", "MVP (王小明)"]
+    assert index.query(name="王小明") == ["出席 3 次 (王小明)", "MVP (王小明)"]
+    assert index.query(user_id="U9") == []
+
+
+def test_normalized_and_prefix_name_matching():
+    index = StatsIndex(ROWS)
+    # 忽略大小寫、空白與全形
+    assert index.query(name="ａｍｙ chen") == ["出席 5 次 (Amy Chen)"]
+    assert index.query(name="amy") == ["出席 5 次 (Amy Chen)"]
+    # 前綴比對，依原本順序回傳
+    assert index.query(name="王") == ["出席 3 次 (王小明)", "出席 1 次 (王大明)", "MVP (王小明)"]
+    assert index.query(name="李") == []
+
+
+def test_sheet_stats_reloaded_only_after_ttl_and_text_cached_per_version():
+    spreadsheet = make_signup_spreadsheet(stats=ROWS)
+    manager = make_sheet_manager(spreadsheet, "https://example.invalid/stats", stats_ttl=3600)
+
+    text = manager.get_all_stats()
+    assert manager.get_all_stats() is text
+    assert manager.query_stats(name="王小明") == ["出席 3 次 (王小明)", "MVP (王小明)"]
+    assert spreadsheet.calls == ["get_lastUpdateTime", "get"]
+
+    # 內容沒變：重新下載後沿用同一個版本與文字
+    manager.invalidate_stats()
+    assert manager.get_all_stats() is text
+
+    spreadsheet.worksheet("Stats").rows.append(["U4", "林志玲", "新成員"])
+    manager.invalidate_stats()
+    assert manager.get_all_stats().endswith("林志玲: 新成員")
+    assert manager._stats_index.version == 2
@@ -0,0 +1,78 @@
+import bot_logic
+from fakes import FakeLineBotApi, make_text_event
+from roster import RosterEntry
+from summary import SummaryRenderer, format_summary
+from test_promotion import make_manager
+
+SETTINGS = {"活動標題": "週末羽球", "活動說明": "", "人數上限": "2"}
+
+
+def test_format_matches_original_layout():
+    entries = [RosterEntry("A", "小明", 2, "正取"), RosterEntry("B", "小華", 1, "候補")]
+    assert format_summary(SETTINGS, entries) == "\n".join([
+        "🎉 週末羽球",
+        "----------------",
+        "1. 小明 (+2) ✅正取",
+        "2. 小華 (+1) ⏳候補",
+        "----------------",
+        "目前正取人數: 2 / 上限 2",
+    ])
+
+
+def test_query_reuses_text_and_mutation_rerenders_changed_lines_only():
+    manager, spreadsheet = make_manager([
+        [f"U{i}", f"user{i}", 1, "正取", f"2024-01-01 10:{i:02d}:00", ""] for i in range(4)
+    ], max_people=10)
+    renderer = manager.summary_renderer
+
+    first = manager.get_summary()
+    assert renderer.lines_rendered == 4
+    assert manager.get_summary() is first
+    assert renderer.hits == 1
+    assert spreadsheet.calls == []
+
+    manager.add_signup("U9", "newbie", 2)
+    text = manager.get_summary()
+    assert "5. newbie (+2) ✅正取" in text
+    # 只有新的一列需要排版
+    assert renderer.lines_rendered == 5
+
+
+def test_long_roster_is_truncated_within_limit():
+    entries = [RosterEntry(f"U{i}", "名" * 40, 1, "正取") for i in range(300)]
+    full = format_summary(SETTINGS, entries)
+    assert len(full) > 5000
+
+    text = SummaryRenderer().render(SETTINGS, entries)
+    assert len(text) <= 5000
+    assert "筆未顯示" in text
+    assert text.endswith("目前正取人數: 300 / 上限 2")
+    shown = text.count("(+1)")
+    assert f"…還有 {300 - shown} 筆未顯示" in text
+
+
+def test_pagination():
+    entries = [RosterEntry(f"U{i}", f"user{i}", 1, "候補") for i in range(25)]
+    renderer = SummaryRenderer(page_size=10)
+    page3 = renderer.render(SETTINGS, entries, version=1, page=3)
+    assert "21. user20" in page3 and "20. user19" not in page3
+    assert "第 3 / 3 頁" in page3
+    assert "第 1 / 3 頁 (輸入 ?2 看下一頁)" in renderer.render(SETTINGS, entries, version=1)
+    # 超出範圍的頁數顯示最後一頁
+    assert renderer.render(SETTINGS, entries, version=1, page=9).count("(+1)") == 5
+
+
+def test_page_command_replies_with_requested_page(monkeypatch):
+    monkeypatch.setenv("SUMMARY_PAGE_SIZE", "10")
+    manager, spreadsheet = make_manager([
+        [f"U{i}", f"user{i}", 1, "候補", f"2024-01-01 10:{i:02d}:00", ""] for i in range(25)
+    ], max_people=10)
+    monkeypatch.setattr(bot_logic, "_sheet_manager", manager)
+    api = FakeLineBotApi()
+
+    bot_logic.handle_text_message(make_text_event("?"), api)
+    bot_logic.handle_text_message(make_text_event("?2"), api)
+    first, second = api.replies[0][1][0], api.replies[1][1][0]
+    assert "1. user0" in first and "第 1 / 3 頁" in first
+    assert "11. user10" in second and "10. user9" not in second
+    assert "第 2 / 3 頁 (輸入 ?3 看下一頁)" in second
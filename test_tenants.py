@@ -0,0 +1,120 @@
+import json
+import threading
+import time
+
+import bot_logic
+import sheets_api
+from fakes import FakeClient, FakeLineBotApi, make_sheet_manager, make_signup_spreadsheet, make_text_event
+from group_locks import KeyedLocks
+from tenants import Tenant, TenantRegistry, load_tenants
+
+URL = "https://example.invalid/shared"
+
+
+def make_registry(tenants, **kwargs):
+    spreadsheet = make_signup_spreadsheet(max_people=5)
+    clients = []
+
+    def client_factory():
+        clients.append(FakeClient(spreadsheet))
+        return clients[-1]
+
+    def factory(tenant, client):
+        return make_sheet_manager(
+            url=tenant.spreadsheet_url, client=client, reset_calls=False,
+            signups_title=tenant.signups_title, setting_title=tenant.setting_title, stats_title=tenant.stats_title,
+        )
+
+    registry = TenantRegistry(factory, tenants=tenants, client_factory=client_factory, **kwargs)
+    return registry, spreadsheet, clients
+
+
+def test_groups_get_their_own_event_and_share_one_client(monkeypatch):
+    registry, spreadsheet, clients = make_registry({
+        "G1": Tenant(URL, "Signups-G1", "Setting-G1", "Stats-G1"),
+        "G2": Tenant(URL, "Signups-G2", "Setting-G2", "Stats-G2"),
+        "G3": Tenant(URL, "Signups-G1", "Setting-G1", "Stats-G1"),  # 與 G1 同一個活動
+    })
+    monkeypatch.setenv("GOOGLE_SHEETS_CREDENTIALS_FILE", "unused.json")
+    monkeypatch.setattr(bot_logic, "_sheet_manager", None)
+    monkeypatch.setattr(bot_logic, "_tenant_registry", registry)
+    api = FakeLineBotApi()
+
+    bot_logic.handle_text_message(make_text_event("+2", user_id="U1", group_id="G1"), api)
+    bot_logic.handle_text_message(make_text_event("+1", user_id="U2", group_id="G2"), api)
+    bot_logic.handle_text_message(make_text_event("+1", user_id="U3", group_id="G3"), api)
+    # 沒有對應 (也沒有預設活動) 的群組回覆系統錯誤
+    bot_logic.handle_text_message(make_text_event("+1", user_id="U4", group_id="G9"), api)
+
+    g1 = [r[:3] for r in spreadsheet.worksheet("Signups-G1").rows[1:]]
+    g2 = [r[:3] for r in spreadsheet.worksheet("Signups-G2").rows[1:]]
+    assert g1 == [["U1", "name-U1", 2], ["U3", "name-U3", 1]]
+    assert g2 == [["U2", "name-U2", 1]]
+    assert len(clients) == 1
+    assert registry.stats()["active"] == 2
+    assert "系統錯誤" in api.replies[-1][1][0]
+
+
+def test_lru_and_idle_eviction():
+    tenants = {f"G{i}": Tenant(URL, f"Signups-{i}") for i in range(3)}
+    registry, _, _ = make_registry(tenants, max_active=2)
+
+    first = registry.get("G0")
+    registry.get("G1")
+    assert registry.get("G0") is first
+    registry.get("G2")                      # G1 最久沒用到，被釋放
+    assert registry.active() == [f"{URL}#Signups-0", f"{URL}#Signups-2"]
+    assert registry.stats()["evicted"] == 1
+
+    registry.idle_ttl = 0.01
+    time.sleep(0.02)
+    registry.evict_idle()
+    assert registry.active() == []
+    assert registry.get("G0") is not first  # 重新建立
+
+
+def test_concurrent_first_use_creates_one_manager():
+    registry, _, _ = make_registry({"G1": Tenant(URL, "Signups-G1")})
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get("G1"))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len({id(m) for m in results}) == 1
+    assert registry.stats()["created"] == 1
+
+
+def test_load_tenants(tmp_path):
+    path = tmp_path / "tenants.json"
+    path.write_text(json.dumps({
+        "G1": URL,
+        "G2": {"spreadsheet_url": URL, "worksheet": "週五場", "setting_worksheet": "週五場設定"},
+    }), encoding="utf-8")
+    tenants = load_tenants(path)
+    assert tenants["G1"] == Tenant(URL)
+    assert tenants["G2"] == Tenant(URL, "週五場", "週五場設定", "Stats")
+
+
+def test_evicted_tenants_release_breakers_and_locks():
+    tenants = {f"G{i}": Tenant(f"{URL}/{i}") for i in range(3)}
+    registry, _, _ = make_registry(tenants, max_active=1)
+    for i in range(3):
+        registry.get(f"G{i}")
+
+    # 只留下最後一個活動的斷路器、建立鎖與試算表的變動鎖
+    assert registry.active() == [f"{URL}/2#Signups"]
+    assert list(registry._breakers) == [f"{URL}/2#Signups"]
+    assert len(registry._creating) == 1
+    assert f"{URL}/0" not in sheets_api._mutation_locks._locks
+    assert f"{URL}/2" in sheets_api._mutation_locks._locks
+
+
+def test_discard_keeps_locks_that_are_held():
+    locks = KeyedLocks()
+    with locks.hold("A"):
+        held = locks.get("A")
+        locks.discard("A")
+        assert locks.get("A") is held
+    locks.discard("A")
+    assert len(locks) == 0
@@ -0,0 +1,91 @@
+import threading
+import time
+
+import bot_logic
+from fakes import FakeLineBotApi, make_sheet_manager, make_signup_spreadsheet, make_text_event, make_webhook_body, sign_body
+from work_queue import EventWorkQueue
+
+
+def test_full_queue_falls_back_to_inline_processing(app_module, monkeypatch):
+    manager = make_sheet_manager(make_signup_spreadsheet(), "https://example.invalid/queue")
+    api = FakeLineBotApi()
+    monkeypatch.setattr(bot_logic, "_sheet_manager", manager)
+    monkeypatch.setattr(app_module, "line_bot_api", api)
+    # 沒有 worker 的佇列：放滿一個事件後，之後的事件在 callback 內同步處理
+    queue = EventWorkQueue(app_module.dispatch_event, workers=1, maxsize=1)
+    monkeypatch.setattr(app_module, "work_queue", queue)
+    client = app_module.app.test_client()
+
+    for i, text in enumerate(["+1", "+2"]):
+        body = make_webhook_body(text, user_id=f"U{i}", event_id=f"queue-full-{i}-{time.monotonic_ns()}")
+        assert client.post("/callback", data=body, headers={"X-Line-Signature": sign_body(body)}).status_code == 200
+
+    assert queue.stats()["queue_depth"] == 1
+    assert queue.rejected == 1
+    assert [e.user_id for e in manager.roster.snapshot()] == ["U1"]
+    assert len(api.replies) == 1
+
+
+def test_stats_report_latency_and_utilization():
+    gate = threading.Event()
+
+    def slow(event):
+        gate.wait(1)
+        time.sleep(0.05)
+
+    queue = EventWorkQueue(slow, workers=2, maxsize=10)
+    queue.start()
+    for i in range(4):
+        assert queue.submit(i)
+    time.sleep(0.05)
+    busy = queue.stats()
+    assert (busy["busy_workers"], busy["queue_depth"]) == (2, 2)
+    gate.set()
+    queue.join()
+
+    stats = queue.stats()
+    assert (stats["processed"], stats["failed"], stats["rejected"]) == (4, 0, 0)
+    assert stats["busy_workers"] == 0
+    # 後兩個事件要等前兩個處理完
+    assert stats["latency_p99_ms"] >= 100
+    assert stats["wait_p50_ms"] > 0
+    assert 0 < stats["utilization"] <= 1
+
+
+def test_late_events_are_answered_by_push(app_module, monkeypatch):
+    manager = make_sheet_manager(make_signup_spreadsheet(), "https://example.invalid/late")
+    api = FakeLineBotApi()
+    monkeypatch.setattr(bot_logic, "_sheet_manager", manager)
+    monkeypatch.setattr(app_module, "line_bot_api", api)
+    queue = EventWorkQueue(app_module.dispatch_event, workers=1,
+                           late_func=app_module.dispatch_late_event, reply_token_ttl=0.05)
+
+    # 排隊超過 reply token 有效時間才開始處理：改以 push message 回覆到群組
+    assert queue.submit(make_text_event("+1", user_id="U1", group_id="G1"))
+    time.sleep(0.1)
+    queue.start()
+    queue.join()
+
+    assert queue.stats()["late_replies"] == 1
+    assert "reply_message" not in api.calls
+    assert [to for to, _ in api.pushes] == ["G1"]
+    assert [e.user_id for e in manager.roster.snapshot()] == ["U1"]
+
+
+def test_handler_exception_does_not_kill_worker():
+    handled = []
+
+    def process(event):
+        if event == "bad":
+            raise RuntimeError("boom")
+        handled.append(event)
+
+    queue = EventWorkQueue(process, workers=1)
+    queue.start()
+    for event in ["a", "bad", "b"]:
+        queue.submit(event)
+    queue.join()
+
+    assert handled == ["a", "b"]
+    stats = queue.stats()
+    assert (stats["processed"], stats["failed"]) == (3, 1)